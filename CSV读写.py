@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+各脚本共用的编码检测和CSV读写
+- 编码检测：BOM优先；没有BOM时只对文件开头的一段样本运行chardet，并确认样本能按该编码严格解码
+- 检测结果按 (路径, 大小, 修改时间) 缓存在内存和 Index_Cache/encoding_cache.json 中，文件没变时不再检测
+- 读取只解析一次：先确定编码再调用 pd.read_csv，不再按编码列表反复重试整个文件；
+  样本之后才出现无法解码的字节时，重新检测编码并更新缓存，只重试一次
+- 安装了 pyarrow 时 read_dataframe 可以使用更快的 pyarrow 解析引擎（不支持的参数自动退回C引擎）
+- 按内存预算分块读取（read_batches），Csv_All 和 Csv_true 共用
+"""
+
+import os
+import csv
+import json
+import codecs
+import itertools
+import threading
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# 编码检测依赖 chardet，各脚本导入本模块时检查
+try:
+    import chardet
+except ImportError as e:
+    raise ImportError("缺少必要的模块 chardet，请运行以下命令安装: pip install chardet") from e
+
+# 编码检测只读取文件开头的这么多字节
+ENCODING_SAMPLE_SIZE = 256 * 1024
+
+# 样本检测结果 -> 兼容整个文件的编码（样本之外可能出现样本里没有的字符）
+SAMPLE_ENCODING_SUPERSETS = {
+    'ascii': 'utf-8',
+    'gb2312': 'gb18030',
+    'gbk': 'gb18030',
+}
+
+# 检测结果无法严格解码样本时依次尝试的编码（以ASCII为主的文件常被误判）
+FALLBACK_ENCODINGS = ('utf-8', 'gb18030')
+
+# 编码检测结果的持久缓存（与文件索引放在同一个文件夹）
+DEFAULT_CACHE_PATH = Path(__file__).resolve().parent / "Index_Cache" / "encoding_cache.json"
+CACHE_MAX_ENTRIES = 1024
+
+# 读取CSV的默认内存预算（MB），估算占用超过预算的文件分块读取
+DEFAULT_MEMORY_BUDGET_MB = 1024
+# CSV的每个字节读入DataFrame并处理时大约占用的内存（字节）
+MEMORY_PER_CSV_BYTE = 12
+# 估算每行字节数时读取的样本大小
+ROW_SIZE_SAMPLE_BYTES = 1024 * 1024
+MIN_CHUNK_ROWS = 1000
+
+_cache_lock = threading.Lock()
+_cache: Optional[Dict[str, list]] = None  # 路径键 -> [大小, mtime_ns, 编码]
+
+
+def _cache_key(file_path: str) -> str:
+    return os.path.normcase(os.path.abspath(file_path))
+
+
+def _load_cache() -> Dict[str, list]:
+    global _cache
+    if _cache is None:
+        try:
+            with open(DEFAULT_CACHE_PATH, 'r', encoding='utf-8') as f:
+                _cache = json.load(f)
+        except (OSError, ValueError):
+            _cache = {}
+    return _cache
+
+
+def _save_cache(cache: Dict[str, list]):
+    # 缓存只是加速，写入失败（只读目录等）时忽略
+    try:
+        DEFAULT_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = DEFAULT_CACHE_PATH.with_name(f"{DEFAULT_CACHE_PATH.name}.{os.getpid()}.part")
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, ensure_ascii=False)
+        os.replace(temp_path, DEFAULT_CACHE_PATH)
+    except OSError:
+        pass
+
+
+def detect_encoding_uncached(file_path: str) -> str:
+    """BOM优先；没有BOM时只对文件开头的一段样本运行chardet，不读入整个文件"""
+    with open(file_path, 'rb') as f:
+        raw_data = f.read(ENCODING_SAMPLE_SIZE)
+
+    if raw_data.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    elif raw_data.startswith(codecs.BOM_UTF32_LE) or raw_data.startswith(codecs.BOM_UTF32_BE):
+        # UTF-32-LE 的BOM以 UTF-16-LE 的BOM开头，必须先判断
+        return 'utf-32'
+    elif raw_data.startswith(codecs.BOM_UTF16_LE) or raw_data.startswith(codecs.BOM_UTF16_BE):
+        # 'utf-16' 会按BOM判断字节序并去掉BOM
+        return 'utf-16'
+
+    # 截断到最后一个换行，避免样本末尾切断多字节字符影响判断
+    if len(raw_data) == ENCODING_SAMPLE_SIZE and b'\n' in raw_data:
+        raw_data = raw_data[:raw_data.rfind(b'\n') + 1]
+
+    encoding = (chardet.detect(raw_data).get('encoding') or 'utf-8').lower()
+    encoding = SAMPLE_ENCODING_SUPERSETS.get(encoding, encoding)
+
+    for candidate in (encoding,) + FALLBACK_ENCODINGS:
+        try:
+            codecs.getincrementaldecoder(candidate)().decode(raw_data, final=False)
+        except (UnicodeDecodeError, LookupError):
+            continue
+        return candidate
+    return encoding
+
+
+def _store_cached_encoding(file_path: str, encoding: str):
+    stat = os.stat(file_path)
+    key = _cache_key(file_path)
+    with _cache_lock:
+        cache = _load_cache()
+        cache.pop(key, None)
+        cache[key] = [stat.st_size, stat.st_mtime_ns, encoding]
+        # 超出上限时丢弃最早加入的记录
+        for old_key in list(cache)[:max(0, len(cache) - CACHE_MAX_ENTRIES)]:
+            del cache[old_key]
+        _save_cache(cache)
+
+
+def detect_encoding(file_path: str) -> str:
+    """检测文件编码；文件的大小和修改时间与上次检测时相同则直接使用缓存的结果"""
+    stat = os.stat(file_path)
+    with _cache_lock:
+        cached = _load_cache().get(_cache_key(file_path))
+    if cached is not None and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+        return cached[2]
+
+    encoding = detect_encoding_uncached(file_path)
+    _store_cached_encoding(file_path, encoding)
+    return encoding
+
+
+def _decodes_completely(file_path: str, encoding: str) -> bool:
+    """逐块严格解码整个文件，判断能否按该编码读取"""
+    try:
+        decoder = codecs.getincrementaldecoder(encoding)()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(ENCODING_SAMPLE_SIZE), b''):
+                decoder.decode(block)
+        decoder.decode(b'', final=True)
+    except (UnicodeDecodeError, LookupError):
+        return False
+    return True
+
+
+def redetect_encoding(file_path: str, failed_encoding: str) -> Optional[str]:
+    """
+    按样本检测的编码在样本之后遇到无法解码的字节时调用（如开头全是ASCII、后面才有GBK字符）：
+    依次尝试 FALLBACK_ENCODINGS 中的其他编码，仍不行时对整个文件运行chardet；
+    找到能解码整个文件的编码时更新缓存并返回，否则返回None
+    """
+    candidates = [encoding for encoding in FALLBACK_ENCODINGS if encoding != failed_encoding]
+    for candidate in candidates:
+        if _decodes_completely(file_path, candidate):
+            _store_cached_encoding(file_path, candidate)
+            return candidate
+
+    detector = chardet.UniversalDetector()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(ENCODING_SAMPLE_SIZE), b''):
+            detector.feed(block)
+            if detector.done:
+                break
+    detected = (detector.close().get('encoding') or '').lower()
+    detected = SAMPLE_ENCODING_SUPERSETS.get(detected, detected)
+    if detected and detected != failed_encoding and detected not in candidates \
+            and _decodes_completely(file_path, detected):
+        _store_cached_encoding(file_path, detected)
+        return detected
+    return None
+
+
+def open_text(file_path: str, encoding: Optional[str] = None, errors: str = 'strict'):
+    """按检测到的编码打开文本文件（newline='' 以便交给csv模块）"""
+    return open(file_path, 'r', encoding=encoding or detect_encoding(file_path), errors=errors, newline='')
+
+
+def iter_csv_rows(file_path: str, encoding: Optional[str] = None) -> Iterator[List[str]]:
+    """
+    逐行读取CSV，不把整个文件放进内存
+    自动检测的编码读到中途无法解码时，重新检测编码并从下一行继续（只重试一次）
+    """
+    detected = encoding is None
+    encoding = encoding or detect_encoding(file_path)
+    rows = 0
+    try:
+        with open_text(file_path, encoding) as f:
+            for row in csv.reader(f):
+                yield row
+                rows += 1
+        return
+    except UnicodeDecodeError:
+        fallback = redetect_encoding(file_path, encoding) if detected else None
+        if fallback is None:
+            raise
+    with open_text(file_path, fallback) as f:
+        yield from itertools.islice(csv.reader(f), rows, None)
+
+
+def read_csv_rows(file_path: str) -> Tuple[List[List[str]], str]:
+    encoding = detect_encoding(file_path)
+    return list(iter_csv_rows(file_path, encoding)), encoding
+
+
+def write_csv_rows(file_path: str, rows, encoding: str = 'utf-8-sig'):
+    """写入CSV：先写临时文件再替换，中途失败不会留下半个文件"""
+    temp_path = f"{file_path}.part"
+    try:
+        with open(temp_path, 'w', encoding=encoding, newline='') as f:
+            csv.writer(f).writerows(rows)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def fast_engine_available() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _read_dataframe(file_path: str, encoding: str, fast: bool, **kwargs):
+    import pandas as pd
+
+    # pyarrow 不认识 'utf-8-sig'，BOM由它自己跳过
+    if fast and 'engine' not in kwargs and fast_engine_available():
+        try:
+            arrow_encoding = 'utf-8' if encoding == 'utf-8-sig' else encoding
+            return pd.read_csv(file_path, encoding=arrow_encoding, engine='pyarrow', **kwargs)
+        except (ValueError, TypeError, NotImplementedError, LookupError):
+            pass
+    return pd.read_csv(file_path, encoding=encoding, **kwargs)
+
+
+def read_dataframe(file_path: str, encoding: Optional[str] = None, fast: bool = True, **kwargs):
+    """
+    读取CSV为DataFrame，返回 (DataFrame, 编码)；整个文件只解析一次
+    fast 为 True 且安装了 pyarrow 时使用 pyarrow 引擎，参数不受支持时退回默认的C引擎
+    自动检测的编码无法解码整个文件时，重新检测编码（见 redetect_encoding）后再读取一次
+    （chunksize 分块读取时解码错误在读取各块时才出现，由 read_batches 处理）
+    """
+    detected = encoding is None
+    encoding = encoding or detect_encoding(file_path)
+    try:
+        return _read_dataframe(file_path, encoding, fast, **kwargs), encoding
+    except UnicodeDecodeError:
+        fallback = redetect_encoding(file_path, encoding) if detected else None
+        if fallback is None:
+            raise
+    print(f"编码 {encoding} 无法读取整个文件 {os.path.basename(file_path)}，改用 {fallback}")
+    return _read_dataframe(file_path, fallback, fast, **kwargs), fallback
+
+
+def find_image_path_column(columns) -> str:
+    """确定图片路径所在的列（从文档看是"图片路径"），没有标准列名时使用第一列"""
+    possible_names = ["图片路径", "图片路径", "图片", "路径", "image_path", "path"]
+
+    for col in columns:
+        if col in possible_names:
+            return col
+
+    # 如果没有找到标准列名，使用第一列
+    print(f"未找到标准图片路径列名，使用第一列: {columns[0]}")
+    return columns[0]
+
+
+def estimate_chunk_rows(file_path: str, memory_budget_mb: int) -> Optional[int]:
+    """
+    按内存预算估算每块读取多少行；整个文件估算的内存占用不超过预算时返回None（一次读入）
+    每行的字节数由文件开头的样本估算
+    """
+    file_size = os.path.getsize(file_path)
+    budget = memory_budget_mb * 1024 * 1024
+    if file_size * MEMORY_PER_CSV_BYTE <= budget:
+        return None
+    with open(file_path, 'rb') as f:
+        sample = f.read(ROW_SIZE_SAMPLE_BYTES)
+    bytes_per_row = len(sample) / max(1, sample.count(b'\n'))
+    return max(MIN_CHUNK_ROWS, int(budget / (bytes_per_row * MEMORY_PER_CSV_BYTE)))
+
+
+def read_batches(file_path: str, chunk_rows: Optional[int] = None):
+    """
+    读取一个CSV文件，所有值按原样读为字符串（空值为空字符串）
+    chunk_rows 为None时整个文件作为一块，否则每次产出 chunk_rows 行
+    """
+    if chunk_rows is None:
+        df, encoding = read_dataframe(file_path, dtype=str, keep_default_na=False)
+        print(f"成功读取文件 {os.path.basename(file_path)}，编码: {encoding}")
+        yield df
+        return
+    reader, encoding = read_dataframe(file_path, dtype=str, keep_default_na=False, chunksize=chunk_rows)
+    print(f"分块读取文件 {os.path.basename(file_path)}，编码: {encoding}，每块 {chunk_rows} 行")
+    rows = 0
+    try:
+        with reader:
+            for df in reader:
+                yield df
+                rows += len(df)
+        return
+    except UnicodeDecodeError:
+        fallback = redetect_encoding(file_path, encoding)
+        if fallback is None:
+            raise
+    # 已经产出的行不再重复，跳过这些数据行（保留表头）后按新的编码继续
+    print(f"编码 {encoding} 无法读取第 {rows + 1} 行之后的内容，改用 {fallback} 继续读取")
+    reader, _ = read_dataframe(file_path, fallback, dtype=str, keep_default_na=False, chunksize=chunk_rows,
+                               skiprows=range(1, rows + 1))
+    with reader:
+        yield from reader
+
+
+def write_dataframe(df, file_path: str, encoding: str = 'utf-8-sig', **kwargs):
+    """DataFrame写入CSV（默认带BOM的UTF-8，Excel可直接打开），先写临时文件再替换"""
+    temp_path = f"{file_path}.part"
+    try:
+        df.to_csv(temp_path, index=False, encoding=encoding, **kwargs)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
@@ -1,9 +1,20 @@
 import os
+import argparse
 import pandas as pd
 import glob
 from datetime import datetime
-import hashlib
-from pathlib import Path
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from CSV读写 import DEFAULT_MEMORY_BUDGET_MB, estimate_chunk_rows, find_image_path_column, read_batches
+from 标签总库 import DEFAULT_STORE_PATH, TagStore
+from 阶段缓存 import StageCache
+
+# 并发读取文件属性的线程数上限
+STAT_WORKERS = 16
+# 一个目录中请求的文件达到这个数量时列出整个目录，否则逐个stat
+SCANDIR_MIN_FILES = 8
+# 最多逐个打印多少个不存在的图片文件
+MISSING_WARNING_LIMIT = 20
 
 def get_latest_csv(folder_path):
     """获取指定文件夹中最新的CSV文件"""
@@ -53,305 +64,453 @@ def align_columns(df_target, df_source):
     
     return df_source
 
-def get_image_file_modification_date(image_path, base_path=""):
-    """获取图片文件的修改日期（Windows系统）"""
-    try:
-        # 处理图片路径
-        # 根据文档内容，图片路径可能是相对路径
-        full_path = image_path
-        
-        # 如果提供基础路径，尝试构建完整路径
-        if base_path and not os.path.isabs(image_path):
-            # 尝试几种可能的路径组合
-            possible_paths = [
-                os.path.join(base_path, image_path),
-                os.path.join(os.path.dirname(base_path), image_path),
-                image_path  # 原始路径
-            ]
-            
-            for path in possible_paths:
-                if os.path.exists(path):
-                    full_path = path
-                    break
-        
-        # 使用pathlib获取文件信息
-        file_path_obj = Path(full_path)
-        if file_path_obj.exists():
-            # 获取文件的修改时间（Windows系统）
-            mod_time = file_path_obj.stat().st_mtime
-            # 转换为可读的日期时间格式
-            return datetime.fromtimestamp(mod_time).strftime("%Y-%m-%d %H:%M:%S")
-        else:
-            # 文件不存在，返回空字符串
-            print(f"警告：图片文件不存在: {full_path}")
-            return ""
-            
-    except Exception as e:
-        print(f"获取图片文件 {image_path} 修改日期时出错: {e}")
-        return ""
+def candidate_base_dirs(csv_file_path):
+    """
+    相对路径依次尝试的基础目录：CSV所在目录、它的上级目录、当前目录
+    每个CSV文件只计算一次，规范化后去掉重复的目录
+    """
+    csv_dir = os.path.dirname(csv_file_path) if csv_file_path else ""
+    if not csv_dir:
+        return [""]
+    base_dirs = []
+    for base_dir in (csv_dir, os.path.dirname(csv_dir), ""):
+        base_dir = os.path.normpath(base_dir) if base_dir else ""
+        if base_dir == ".":
+            base_dir = ""
+        if base_dir not in base_dirs:
+            base_dirs.append(base_dir)
+    return base_dirs
+
+
+def stat_directory(directory, names):
+    """
+    读取一个目录中若干文件（names 为规范化的文件名）的修改时间，返回 {文件名: mtime}
+    请求的文件较多时列出整个目录一次（Windows上scandir直接带回文件属性，不需要逐个stat），
+    较少时逐个stat，避免为一两个文件列出很大的目录
+    """
+    wanted = set(names)
+    mtimes = {}
+    if len(wanted) >= SCANDIR_MIN_FILES:
+        try:
+            with os.scandir(directory or ".") as entries:
+                for entry in entries:
+                    key = os.path.normcase(entry.name)
+                    if key in wanted:
+                        try:
+                            mtimes[key] = entry.stat().st_mtime
+                        except OSError:
+                            pass
+            return mtimes
+        except OSError:
+            # 目录不存在或无法列出时退回逐个stat
+            pass
+    for name in wanted:
+        try:
+            mtimes[name] = os.stat(os.path.join(directory, name)).st_mtime
+        except OSError:
+            pass
+    return mtimes
+
+
+def split_image_paths(image_paths):
+    """把图片路径向量化地拆分为 (目录, 文件名) 两列，之后每个目录只需处理一次"""
+    paths = pd.Series(image_paths, dtype=object)
+    if os.altsep:
+        paths = paths.str.replace(os.altsep, os.sep, regex=False)
+    parts = paths.str.rpartition(os.sep)
+    # 根目录下的文件（如 "/a.jpg"）保留分隔符作为目录
+    directories = parts[0].where((parts[0] != "") | (parts[1] == ""), os.sep)
+    return directories, parts[2].map(os.path.normcase)
+
+
+def resolve_modification_times(image_paths, base_dirs, mtime_cache=None):
+    """
+    批量解析图片路径并获取修改时间，返回 {图片路径: mtime}（找不到的文件不在结果中）
+    图片按所在目录分组，相对目录按 base_dirs 的顺序尝试，每一轮的各个目录并发读取（线程数有上限）；
+    mtime_cache 为 {规范化目录: {规范化文件名: mtime或None}}，同一次合并中的多个文件共用，每个文件只读取一次
+    """
+    if mtime_cache is None:
+        mtime_cache = {}
+    image_paths = list(image_paths)
+    directories, names = split_image_paths(image_paths)
+    # 目录 -> [(文件名, 图片路径)]
+    groups = defaultdict(list)
+    for directory, name, image_path in zip(directories.tolist(), names.tolist(), image_paths):
+        groups[directory].append((name, image_path))
+
+    result = {}
+    pending = groups
+    with ThreadPoolExecutor(max_workers=STAT_WORKERS) as pool:
+        for level, base_dir in enumerate(base_dirs):
+            if not pending:
+                break
+            # 本轮要读取的 规范化目录 -> (实际目录, 尚未读取过的文件名)
+            requests = {}
+            candidates = {}
+            for directory in pending:
+                if os.path.isabs(directory):
+                    # 绝对路径只有一个候选
+                    if level > 0:
+                        continue
+                    full_dir = os.path.normpath(directory)
+                else:
+                    full_dir = os.path.normpath(os.path.join(base_dir, directory))
+                key = os.path.normcase(full_dir)
+                candidates[directory] = key
+                known = mtime_cache.setdefault(key, {})
+                new_names = {name for name, _ in pending[directory] if name not in known}
+                if new_names:
+                    requests.setdefault(key, (full_dir, set()))[1].update(new_names)
+
+            keys = list(requests)
+            for key, mtimes in zip(keys, pool.map(lambda k: stat_directory(*requests[k]), keys)):
+                known = mtime_cache[key]
+                for name in requests[key][1]:
+                    known[name] = mtimes.get(name)
+
+            unresolved = defaultdict(list)
+            for directory, key in candidates.items():
+                known = mtime_cache[key]
+                for name, image_path in pending[directory]:
+                    mtime = known[name]
+                    if mtime is not None:
+                        result[image_path] = mtime
+                    else:
+                        unresolved[directory].append((name, image_path))
+            pending = unresolved
+    return result
+
 
-def add_image_modification_dates(df, csv_file_path):
+def add_image_modification_dates(df, csv_file_path, mtime_cache=None):
     """
     为DataFrame添加图片文件的修改日期
-    读取第一列（图片路径）中每个图片文件的修改日期
+    读取第一列（图片路径）中每个图片文件的修改日期：
+    重复的路径只解析一次，按目录分组批量读取文件属性；
+    文件暂时找不到（如移动硬盘未连接）时保留表中已有的修改日期
     """
-    # 确定第一列的列名（从文档看是"图片路径"）
-    image_path_column = None
-    possible_names = ["图片路径", "图片路径", "图片", "路径", "image_path", "path"]
-    
-    for col in df.columns:
-        if col in possible_names:
-            image_path_column = col
-            break
-    
-    if not image_path_column:
-        # 如果没有找到标准列名，使用第一列
-        image_path_column = df.columns[0]
-        print(f"未找到标准图片路径列名，使用第一列: {image_path_column}")
-    
+    image_path_column = find_image_path_column(df.columns)
     print(f"使用列 '{image_path_column}' 作为图片路径")
     
-    # 获取CSV文件所在目录，用于解析相对路径
-    csv_dir = os.path.dirname(csv_file_path) if csv_file_path else ""
+    # 图片路径列转为字符串，空值为空字符串
+    image_paths = df[image_path_column].astype(object).where(df[image_path_column].notna(), "").astype(str)
+    unique_paths = [path for path in image_paths.unique() if path]
     
-    # 创建空列表存储修改日期
-    modification_dates = []
+    # 基础目录每个CSV文件只确定一次，然后批量获取修改时间
+    mtimes = resolve_modification_times(unique_paths, candidate_base_dirs(csv_file_path), mtime_cache)
     
-    # 遍历每行的图片路径
-    for index, row in df.iterrows():
-        image_path = str(row[image_path_column]) if pd.notna(row[image_path_column]) else ""
-        
-        if image_path:
-            # 获取图片文件的修改日期
-            mod_date = get_image_file_modification_date(image_path, csv_dir)
-            modification_dates.append(mod_date)
-        else:
-            # 图片路径为空，添加空字符串
-            modification_dates.append("")
+    # 每个不同的修改时间只格式化一次
+    date_strings = {}
+    dates_by_path = {}
+    for path, mtime in mtimes.items():
+        date = date_strings.get(mtime)
+        if date is None:
+            date = date_strings[mtime] = datetime.fromtimestamp(mtime).strftime("%Y-%m-%d %H:%M:%S")
+        dates_by_path[path] = date
+    modification_dates = image_paths.map(dates_by_path).fillna("")
+    
+    missing_paths = [path for path in unique_paths if path not in mtimes]
+    for path in missing_paths[:MISSING_WARNING_LIMIT]:
+        print(f"警告：图片文件不存在: {path}")
+    if len(missing_paths) > MISSING_WARNING_LIMIT:
+        print(f"警告：另有 {len(missing_paths) - MISSING_WARNING_LIMIT} 个图片文件不存在")
     
     # 在G列位置（第7列，索引6）插入修改日期
     insert_position = min(6, len(df.columns))  # 确保位置有效
     
     if "图片修改日期" not in df.columns:
         # 插入新列
-        df.insert(insert_position, "图片修改日期", modification_dates)
+        df.insert(insert_position, "图片修改日期", modification_dates.to_numpy())
         print(f"已在第{insert_position+1}列添加'图片修改日期'列")
     else:
-        # 更新现有列
-        df["图片修改日期"] = modification_dates
-        print(f"已更新'图片修改日期'列")
+        # 更新现有列；找不到文件的行保留之前记录的日期
+        previous_dates = df["图片修改日期"].astype(object).where(df["图片修改日期"].notna(), "").astype(str)
+        reused = (modification_dates == "") & (previous_dates != "")
+        if reused.any():
+            print(f"{int(reused.sum())} 个找不到的图片文件保留了之前记录的修改日期")
+        df["图片修改日期"] = modification_dates.where(~reused, previous_dates).to_numpy()
+        print("已更新'图片修改日期'列")
     
     # 统计成功获取日期的文件数量
-    valid_dates = [d for d in modification_dates if d]
-    print(f"成功获取 {len(valid_dates)}/{len(modification_dates)} 个图片文件的修改日期")
+    valid_count = int((modification_dates != "").sum())
+    print(f"成功获取 {valid_count}/{len(modification_dates)} 个图片文件的修改日期")
     
     return df
 
-def merge_latest_csv_files():
+def relative_base_dir(csv_file_path, image_paths, sample_size=20):
     """
-    合并Csv_All文件夹内最新的一个csv文件与Exported_Labels_csv_true文件夹内最新的一个csv文件
-    处理列结构不匹配问题，优先保留绝对路径，并添加图片文件修改日期到G列
+    确定CSV中相对路径的基准目录（每个文件只确定一次）：
+    依次尝试 candidate_base_dirs，取第一个能找到样本中图片的目录，都找不到时使用CSV所在目录的上级目录（项目根目录）
     """
-    input_folder = "Exported_Labels_csv_true"
-    output_folder = "Csv_All"
-    
-    if not os.path.exists(output_folder):
-        os.makedirs(output_folder)
+    relative_paths = [path for path in image_paths[:sample_size * 10] if path and not os.path.isabs(path)]
+    sample = relative_paths[:sample_size]
+    for base_dir in candidate_base_dirs(csv_file_path):
+        if any(os.path.exists(os.path.join(base_dir, path)) for path in sample):
+            return os.path.abspath(base_dir or ".")
+    csv_dir = os.path.dirname(os.path.abspath(csv_file_path))
+    return os.path.dirname(csv_dir)
 
-    # 获取两个文件夹中最新的CSV文件
-    latest_input = get_latest_csv(input_folder)
-    latest_output = get_latest_csv(output_folder)
+def canonical_path_keys(image_paths, base_dir):
+    """
+    向量化地计算图片路径的规范化键，返回 (路径键, 是否为绝对路径) 两列：
+    统一分隔符为 /，相对路径按 base_dir 转为绝对路径，去掉多余的 / 、 . 和 ..，
+    在不区分大小写的系统上（与 os.path.normcase 一致）转为小写
+    """
+    paths = pd.Series(image_paths, dtype=object).fillna("").astype(str).str.strip().str.replace("\\", "/", regex=False)
+    is_absolute = paths.str.match(r"^(?:[A-Za-z]:/|/)")
+    base = os.path.abspath(base_dir).replace("\\", "/").rstrip("/")
+    keys = paths.where(is_absolute | (paths == ""), base + "/" + paths)
+    # 连续的分隔符合并为一个（开头的 // 为网络路径，保留）
+    keys = keys.str.replace(r"(?<=.)/{2,}", "/", regex=True)
+    # 去掉 ./ 和末尾的 /
+    keys = keys.str.replace(r"(?<=/)(?:\./)+", "", regex=True).str.replace(r"(?<=.)/\.?$", "", regex=True)
+    # 逐层消去 目录/..
+    parent_pattern = r"[^/]+/\.\.(?:/|$)"
+    while True:
+        has_parent = keys.str.contains(r"(?:^|/)\.\.(?:/|$)", regex=True)
+        if not has_parent.any():
+            break
+        reduced = keys.str.replace(parent_pattern, "", n=1, regex=True)
+        if reduced.equals(keys):
+            break
+        keys = reduced
+    if os.path.normcase("A") == "a":
+        keys = keys.str.lower()
+    return keys, is_absolute
+
+def dedupe_by_canonical_path(df, keys, is_absolute):
+    """
+    按规范化路径键去重：同一张图片优先保留绝对路径的写法，写法相同时保留后面（较新）的行
+    一次向量化的排序完成，不逐行回调；返回 (去重后的DataFrame, 对应的路径键, 是否为绝对路径)
+    """
+    order = pd.DataFrame({"key": keys.to_numpy(), "absolute": is_absolute.to_numpy(),
+                          "position": range(len(df))})
+    order = order.sort_values(["key", "absolute", "position"], kind="stable")
+    keep = ~order.duplicated(subset=["key"], keep="last")
+    positions = order.loc[keep, "position"].sort_values().to_numpy()
+    duplicates_count = len(df) - len(positions)
+    if duplicates_count > 0:
+        print(f"找到 {duplicates_count} 个重复项（按规范化路径），优先保留绝对路径")
+        print(f"去除重复项: {len(df)} -> {len(positions)}")
+    return (df.iloc[positions], keys.iloc[positions].to_numpy(), is_absolute.iloc[positions].to_numpy())
+
+def order_columns(columns):
+    """确定总库的列顺序：'图片修改日期'在G列（第7列，索引6），source_file在它之前"""
+    columns = list(columns)
+    if '图片修改日期' not in columns:
+        return columns
     
-    if not latest_input:
-        print(f"在文件夹 {input_folder} 中未找到CSV文件")
-        return
+    # 期望的列顺序：图片路径、标签数量、标签、标签(带置信度)、置信度列表、source_file、图片修改日期
+    current_idx = columns.index('图片修改日期')
+    expected_position = 6  # G列位置
     
-    all_data = []
-    target_columns = None
+    if current_idx == expected_position or len(columns) <= expected_position:
+        return columns
     
-    # 读取两个最新的CSV文件
-    files_to_read = []
-    if latest_input:
-        files_to_read.append(('input', latest_input))
-    if latest_output:
-        files_to_read.append(('output', latest_output))
+    cols_to_move = ['图片修改日期']
+    other_cols = [col for col in columns if col not in cols_to_move]
     
-    print(f"将合并以下文件: {[f[1] for f in files_to_read]}")
+    # 如果source_file在图片修改日期之后，将source_file也移到正确位置
+    if 'source_file' in other_cols and other_cols.index('source_file') >= expected_position:
+        other_cols.remove('source_file')
+        other_cols.insert(expected_position - 1, 'source_file')
     
-    for file_type, file_path in files_to_read:
-        try:
-            encodings = ['utf-8', 'gbk', 'gb2312', 'utf-8-sig']
-            df = None
-            
-            for encoding in encodings:
-                try:
-                    df = pd.read_csv(file_path, encoding=encoding)
-                    print(f"成功读取文件 {os.path.basename(file_path)}，编码: {encoding}")
-                    break
-                except UnicodeDecodeError:
-                    continue
-                except Exception as e:
-                    print(f"使用编码 {encoding} 读取文件 {file_path} 时出错: {e}")
-                    continue
-            
-            if df is None:
-                print(f"无法读取文件 {file_path}，跳过")
-                continue
-            
-            # 添加源文件列
-            df['source_file'] = os.path.basename(file_path)
-            
-            # 为每个图片文件添加修改日期
-            df = add_image_modification_dates(df, file_path)
-            
-            # 设置目标列结构（以第一个文件的列结构为准）
-            if target_columns is None:
-                # 更新目标列结构
-                target_columns = df.columns.tolist()
-                all_data.append(df)
-                print(f"设置目标列结构: {target_columns}")
-            else:
-                # 对齐列结构
-                print(f"对齐文件 {os.path.basename(file_path)} 的列结构...")
-                df_aligned = align_columns(all_data[0], df)
-                all_data.append(df_aligned)
-                print(f"文件 {os.path.basename(file_path)} 列结构对齐完成")
-            
-        except Exception as e:
-            print(f"处理文件 {file_path} 时出错: {e}")
-            import traceback
-            traceback.print_exc()
-            continue
+    print(f"已确认'图片修改日期'列在第{expected_position+1}列（G列）")
+    return other_cols[:expected_position] + cols_to_move + other_cols[expected_position:]
+
+def upsert_batch(store, df, file_path, mtime_cache, snapshot=False, base_dir=None, announce_alignment=True):
+    """
+    把一块数据（来自 file_path）upsert 到总库，返回 (统计结果, 相对路径的基准目录)
+    总库为空时以这块数据的列结构（加上source_file和图片修改日期）作为总库的列结构；
+    snapshot 为 True 表示导入完整的CSV快照：保留其中已有的来源和修改日期
+    """
+    # 添加源文件列
+    if not snapshot or 'source_file' not in df.columns:
+        df['source_file'] = os.path.basename(file_path)
+    
+    # 为每个图片文件添加修改日期
+    if not snapshot or '图片修改日期' not in df.columns:
+        df = add_image_modification_dates(df, file_path, mtime_cache)
+    
+    columns = store.columns
+    if columns is None:
+        columns = order_columns(df.columns)
+        store.set_columns(columns)
+        print(f"设置总库列结构: {columns}")
+    elif announce_alignment:
+        print(f"对齐文件 {os.path.basename(file_path)} 的列结构...")
+        df = align_columns(pd.DataFrame(columns=columns), df)
+    df = df.reindex(columns=columns).fillna("").astype(str)
     
-    if not all_data:
-        print("没有成功读取任何CSV文件")
+    path_column = find_image_path_column(columns)
+    image_paths = df[path_column].tolist()
+    if base_dir is None:
+        # 相对路径的基准目录每个文件只确定一次
+        base_dir = relative_base_dir(file_path, image_paths)
+    keys, is_absolute = canonical_path_keys(image_paths, base_dir)
+    df, keys, is_absolute = dedupe_by_canonical_path(df, keys, is_absolute)
+    
+    records = zip(keys, is_absolute.astype(int).tolist(), df.itertuples(index=False, name=None))
+    return store.upsert(records, columns.index(path_column)), base_dir
+
+def upsert_csv_file(store, file_path, mtime_cache, snapshot=False, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB):
+    """
+    把一个CSV文件的行 upsert 到总库，返回统计结果（读取失败时返回None）
+    估算的内存占用超过 memory_budget_mb 时分块读取，逐块去重并写入，块之间由总库的主键去重
+    """
+    chunk_rows = estimate_chunk_rows(file_path, memory_budget_mb)
+    totals = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+    base_dir = None
+    rows = 0
+    try:
+        for chunk_index, df in enumerate(read_batches(file_path, chunk_rows)):
+            if chunk_rows is not None:
+                print(f"处理第 {chunk_index + 1} 块（第 {rows + 1}-{rows + len(df)} 行）")
+                # 分块时文件属性缓存只在块内使用，内存占用不随文件增长
+                mtime_cache = {}
+            rows += len(df)
+            result, base_dir = upsert_batch(store, df, file_path, mtime_cache, snapshot, base_dir,
+                                            announce_alignment=chunk_index == 0)
+            for name, count in result.items():
+                totals[name] += count
+    except (UnicodeDecodeError, pd.errors.ParserError) as e:
+        print(f"无法读取文件 {file_path}，跳过: {e}")
+        return None
+    
+    # 全部写入后才记录为已合并，中途失败时下次会重新合并（upsert可以重复执行）
+    store.record_source(file_path, rows)
+    return totals
+
+def merge_dataframe(store, df, file_path, mtime_cache=None):
+    """
+    合并已经在内存中的一批数据，不重新读取文件（刷新流程把刚写出的检查点文件作为 file_path，
+    df 的内容与它一致，所有值为字符串）；返回统计结果
+    """
+    result, _ = upsert_batch(store, df, file_path, {} if mtime_cache is None else mtime_cache)
+    store.record_source(file_path, len(df))
+    return result
+
+def print_merge_result(result):
+    print(f"新增 {result['inserted']} 张图片，更新 {result['updated']} 张，未变化 {result['unchanged']} 张")
+
+def sync_with_latest_snapshot(store, output_folder, mtime_cache, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB):
+    """
+    Csv_All中最新的快照不是总库导出的（第一次运行，或路径修正等程序写入了新快照）时，
+    它才是完整的最新数据，以它重建总库
+    """
+    latest_output = get_latest_csv(output_folder)
+    if not latest_output or store.is_merged(latest_output):
         return
+    if len(store):
+        print(f"发现总库之外写入的CSV快照，以它重建总库: {latest_output}")
+        store.clear()
+    else:
+        print(f"总库为空，导入已有的CSV快照: {latest_output}")
+    result = upsert_csv_file(store, latest_output, mtime_cache, snapshot=True, memory_budget_mb=memory_budget_mb)
+    if result:
+        print(f"已导入 {result['inserted']} 张图片")
+
+def merge_cache_key(store, file_path, cache):
+    """合并步骤的缓存键：输入文件的内容哈希 + 总库位置"""
+    return cache.key('merge', cache.file_hash(file_path), str(store.db_path))
+
+def already_merged(store, file_path, cache=None):
+    """
+    文件已合并过时返回True：签名与合并时相同，
+    或内容与上次合并的文件相同（被原样重新写出，只是修改时间变了）
+    """
+    if store.is_merged(file_path):
+        return True
+    return cache is not None and cache.lookup('merge', merge_cache_key(store, file_path, cache)) is not None
+
+def export_snapshot(store, output_folder, cache=None):
+    """
+    导出新的CSV快照，返回文件路径（总库为空时返回None）；
+    传入 cache 时，总库自上次导出后没有变化且快照文件未被改动，直接返回上次的快照，不再写出相同的文件
+    """
+    if store.columns is None:
+        print("总库为空，没有可导出的数据")
+        return None
+    if cache is not None:
+        key = cache.key('export', str(store.db_path), store.revision)
+        entry = cache.lookup('export', key)
+        if entry is not None:
+            output_path = entry['path']
+            print(f"总库没有变化，沿用上次导出的CSV快照: {output_path}")
+            cache.record_run('export', skipped=True)
+            return output_path
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M")
+    output_path = os.path.join(output_folder, f"所有图片标签_{timestamp}.csv")
+    count = store.export_csv(output_path)
+    if cache is not None:
+        cache.store('export', key, outputs=[output_path], path=output_path, rows=count)
+        cache.record_run('export', skipped=False, rows=count)
+    print(f"成功导出CSV快照: {output_path}")
+    print(f"最终数据行数: {count}")
+    print("列名:", store.columns)
+    return output_path
+
+def merge_latest_csv_files(export=False, store_path=None, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB):
+    """
+    把Exported_Labels_csv_true文件夹内最新的一个csv文件合并到标签总库（以图片路径为主键upsert）
+    处理列结构不匹配问题，并添加图片文件修改日期到G列；
+    Csv_All文件夹内最新的CSV快照不是总库导出的时先以它重建总库，export 为 True 时导出新的CSV快照；
+    大文件按 memory_budget_mb 分块读取，总库在磁盘上按主键去重，导出逐行写出，内存占用不随总库增长
+    """
+    input_folder = "Exported_Labels_csv_true"
+    output_folder = "Csv_All"
+    
+    if not os.path.exists(output_folder):
+        os.makedirs(output_folder)
+    
+    store = TagStore(store_path)
+    print(f"标签总库: {store.db_path}（现有 {len(store)} 张图片）")
+    
+    # 同一次合并中的文件共用文件属性缓存，同一个图片文件只读取一次
+    mtime_cache = {}
+    cache = StageCache()
     
     try:
-        if len(all_data) > 1:
-            merged_df = pd.concat(all_data, ignore_index=True)
-        else:
-            merged_df = all_data[0]
-            
-        print(f"合并后总行数: {len(merged_df)}")
-        
-        # 去重处理 - 优先保留绝对路径
-        def create_hash(row):
-            # 使用图片路径作为主要去重依据，确保绝对路径优先
-            content = str(row['图片路径']) if '图片路径' in row else ""
-            return hashlib.md5(content.encode('utf-8')).hexdigest()
-        
-        # 确保去重时包含所有必要的列
-        merged_df['content_hash'] = merged_df.apply(create_hash, axis=1)
+        sync_with_latest_snapshot(store, output_folder, mtime_cache, memory_budget_mb)
         
-        initial_count = len(merged_df)
-        
-        # 检查是否真的有重复项
-        duplicate_mask = merged_df.duplicated(subset=['content_hash'], keep='last')
-        duplicates_count = duplicate_mask.sum()
-        
-        if duplicates_count > 0:
-            print(f"找到 {duplicates_count} 个重复项")
-            # 优先保留较新的记录（假设后面的文件较新）
-            merged_df = merged_df.drop_duplicates(subset=['content_hash'], keep='last')
+        latest_input = get_latest_csv(input_folder)
+        if not latest_input:
+            print(f"在文件夹 {input_folder} 中未找到CSV文件")
+        elif already_merged(store, latest_input, cache):
+            print(f"文件 {os.path.basename(latest_input)} 已合并过且没有变化，跳过")
+            cache.record_run('merge', skipped=True)
         else:
-            print("未找到重复项")
-            
-        final_count = len(merged_df)
-        
-        if initial_count != final_count:
-            print(f"去除重复项: {initial_count} -> {final_count} (去除 {initial_count - final_count} 个重复项)")
+            print(f"将合并文件: {latest_input}")
+            result = upsert_csv_file(store, latest_input, mtime_cache, memory_budget_mb=memory_budget_mb)
+            if result:
+                print_merge_result(result)
+                cache.store('merge', merge_cache_key(store, latest_input, cache))
+            cache.record_run('merge', skipped=False)
         
-        # 移除临时列
-        if 'content_hash' in merged_df.columns:
-            merged_df = merged_df.drop('content_hash', axis=1)
+        print(f"总库现有 {len(store)} 张图片")
         
-        # 最终确保'图片修改日期'列在G列位置（第7列，索引6）
-        if '图片修改日期' in merged_df.columns:
-            current_columns = merged_df.columns.tolist()
-            
-            # 确定期望的列顺序：图片路径、标签数量、标签、标签(带置信度)、置信度列表、source_file、图片修改日期
-            # 查找图片修改日期列的当前位置
-            current_idx = current_columns.index('图片修改日期')
-            expected_position = 6  # G列位置
-            
-            if current_idx != expected_position and len(current_columns) > expected_position:
-                try:
-                    # 重新排序列
-                    cols_to_move = ['图片修改日期']
-                    other_cols = [col for col in current_columns if col not in cols_to_move]
-                    
-                    # 确保source_file在图片修改日期之前
-                    # 如果source_file在图片修改日期之后，需要调整
-                    if 'source_file' in other_cols and other_cols.index('source_file') >= expected_position:
-                        # 将source_file也移到正确位置
-                        source_file_idx = other_cols.index('source_file')
-                        other_cols.pop(source_file_idx)
-                        # 插入到图片修改日期之前
-                        other_cols.insert(expected_position - 1, 'source_file')
-                    
-                    # 插入图片修改日期到G列
-                    new_columns = other_cols[:expected_position] + cols_to_move + other_cols[expected_position:]
-                    merged_df = merged_df[new_columns]
-                    
-                    print(f"已确认'图片修改日期'列在第{expected_position+1}列（G列）")
-                    
-                except Exception as e:
-                    print(f"调整列顺序时出错: {e}")
-        
-        # 保存结果
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M")
-        output_filename = f"所有图片标签_{timestamp}.csv"
-        output_path = os.path.join(output_folder, output_filename)
-        
-        merged_df.to_csv(output_path, index=False, encoding='utf-8-sig')
-        print(f"成功保存合并文件: {output_path}")
-        print(f"最终数据行数: {len(merged_df)}")
-        print(f"列数: {len(merged_df.columns)}")
-        print("列名:", merged_df.columns.tolist())
-        
-        # 显示图片修改日期的统计信息
-        if '图片修改日期' in merged_df.columns:
-            try:
-                # 统计有效的修改日期
-                valid_dates = merged_df['图片修改日期'].dropna()
-                valid_dates = valid_dates[valid_dates != ""]
-                
-                print(f"\n图片修改日期统计:")
-                print(f"  总图片数: {len(merged_df)}")
-                print(f"  成功获取修改日期的图片数: {len(valid_dates)}")
-                print(f"  失败/缺失的图片数: {len(merged_df) - len(valid_dates)}")
-                
-                if len(valid_dates) > 0:
-                    # 显示最早的5个修改日期
-                    print("  最早的5个修改日期:")
-                    for date in sorted(valid_dates.unique())[:5]:
-                        count = (valid_dates == date).sum()
-                        print(f"    {date}: {count}个文件")
-                
-                # 显示G列的位置
-                g_column_index = merged_df.columns.get_loc('图片修改日期')
-                print(f"  '图片修改日期'列位于第 {g_column_index + 1} 列（{chr(65 + g_column_index)}列）")
-                
-            except Exception as e:
-                print(f"显示图片修改日期统计信息时出错: {e}")
-        
-        # 显示源文件信息
-        if 'source_file' in merged_df.columns:
-            file_counts = merged_df['source_file'].value_counts()
-            print("\n各源文件贡献的行数:")
-            for file, count in file_counts.items():
-                print(f"  {file}: {count} 行")
-                
+        if export:
+            export_snapshot(store, output_folder, cache)
+    
     except Exception as e:
         print(f"处理数据时出错: {e}")
         import traceback
         traceback.print_exc()
+    finally:
+        cache.save()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="把最新的标签CSV合并到标签总库，并按需导出CSV快照")
+    parser.add_argument('--export', action='store_true', help="合并后导出 Csv_All/所有图片标签_<时间>.csv（供图片查看器导入）")
+    parser.add_argument('--store', help=f"标签总库文件（默认 {DEFAULT_STORE_PATH}）")
+    parser.add_argument('--memory-budget', type=int, default=DEFAULT_MEMORY_BUDGET_MB,
+                        help=f"读取CSV的内存预算（MB），超过时分块读取（默认 {DEFAULT_MEMORY_BUDGET_MB}）")
+    return parser.parse_args(argv)
 
-def main():
-    print("开始合并最新的CSV文件（处理列结构不匹配）...")
+def main(argv=None):
+    args = parse_args(argv)
+    print("开始合并最新的CSV文件到标签总库...")
     print("=" * 50)
-    merge_latest_csv_files()
+    merge_latest_csv_files(export=args.export, store_path=args.store, memory_budget_mb=args.memory_budget)
     print("=" * 50)
     print("处理完成！")
 
@@ -1,8 +1,9 @@
 import os
-import pandas as pd
 import glob
 import re
 from pathlib import Path
+from CSV读写 import DEFAULT_MEMORY_BUDGET_MB, estimate_chunk_rows, find_image_path_column, read_batches
+from 阶段缓存 import StageCache
 
 def find_latest_csv_file(csv_folder):
     """
@@ -18,24 +19,57 @@ def find_latest_csv_file(csv_folder):
     latest_csv = max(csv_files, key=os.path.getmtime)
     return latest_csv
 
-def process_image_paths(df):
+# 路径中完整的一级 Images_To_Sort 目录（前面是路径开头或分隔符，后面是分隔符或结尾），
+# 不会改动 Images_To_Sort_old、My_Images_To_Sort 这类只是包含这段文字的目录名或文件名
+SOURCE_FOLDER = 'Images_To_Sort'
+TARGET_FOLDER = 'Sorted_Images'
+SOURCE_COMPONENT = re.compile(r'(?:^|(?<=[\\/]))Images_To_Sort(?=[\\/]|$)')
+
+def rewrite_paths(paths):
+    """把每个路径中第一个 Images_To_Sort 目录替换为 Sorted_Images，返回新的Series（空值不变）"""
+    return paths.str.replace(SOURCE_COMPONENT, TARGET_FOLDER, n=1, regex=True)
+
+def process_image_paths(df, path_column=None):
     """
     处理DataFrame中的图片路径，将Images_To_Sort替换为Sorted_Images
+    只处理图片路径列（默认按 CSV读写.find_image_path_column 确定），标签等其他列不读取也不改动
     """
-    # 复制DataFrame以避免修改原始数据
-    processed_df = df.copy()
-    
-    # 遍历所有列，查找包含图片路径的列
-    for col in processed_df.columns:
-        # 检查列中是否包含图片路径（包含Images_To_Sort）
-        if processed_df[col].astype(str).str.contains('Images_To_Sort', na=False).any():
-            # 替换路径
-            processed_df[col] = processed_df[col].astype(str).str.replace(
-                'Images_To_Sort', 'Sorted_Images', regex=False
-            )
-    
+    if path_column is None:
+        path_column = find_image_path_column(df.columns)
+    # 浅复制后替换整列，不修改原始数据，也不复制其他列
+    processed_df = df.copy(deep=False)
+    processed_df[path_column] = rewrite_paths(df[path_column])
     return processed_df
 
+def rewrite_csv_file(input_path, output_path, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB, examples=3):
+    """
+    逐块读取CSV、替换图片路径列并追加写出（先写临时文件再替换），内存占用与文件大小无关；
+    所有值按原样读写为字符串。返回 (行数, 替换示例列表[(原路径, 新路径)])
+    """
+    chunk_rows = estimate_chunk_rows(input_path, memory_budget_mb)
+    temp_path = f"{output_path}.part"
+    rows = 0
+    samples = []
+    path_column = None
+    try:
+        with open(temp_path, 'w', encoding='utf-8-sig', newline='') as f:
+            for df in read_batches(input_path, chunk_rows):
+                if path_column is None:
+                    path_column = find_image_path_column(df.columns)
+                processed_df = process_image_paths(df, path_column)
+                processed_df.to_csv(f, index=False, header=rows == 0)
+                rows += len(df)
+                if len(samples) < examples:
+                    changed = df[path_column] != processed_df[path_column]
+                    samples += zip(df[path_column][changed].head(examples - len(samples)),
+                                   processed_df[path_column][changed].head(examples - len(samples)))
+        os.replace(temp_path, output_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return rows, samples
+
 def main():
     # 定义文件夹路径
     script_dir = os.path.dirname(os.path.abspath(__file__))  # 脚本所在目录（项目根目录）
@@ -50,50 +84,35 @@ def main():
         latest_csv = find_latest_csv_file(input_folder)
         print(f"找到最新CSV文件: {os.path.basename(latest_csv)}")
         
-        # 读取CSV文件，处理可能的编码问题
-        try:
-            # 尝试UTF-8编码
-            df = pd.read_csv(latest_csv, encoding='utf-8')
-        except UnicodeDecodeError:
-            try:
-                # 尝试GBK编码（中文）
-                df = pd.read_csv(latest_csv, encoding='gbk')
-            except UnicodeDecodeError:
-                # 尝试其他常见编码
-                df = pd.read_csv(latest_csv, encoding='latin-1')
-        
-        print(f"成功读取CSV文件，共 {len(df)} 行数据")
-        
-        # 处理图片路径
-        processed_df = process_image_paths(df)
-        
         # 生成输出文件名（添加"_true"后缀）
         input_filename = Path(latest_csv).stem  # 获取文件名（不含扩展名）
         output_filename = f"{input_filename}_true.csv"
         output_path = os.path.join(output_folder, output_filename)
         
-        # 保存处理后的数据（使用UTF-8编码避免中文问题）
-        processed_df.to_csv(output_path, index=False, encoding='utf-8-sig')
+        # 输入内容与上次处理时相同且输出文件没有被改动时，不再重新处理
+        cache = StageCache()
+        cache_key = cache.key('csv_true', cache.file_hash(latest_csv), output_path)
+        if cache.lookup('csv_true', cache_key) is not None:
+            print(f"输入文件没有变化，沿用上次的输出: {output_path}")
+            cache.record_run('csv_true', skipped=True)
+            cache.save()
+            return
+        
+        # 逐块读取、只替换图片路径列并写出（使用UTF-8编码避免中文问题），大文件也不会整个读入内存
+        rows, samples = rewrite_csv_file(latest_csv, output_path)
+        cache.store('csv_true', cache_key, outputs=[output_path])
+        cache.record_run('csv_true', skipped=False, rows=rows)
+        cache.save()
         
-        print(f"处理完成！输出文件已保存至: {output_path}")
+        print(f"处理完成！共 {rows} 行数据，输出文件已保存至: {output_path}")
         print(f"原文件: {latest_csv}")
         print(f"新文件: {output_path}")
         
         # 显示一些处理前后的路径对比示例
-        print("\n路径替换示例:")
-        for col in df.columns:
-            if df[col].astype(str).str.contains('Images_To_Sort', na=False).any():
-                # 找到包含Images_To_Sort的行
-                old_paths = df[col].dropna().astype(str)
-                new_paths = processed_df[col].dropna().astype(str)
-                
-                # 显示前3个示例
-                for i, (old, new) in enumerate(zip(old_paths.head(3), new_paths.head(3))):
-                    if 'Images_To_Sort' in old:
-                        print(f"  {old} -> {new}")
-                        if i >= 2:  # 只显示3个示例
-                            break
-                break
+        if samples:
+            print("\n路径替换示例:")
+            for old, new in samples:
+                print(f"  {old} -> {new}")
         
     except FileNotFoundError as e:
         print(f"错误: {e}")
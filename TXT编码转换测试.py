@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TXT编码转换测试
+把同一份合成的 DeepDanbooru 输出TXT分别以 UTF-8、UTF-8(BOM)、GB18030、UTF-16（LE/BE，带BOM，
+即 Windows PowerShell 的 > 重定向输出）、UTF-32（LE/BE，带BOM）写出，逐一转换为CSV，结果必须与UTF-8版本完全一致；
+增量转换（先转换前一半，追加后一半后再转换）的结果同样必须与UTF-8版本一致
+（UTF-16/32 不支持增量转换，每次完整转换，结果应与完整转换相同）；
+--all 模式的并行转换（切成多段）结果也必须与UTF-8版本一致
+有不一致时返回非0
+"""
+
+import argparse
+import sys
+import tempfile
+from pathlib import Path
+
+from 转换TXT到CSV相对路径 import (convert_deepdanbooru_txt_to_csv, convert_txt_files_parallel, convert_txt_to_rows,
+                                 is_ascii_compatible)
+
+ENCODINGS = ['utf-8', 'utf-8-sig', 'gb18030', 'utf-16-le', 'utf-16-be', 'utf-32-le', 'utf-32-be']
+
+BOMS = {'utf-16-le': '\ufeff', 'utf-16-be': '\ufeff', 'utf-32-le': '\ufeff', 'utf-32-be': '\ufeff'}
+
+
+def build_txt(images):
+    """合成的 deepdanbooru evaluate 输出（Windows换行，含中文路径和标签，以及一张没有标签的图片）"""
+    lines = []
+    for i in range(images):
+        lines.append(f"Tags of D:\\图片\\Images_To_Sort\\子文件夹\\img_{i}.jpg:")
+        for j in range(i % 7):
+            lines.append(f"({0.5 + j / 20:.3f}) {'猫耳' if j == 3 else f'tag_{j}'}")
+        lines.append("")
+    return "\r\n".join(lines) + "\r\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TXT编码转换测试")
+    parser.add_argument('--images', type=int, default=200, help="TXT中的图片数量")
+    parser.add_argument('--chunk-size', type=int, default=2048, help="并行转换时每段的大小（字节）")
+    args = parser.parse_args()
+
+    text = build_txt(args.images)
+    failures = 0
+    with tempfile.TemporaryDirectory(prefix='txt_encoding_test_') as work_dir:
+        work_dir = Path(work_dir)
+        expected_rows = None
+        expected_csv = None
+        expected_incremental = None
+        expected_parallel = None
+        half = text.index("Tags of", len(text) // 2)
+        for encoding in ENCODINGS:
+            txt_path = work_dir / f"{encoding}.txt"
+            with open(txt_path, 'w', encoding=encoding, newline='') as f:
+                f.write(BOMS.get(encoding, '') + text)
+
+            rows = convert_txt_to_rows(str(txt_path), str(work_dir / f"{encoding}_rows.csv"), work_dir)
+            csv_path = convert_deepdanbooru_txt_to_csv(str(txt_path), work_dir / f"{encoding}.csv", work_dir)
+            csv_bytes = csv_path.read_bytes() if csv_path else b''
+            if expected_rows is None:
+                expected_rows, expected_csv = rows, csv_bytes
+
+            incremental_txt = work_dir / f"{encoding}_incremental.txt"
+            incremental_csv = work_dir / f"{encoding}_incremental.csv"
+            with open(incremental_txt, 'w', encoding=encoding, newline='') as f:
+                f.write(BOMS.get(encoding, '') + text[:half])
+            convert_deepdanbooru_txt_to_csv(str(incremental_txt), incremental_csv, work_dir, incremental=True)
+            with open(incremental_txt, 'a', encoding=encoding, newline='') as f:
+                f.write(text[half:])
+            convert_deepdanbooru_txt_to_csv(str(incremental_txt), incremental_csv, work_dir, incremental=True)
+            incremental_bytes = incremental_csv.read_bytes()
+            if expected_incremental is None:
+                expected_incremental = incremental_bytes
+
+            parallel_dir = work_dir / f"{encoding}_parallel"
+            parallel_dir.mkdir()
+            parallel_csv = parallel_dir / "all.csv"
+            convert_txt_files_parallel([str(txt_path)], str(parallel_csv), work_dir, max_workers=2,
+                                       chunk_size=args.chunk_size)
+            parallel_bytes = parallel_csv.read_bytes()
+            if expected_parallel is None:
+                expected_parallel = parallel_bytes
+
+            ok = (bool(rows) and rows == expected_rows and csv_bytes == expected_csv
+                  and parallel_bytes == expected_parallel
+                  and incremental_bytes == (expected_incremental if is_ascii_compatible(encoding) else expected_csv))
+            failures += not ok
+            print(f"{'✅' if ok else '❌'} {encoding}: {len(rows)} 张图片")
+
+    print(f"不一致: {failures}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
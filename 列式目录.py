@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+列式标签目录
+与 *_CSV格式.csv 内容相同的另一种存储格式：每个标签只在词表中保存一次，
+每张图片的标签是 int32 标签ID 数组和 float32 置信度数组，读取时不需要再拆分逗号分隔的字符串。
+
+目录结构（二进制文件均为小端序、没有文件头，可以直接用 numpy.memmap 打开）：
+  manifest.json     格式版本、图片数、标签数、条目数和各列的数据类型
+  paths.txt         每行一个图片路径（UTF-8），第 i 行为图片 i
+  path_offsets.bin  int64[图片数+1]，图片 i 的路径是 paths.txt 中 [path_offsets[i], path_offsets[i+1]) 字节（含换行符）
+  vocab.txt         每行一个标签（UTF-8），第 j 行的标签ID为 j
+  offsets.bin       int64[图片数+1]，图片 i 的标签是 tag_ids / confidences 的 [offsets[i], offsets[i+1]) 区间
+  tag_ids.bin       int32[条目数]
+  confidences.bin   float32[条目数]
+
+图片按写入顺序排列。追加写入只在各文件末尾追加，也可以去掉末尾的若干张图片（替换未写完的最后一个块），
+因此增量转换不需要重写整个目录。写入使用标准库 array，读取（TagCatalog）需要 numpy
+"""
+
+import os
+import sys
+import json
+import shutil
+from array import array
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+CATALOG_FORMAT = 'deepdanbooru-tag-catalog'
+CATALOG_VERSION = 1
+
+MANIFEST_FILE = 'manifest.json'
+PATHS_FILE = 'paths.txt'
+PATH_OFFSETS_FILE = 'path_offsets.bin'
+VOCAB_FILE = 'vocab.txt'
+OFFSETS_FILE = 'offsets.bin'
+TAG_IDS_FILE = 'tag_ids.bin'
+CONFIDENCES_FILE = 'confidences.bin'
+
+# 列 -> (文件, array类型码, numpy数据类型)
+COLUMNS = {
+    'path_offsets': (PATH_OFFSETS_FILE, 'q', '<i8'),
+    'offsets': (OFFSETS_FILE, 'q', '<i8'),
+    'tag_ids': (TAG_IDS_FILE, 'i', '<i4'),
+    'confidences': (CONFIDENCES_FILE, 'f', '<f4'),
+}
+
+# 缓冲的标签条目超过这个数量就写入文件
+FLUSH_ENTRIES = 1 << 20
+
+
+def read_manifest(catalog_dir) -> Optional[dict]:
+    try:
+        with open(os.path.join(catalog_dir, MANIFEST_FILE), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('format') != CATALOG_FORMAT or manifest.get('version') != CATALOG_VERSION:
+        return None
+    return manifest
+
+
+def read_vocab_file(vocab_path) -> List[str]:
+    """读取词表文件（每行一个标签），忽略空行和重复的标签"""
+    with open(vocab_path, 'r', encoding='utf-8') as f:
+        return list(dict.fromkeys(line.strip() for line in f if line.strip()))
+
+
+def _write_array(f, values: array):
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    values.tofile(f)
+
+
+class CatalogWriter:
+    """
+    流式写入列式目录，内存中只缓冲最近的一批条目
+    append 为 True 且目录有效时在已有内容后追加，否则重新创建目录；
+    base_vocab_path 为模型的 tags.txt 时，新建目录的标签ID与模型的标签顺序一致
+    """
+
+    def __init__(self, catalog_dir, base_vocab_path=None, append: bool = False):
+        self.catalog_dir = Path(catalog_dir)
+        manifest = read_manifest(self.catalog_dir) if append else None
+        if manifest is None:
+            if self.catalog_dir.exists():
+                shutil.rmtree(self.catalog_dir)
+            self.catalog_dir.mkdir(parents=True)
+            vocab = read_vocab_file(base_vocab_path) if base_vocab_path else []
+            with open(self.catalog_dir / VOCAB_FILE, 'w', encoding='utf-8') as f:
+                f.writelines(tag + '\n' for tag in vocab)
+            manifest = {'images': 0, 'entries': 0, 'paths_bytes': 0, 'tags': len(vocab)}
+            self._write_initial_offsets()
+        else:
+            vocab = read_vocab_file(self.catalog_dir / VOCAB_FILE)
+
+        self.vocab = {tag: tag_id for tag_id, tag in enumerate(vocab)}
+        self.new_tags = []
+        self.images = manifest['images']
+        self.entries = manifest['entries']
+        self.paths_bytes = manifest['paths_bytes']
+        # 上次写入中断时文件可能比清单记录的长，先截断到清单记录的长度
+        self._truncate_files(self.images, self.entries, self.paths_bytes)
+        self._reset_buffers()
+
+    def _write_initial_offsets(self):
+        for name in ('path_offsets', 'offsets'):
+            with open(self.catalog_dir / COLUMNS[name][0], 'wb') as f:
+                _write_array(f, array('q', [0]))
+        for name in ('tag_ids', 'confidences'):
+            open(self.catalog_dir / COLUMNS[name][0], 'wb').close()
+        open(self.catalog_dir / PATHS_FILE, 'wb').close()
+
+    def _reset_buffers(self):
+        self.buffers = {name: array(typecode) for name, (_, typecode, _) in COLUMNS.items()}
+        self.path_buffer = []
+
+    def _truncate_files(self, images: int, entries: int, paths_bytes: int):
+        sizes = {
+            'path_offsets': (images + 1) * 8,
+            'offsets': (images + 1) * 8,
+            'tag_ids': entries * 4,
+            'confidences': entries * 4,
+        }
+        for name, size in sizes.items():
+            os.truncate(self.catalog_dir / COLUMNS[name][0], size)
+        os.truncate(self.catalog_dir / PATHS_FILE, paths_bytes)
+
+    def _read_offset(self, name: str, index: int) -> int:
+        with open(self.catalog_dir / COLUMNS[name][0], 'rb') as f:
+            f.seek(index * 8)
+            value = array('q', f.read(8))
+        if sys.byteorder == 'big':
+            value.byteswap()
+        return value[0]
+
+    def truncate(self, image_count: int):
+        """只保留前 image_count 张图片（追加写入前调用，用于替换末尾的图片）"""
+        self.flush()
+        if image_count >= self.images:
+            return
+        self.entries = self._read_offset('offsets', image_count)
+        self.paths_bytes = self._read_offset('path_offsets', image_count)
+        self.images = image_count
+        self._truncate_files(self.images, self.entries, self.paths_bytes)
+
+    def add(self, path: str, tags: List[str], confidences: List[float]):
+        vocab = self.vocab
+        tag_ids = self.buffers['tag_ids']
+        for tag in tags:
+            tag_id = vocab.get(tag)
+            if tag_id is None:
+                tag_id = vocab[tag] = len(vocab)
+                self.new_tags.append(tag)
+            tag_ids.append(tag_id)
+        self.buffers['confidences'].extend(confidences)
+
+        encoded = (path + '\n').encode('utf-8')
+        self.path_buffer.append(encoded)
+        self.entries += len(tags)
+        self.paths_bytes += len(encoded)
+        self.images += 1
+        self.buffers['offsets'].append(self.entries)
+        self.buffers['path_offsets'].append(self.paths_bytes)
+
+        if len(tag_ids) >= FLUSH_ENTRIES:
+            self.flush()
+
+    def flush(self):
+        for name, values in self.buffers.items():
+            if values:
+                with open(self.catalog_dir / COLUMNS[name][0], 'ab') as f:
+                    _write_array(f, values)
+        if self.path_buffer:
+            with open(self.catalog_dir / PATHS_FILE, 'ab') as f:
+                f.writelines(self.path_buffer)
+        if self.new_tags:
+            with open(self.catalog_dir / VOCAB_FILE, 'a', encoding='utf-8') as f:
+                f.writelines(tag + '\n' for tag in self.new_tags)
+            self.new_tags = []
+        self._reset_buffers()
+
+    def close(self):
+        """写入剩余数据并更新清单；清单最后写入，中途失败时读取方仍看到上次完整的内容"""
+        self.flush()
+        manifest = {
+            'format': CATALOG_FORMAT,
+            'version': CATALOG_VERSION,
+            'images': self.images,
+            'tags': len(self.vocab),
+            'entries': self.entries,
+            'paths_bytes': self.paths_bytes,
+            'columns': {name: {'file': file_name, 'dtype': dtype}
+                        for name, (file_name, _, dtype) in COLUMNS.items()},
+        }
+        manifest_path = self.catalog_dir / MANIFEST_FILE
+        temp_path = manifest_path.with_name(MANIFEST_FILE + '.part')
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, manifest_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+
+
+class TagCatalog:
+    """只读打开列式目录，数组通过内存映射按需读取"""
+
+    def __init__(self, catalog_dir):
+        import numpy as np
+
+        self.catalog_dir = Path(catalog_dir)
+        manifest = read_manifest(self.catalog_dir)
+        if manifest is None:
+            raise ValueError(f"不是有效的列式标签目录: {catalog_dir}")
+        self.manifest = manifest
+        self.vocab = read_vocab_file(self.catalog_dir / VOCAB_FILE)[:manifest['tags']]
+        self._tag_ids_by_name = None
+
+        lengths = {
+            'path_offsets': manifest['images'] + 1,
+            'offsets': manifest['images'] + 1,
+            'tag_ids': manifest['entries'],
+            'confidences': manifest['entries'],
+        }
+        for name, (file_name, _, dtype) in COLUMNS.items():
+            if lengths[name]:
+                values = np.memmap(self.catalog_dir / file_name, dtype=dtype, mode='r', shape=(lengths[name],))
+            else:
+                values = np.empty(0, dtype=dtype)
+            setattr(self, name, values)
+
+        if manifest['paths_bytes']:
+            self._paths = np.memmap(self.catalog_dir / PATHS_FILE, dtype='u1', mode='r',
+                                    shape=(manifest['paths_bytes'],))
+        else:
+            self._paths = np.empty(0, dtype='u1')
+
+    def __len__(self) -> int:
+        return self.manifest['images']
+
+    def path(self, index: int) -> str:
+        start, end = self.path_offsets[index], self.path_offsets[index + 1]
+        return self._paths[start:end - 1].tobytes().decode('utf-8')
+
+    def paths(self) -> List[str]:
+        """所有图片路径（一次读取整个 paths.txt）"""
+        return self._paths.tobytes().decode('utf-8').split('\n')[:len(self)]
+
+    def tags(self, index: int):
+        """图片 index 的 (标签ID数组, 置信度数组)，均为内存映射上的视图"""
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return self.tag_ids[start:end], self.confidences[start:end]
+
+    def tag_names(self, index: int) -> List[str]:
+        vocab = self.vocab
+        return [vocab[tag_id] for tag_id in self.tags(index)[0]]
+
+    def tag_id(self, tag: str) -> Optional[int]:
+        if self._tag_ids_by_name is None:
+            self._tag_ids_by_name = {name: tag_id for tag_id, name in enumerate(self.vocab)}
+        return self._tag_ids_by_name.get(tag)
+
+    def tag_counts(self):
+        """每张图片的标签数量（int64数组）"""
+        import numpy as np
+        return np.diff(self.offsets)
+
+    def iter_records(self) -> Iterator[Tuple[str, List[str], object]]:
+        """逐张产出 (图片路径, [标签], float32置信度数组)"""
+        vocab = self.vocab
+        for index, path in enumerate(self.paths()):
+            tag_ids, confidences = self.tags(index)
+            yield path, [vocab[tag_id] for tag_id in tag_ids], confidences
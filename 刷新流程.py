@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+一键刷新流程（取代 一键刷新.bat 中依次启动的各个程序）
+在同一个进程中依次执行：
+  1. 移动已打过标签的图片（原 MoveSame.bat）
+  2. DeepDanbooru 打标签（原 batch_process.bat；在当前进程中按批推理，见 打标签引擎.py，
+     内容已经打过标签的图片直接使用之前的结果，只为新的或改动过的图片推理；
+     没有安装 tensorflow / deepdanbooru 的Python包时仍调用 deepdanbooru 命令）
+  3. TXT 转 CSV（转换TXT到CSV相对路径.py）
+  4. 图片路径 Images_To_Sort -> Sorted_Images（Csv_true.py）
+  5. 再次移动已打过标签的图片（在合并之前移动，合并时能读到图片在 Sorted_Images 中的修改日期）
+  6. 合并到标签总库并导出CSV快照（Csv_All.py）
+每个程序不再单独启动解释器、导入pandas、按修改时间查找"最新文件"再重新解析上一步刚写出的CSV，
+各步骤之间直接传递内存中的行（打标签的结果也直接交给转换，不再解析TXT）；中间文件（TXT、*_CSV格式.csv、*_true.csv）仍然写出，作为检查点和其他工具的输入。
+转换、路径替换、合并（含修改日期）和导出按输入内容的哈希缓存结果（见 阶段缓存.py），
+输入没有变化的步骤直接沿用上次的输出，没有新数据的刷新几乎不耗时；各步骤执行或跳过记录在 Index_Cache/stage_cache.json
+
+用法：
+    python 刷新流程.py
+    python 刷新流程.py --txt Exported_Labels/图片标签数据_xxx.txt   # 跳过打标签，转换指定的TXT
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import itertools
+import tempfile
+import subprocess
+from pathlib import Path
+
+import pandas as pd
+
+import Csv_All
+from CSV读写 import iter_csv_rows, write_dataframe
+from Csv_true import process_image_paths, rewrite_csv_file
+from 列式目录 import MANIFEST_FILE
+from 性能统计 import PerformanceStats
+from 文件索引 import path_key
+from 标签总库 import TagStore
+from 阶段缓存 import StageCache
+from 打标签引擎 import (DEFAULT_BATCH_SIZE, TaggingEngine, content_hashes, find_tagging_images, model_key,
+                       record_tagged, split_tagged, write_records_txt)
+from 转换TXT到CSV相对路径 import (CSV_HEADER, MODEL_TAGS_PATH, build_matrix_for_catalog, convert_txt_to_rows,
+                                 detect_file_encoding, find_latest_txt_file, iter_image_records, records_to_rows)
+
+ROOT_DIR = Path(__file__).resolve().parent
+
+IMAGES_TO_SORT = "Images_To_Sort"
+SORTED_IMAGES = "Sorted_Images"
+EXPORTED_LABELS = "Exported_Labels"
+EXPORTED_LABELS_CSV = "Exported_Labels_csv"
+EXPORTED_LABELS_CSV_TRUE = "Exported_Labels_csv_true"
+CSV_ALL = "Csv_All"
+
+MODEL_PATH = os.path.join("Model_Files", "deepdanbooru-v3-20211112-sgd-e28")
+TAG_THRESHOLD = 0.5
+
+
+def run_tagging_subprocess(image_paths):
+    """
+    调用 deepdanbooru 命令为指定的图片打标签，按 image_paths 的顺序返回记录列表（图片路径为原来的路径）
+    图片先硬链接（无法链接时复制）到临时文件夹，deepdanbooru 只处理这些图片
+    """
+    executable = shutil.which("deepdanbooru")
+    if executable is None:
+        raise RuntimeError("未找到 deepdanbooru 命令，请确认已安装 DeepDanbooru")
+    # 临时文件夹放在 Images_To_Sort 旁边（同一磁盘才能建立硬链接），不会被当作待打标签的图片
+    staging_parent = os.path.dirname(os.path.abspath(IMAGES_TO_SORT))
+    with tempfile.TemporaryDirectory(prefix=".tagging_", dir=staging_parent) as staging_dir:
+        original_paths = {}  # 临时文件的路径键 -> 原图片路径
+        for index, image_path in enumerate(image_paths):
+            staged_path = os.path.join(staging_dir, f"{index:06d}{os.path.splitext(image_path)[1]}")
+            try:
+                os.link(image_path, staged_path)
+            except OSError:
+                shutil.copy2(image_path, staged_path)
+            original_paths[path_key(os.path.abspath(staged_path))] = image_path
+
+        txt_file_path = os.path.join(staging_dir, "evaluate.txt")
+        print("⏳ 正在加载模型并处理图片，请稍候...")
+        with open(txt_file_path, "wb") as f:
+            subprocess.run([executable, "evaluate", staging_dir, "--project-path", MODEL_PATH,
+                            "--allow-folder", "--threshold", str(TAG_THRESHOLD)], stdout=f, check=True)
+        results = {}
+        for _, image_path, tags, confidences in iter_image_records(txt_file_path, detect_file_encoding(txt_file_path)):
+            original_path = original_paths.get(path_key(os.path.abspath(image_path)))
+            if original_path is not None:
+                results[original_path] = (tags, confidences)
+        # 没有超过阈值的标签的图片不会出现在解析结果中，记为空结果（与在当前进程中推理相同），
+        # 保存到标签总库后下次不再推理
+        return [(image_path, *results.get(image_path, ([], []))) for image_path in image_paths]
+
+
+def run_tagging(images, stats, batch_size=DEFAULT_BATCH_SIZE, threads=None, retag=False):
+    """
+    为 Images_To_Sort 中的图片打标签，返回 (输出的TXT路径, 记录列表)
+    内容已经打过标签的图片（按内容哈希在标签总库中查询）直接使用之前的结果，只为新的或改动过的图片推理，
+    retag 为 True 时全部重新推理；需要推理时才加载模型。
+    无法导入 tensorflow / deepdanbooru 时退回调用 deepdanbooru 命令（同样只处理需要推理的图片）
+    """
+    os.makedirs(EXPORTED_LABELS, exist_ok=True)
+    txt_file_path = os.path.join(EXPORTED_LABELS, f"图片标签数据_{time.strftime('%Y%m%d_%H%M%S')}.txt")
+    store = TagStore()
+    model = model_key(MODEL_PATH, TAG_THRESHOLD)
+    if retag:
+        reused, todo, hashes = [], list(images), content_hashes(images, store)
+    else:
+        reused, todo, hashes = split_tagged(images, store, model)
+        print(f"内容已打过标签的图片 {len(reused)} 张（直接使用之前的结果），需要推理 {len(todo)} 张")
+    stats.count("reused_tag_results", len(reused))
+
+    engine = None
+    inferred = []
+    if todo:
+        try:
+            engine = TaggingEngine.from_project(MODEL_PATH, TAG_THRESHOLD, batch_size, threads)
+        except ImportError as e:
+            print(f"⚠️  无法在当前进程中加载模型（{e}），改为调用 deepdanbooru 命令")
+            inferred = run_tagging_subprocess(todo)
+        else:
+            print(f"⏳ 正在处理图片，每批 {engine.batch_size} 张...")
+            inferred = engine.tag_images(todo)
+    records = list(write_records_txt(itertools.chain(reused, inferred), txt_file_path))
+    if engine is not None:
+        print(engine.summary())
+    if todo:
+        stats.count("inferred_images", len(records) - len(reused))
+        record_tagged(store, model, records[len(reused):], hashes)
+    print(f"✅ 标签文件已生成: {txt_file_path}")
+    return txt_file_path, records
+
+
+def csv_image_paths(csv_file):
+    """CSV第一列的图片路径（只读取第一列，不解析成DataFrame）"""
+    rows = iter_csv_rows(str(csv_file))
+    next(rows, None)
+    for row in rows:
+        if row and row[0]:
+            yield row[0]
+
+
+def listed_image_paths(csv_dir):
+    """Exported_Labels_csv 中所有CSV第一列的图片路径"""
+    for csv_file in sorted(Path(csv_dir).glob("*.csv")):
+        yield from csv_image_paths(csv_file)
+
+
+def move_listed_images(image_paths, dest_dir=SORTED_IMAGES):
+    """把列出的、仍在原位置的图片移动到 Sorted_Images（与 MoveSame.bat 相同，移动到目标文件夹根目录）"""
+    os.makedirs(dest_dir, exist_ok=True)
+    moved = skipped = 0
+    for image_path in image_paths:
+        if os.path.isfile(image_path):
+            os.replace(image_path, os.path.join(dest_dir, os.path.basename(image_path)))
+            moved += 1
+        else:
+            skipped += 1
+    print(f"移动图片 {moved} 张，跳过（已不在原位置）{skipped} 张")
+    return moved
+
+
+def convert_stage(txt_file_path, cache, records=None):
+    """
+    TXT转CSV：返回 (DataFrame, 检查点CSV路径, 图片数)，DataFrame 的值全部为字符串（与读取CSV时一致）；
+    records 为打标签引擎刚产出的记录（与TXT内容相同）时直接使用，不再解析TXT；
+    TXT、模型词表与上次转换时相同且输出没有被改动时跳过，DataFrame 为None（需要时从检查点读取）
+    """
+    os.makedirs(EXPORTED_LABELS_CSV, exist_ok=True)
+    csv_file_path = os.path.join(EXPORTED_LABELS_CSV, f"{Path(txt_file_path).stem}_CSV格式.csv")
+    catalog_dir = Path(csv_file_path).with_suffix(".catalog")
+    base_vocab_path = MODEL_TAGS_PATH if os.path.exists(MODEL_TAGS_PATH) else None
+
+    key = cache.key('convert', cache.file_hash(txt_file_path), str(ROOT_DIR), csv_file_path,
+                    cache.file_hash(base_vocab_path) if base_vocab_path else None)
+    entry = cache.lookup('convert', key)
+    if entry is not None:
+        print(f"TXT没有变化，沿用上次的转换结果: {csv_file_path}（{entry['rows']} 张图片）")
+        cache.record_run('convert', skipped=True)
+        return None, csv_file_path, entry['rows']
+
+    if records is not None:
+        rows = records_to_rows(records, csv_file_path, ROOT_DIR, catalog_dir, base_vocab_path)
+    else:
+        rows = convert_txt_to_rows(txt_file_path, csv_file_path, ROOT_DIR, catalog_dir, base_vocab_path)
+    print(f"✅ 转换完成: {len(rows)} 张图片 -> {csv_file_path}")
+    if rows:
+        build_matrix_for_catalog(catalog_dir)
+    cache.store('convert', key, outputs=[csv_file_path, catalog_dir / MANIFEST_FILE], rows=len(rows))
+    cache.record_run('convert', skipped=False, rows=len(rows))
+    return pd.DataFrame(rows, columns=CSV_HEADER).astype(str), csv_file_path, len(rows)
+
+
+def rewrite_paths_stage(df, csv_file_path, cache):
+    """
+    Images_To_Sort -> Sorted_Images：返回处理后的DataFrame和写出的检查点CSV路径；
+    转换结果与上次相同且输出没有被改动时跳过；跳过或 df 为None（逐块处理检查点文件）时返回的DataFrame为None
+    """
+    os.makedirs(EXPORTED_LABELS_CSV_TRUE, exist_ok=True)
+    true_csv_path = os.path.join(EXPORTED_LABELS_CSV_TRUE, f"{Path(csv_file_path).stem}_true.csv")
+    key = cache.key('rewrite', cache.file_hash(csv_file_path), true_csv_path)
+    if cache.lookup('rewrite', key) is not None:
+        print(f"转换结果没有变化，沿用上次的路径替换结果: {true_csv_path}")
+        cache.record_run('rewrite', skipped=True)
+        return None, true_csv_path
+
+    if df is None:
+        # 内存中没有转换结果时逐块处理检查点文件，合并时同样按文件读取
+        processed_df = None
+        rewrite_csv_file(csv_file_path, true_csv_path)
+    else:
+        processed_df = process_image_paths(df)
+        write_dataframe(processed_df, true_csv_path)
+    print(f"✅ 路径替换完成 -> {true_csv_path}")
+    cache.store('rewrite', key, outputs=[true_csv_path])
+    cache.record_run('rewrite', skipped=False)
+    return processed_df, true_csv_path
+
+
+def merge_stage(df, true_csv_path, cache, export=True):
+    """
+    合并到标签总库（Csv_All中有外部写入的新快照时先以它重建总库），需要时导出CSV快照
+    true_csv_path 已合并过（签名或内容相同）时跳过合并；总库自上次导出后没有变化时不再导出新的快照；
+    本次没有新数据时检查最新的 *_true.csv 是否已合并（上次刷新在合并前中断的情况）
+    """
+    os.makedirs(CSV_ALL, exist_ok=True)
+    store = TagStore()
+    print(f"标签总库: {store.db_path}（现有 {len(store)} 张图片）")
+    mtime_cache = {}
+    Csv_All.sync_with_latest_snapshot(store, CSV_ALL, mtime_cache)
+    if true_csv_path is None:
+        true_csv_path = Csv_All.get_latest_csv(EXPORTED_LABELS_CSV_TRUE)
+        if true_csv_path:
+            print(f"检查最新的路径替换结果是否已合并: {true_csv_path}")
+    if true_csv_path:
+        if Csv_All.already_merged(store, true_csv_path, cache):
+            print(f"{os.path.basename(true_csv_path)} 已合并过且没有变化，跳过合并")
+            cache.record_run('merge', skipped=True)
+        else:
+            # 内存中没有这一批数据时（路径替换沿用了缓存）按文件合并
+            if df is not None:
+                result = Csv_All.merge_dataframe(store, df, true_csv_path, mtime_cache)
+            else:
+                result = Csv_All.upsert_csv_file(store, true_csv_path, mtime_cache)
+            if result:
+                Csv_All.print_merge_result(result)
+                cache.store('merge', Csv_All.merge_cache_key(store, true_csv_path, cache))
+            cache.record_run('merge', skipped=False)
+    print(f"总库现有 {len(store)} 张图片")
+    if export:
+        Csv_All.export_snapshot(store, CSV_ALL, cache)
+
+
+def run_pipeline(txt_file_path=None, skip_tagging=False, export=True, batch_size=DEFAULT_BATCH_SIZE, threads=None,
+                 retag=False):
+    stats = PerformanceStats()
+    total_start = time.time()
+
+    print("[1/6] 移动已打过标签的图片...")
+    with stats.phase("move_before"):
+        if os.path.isdir(EXPORTED_LABELS_CSV):
+            move_listed_images(listed_image_paths(EXPORTED_LABELS_CSV))
+        else:
+            print(f"文件夹 {EXPORTED_LABELS_CSV} 不存在，跳过")
+
+    print("\n[2/6] DeepDanbooru 打标签...")
+    records = None
+    with stats.phase("tagging"):
+        if txt_file_path is None and not skip_tagging:
+            images = find_tagging_images(IMAGES_TO_SORT) if os.path.isdir(IMAGES_TO_SORT) else []
+            if images:
+                print(f"待打标签的图片: {len(images)} 张")
+                txt_file_path, records = run_tagging(images, stats, batch_size, threads, retag)
+            else:
+                print(f"{IMAGES_TO_SORT} 中没有待打标签的图片，跳过")
+        elif skip_tagging and txt_file_path is None:
+            txt_file_path = find_latest_txt_file(EXPORTED_LABELS)
+            print(f"跳过打标签，使用最新的TXT: {txt_file_path}")
+        else:
+            print(f"跳过打标签，使用指定的TXT: {txt_file_path}")
+
+    cache = StageCache()
+    converted = processed = csv_file_path = true_csv_path = None
+    image_count = 0
+    if txt_file_path:
+        print("\n[3/6] TXT转CSV...")
+        with stats.phase("convert"):
+            converted, csv_file_path, image_count = convert_stage(txt_file_path, cache, records)
+
+        if image_count:
+            print("\n[4/6] 替换图片路径...")
+            with stats.phase("rewrite_paths"):
+                processed, true_csv_path = rewrite_paths_stage(converted, csv_file_path, cache)
+    else:
+        print("\n[3/6] [4/6] 没有新的标签数据，跳过")
+
+    print("\n[5/6] 移动已打过标签的图片...")
+    with stats.phase("move_after"):
+        if converted is not None:
+            # 直接使用本次转换的结果（路径替换之前的原始路径），不重新读取CSV
+            move_listed_images(converted[CSV_HEADER[0]].tolist())
+        elif image_count:
+            move_listed_images(csv_image_paths(csv_file_path))
+        else:
+            print("没有新的标签数据，跳过")
+
+    print("\n[6/6] 合并到标签总库...")
+    with stats.phase("merge"):
+        merge_stage(processed, true_csv_path, cache, export)
+    cache.save()
+
+    print("\n" + "=" * 50)
+    print(f"刷新完成，总耗时 {time.time() - total_start:.2f}秒")
+    for line in stats.summary_lines():
+        print(line)
+    skipped = cache.skipped_stages()
+    if skipped:
+        print(f"输入没有变化、沿用上次结果的步骤: {', '.join(skipped)}（见 {cache.manifest_path}）")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="一键刷新：打标签、转换、路径替换、合并到标签总库")
+    parser.add_argument("--txt", help="跳过打标签，直接转换指定的DeepDanbooru输出TXT")
+    parser.add_argument("--skip-tagging", action="store_true", help="跳过打标签，转换 Exported_Labels 中最新的TXT")
+    parser.add_argument("--no-export", action="store_true", help="只合并到标签总库，不导出CSV快照")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f"打标签时每批推理的图片数（默认 {DEFAULT_BATCH_SIZE}）")
+    parser.add_argument("--threads", type=int, help="打标签时一次推理使用的线程数（默认CPU核数）")
+    parser.add_argument("--retag", action="store_true", help="所有图片重新推理（默认内容打过标签的图片沿用之前的结果）")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    txt_file_path = os.path.abspath(args.txt) if args.txt else None
+    # 各步骤使用相对于项目根目录的路径（与原来的批处理一致）
+    os.chdir(ROOT_DIR)
+    try:
+        run_pipeline(txt_file_path, args.skip_tagging, export=not args.no_export,
+                     batch_size=args.batch_size, threads=args.threads, retag=args.retag)
+    except (OSError, RuntimeError, subprocess.CalledProcessError) as e:
+        print(f"❌ 刷新失败: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+路径纠正的性能统计
+记录各阶段耗时、每个搜索文件夹的索引情况、查找延迟分布和文件系统调用次数，
+运行结束后可以导出为JSON，便于对比不同版本或不同目录树上的表现
+"""
+
+import json
+import math
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict
+
+
+def _bucket_label(bucket: int) -> str:
+    """查找延迟按2的幂分桶（单位：微秒）"""
+    if bucket < 0:
+        return "<1us"
+    return f"{2 ** bucket}-{2 ** (bucket + 1)}us"
+
+
+class PerformanceStats:
+    """线程安全的计数和计时（建索引时多个线程同时写入）"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.total_files = 0
+        # 存在性判断：命中内存索引 / 需要访问文件系统
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.search_time = 0.0
+        self.phases: Dict[str, float] = defaultdict(float)  # 阶段 -> 秒
+        self.folders: Dict[str, Dict] = {}  # 搜索文件夹 -> 索引信息
+        self.counters: Dict[str, int] = defaultdict(int)  # 文件系统调用等计数
+        self.lookup_histogram: Dict[int, int] = defaultdict(int)
+        self.lookup_count = 0
+        self.lookup_max = 0.0
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name: str, seconds: float):
+        with self.lock:
+            self.phases[name] += seconds
+
+    def count(self, name: str, amount: int = 1):
+        with self.lock:
+            self.counters[name] += amount
+
+    def record_folder(self, folder: str, **info):
+        with self.lock:
+            self.folders[folder] = info
+
+    def record_lookup(self, seconds: float):
+        microseconds = seconds * 1e6
+        bucket = int(math.log2(microseconds)) if microseconds >= 1 else -1
+        with self.lock:
+            self.search_time += seconds
+            self.lookup_count += 1
+            self.lookup_max = max(self.lookup_max, seconds)
+            self.lookup_histogram[bucket] += 1
+
+    def to_dict(self) -> Dict:
+        with self.lock:
+            return {
+                'total_files': self.total_files,
+                'cache_hits': self.cache_hits,
+                'cache_misses': self.cache_misses,
+                'phases': {name: round(seconds, 6) for name, seconds in self.phases.items()},
+                'folders': dict(self.folders),
+                'counters': dict(self.counters),
+                'lookups': {
+                    'count': self.lookup_count,
+                    'total_seconds': round(self.search_time, 6),
+                    'max_ms': round(self.lookup_max * 1000, 3),
+                    'histogram': {_bucket_label(bucket): self.lookup_histogram[bucket]
+                                  for bucket in sorted(self.lookup_histogram)},
+                },
+            }
+
+    def export_json(self, file_path: str):
+        with open(file_path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+
+    def summary_lines(self):
+        """各阶段耗时的简短说明，用于日志"""
+        with self.lock:
+            lines = [f"  {name}: {seconds:.3f}秒" for name, seconds in self.phases.items()]
+            if self.counters:
+                lines.append("  " + ", ".join(f"{name}={value}" for name, value in self.counters.items()))
+        return lines
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+DeepDanbooru 打标签引擎（在当前进程中推理）
+取代 `deepdanbooru evaluate ... --allow-folder > xxx.txt`：模型只加载一次，图片按批送入模型（CPU推理），
+读取和解码下一批图片与当前批的推理同时进行；结果直接以 (图片路径, [标签], [置信度]) 记录交给转换步骤，
+不再把标准输出写成TXT后重新解析。TXT仍按 deepdanbooru evaluate 的格式写出，作为检查点和其他工具的输入。
+
+模型、标签表和图片读取都可以替换：TaggingEngine 只要求 predict(批量图片数组) 返回 (图片数, 标签数) 的概率，
+没有安装 TensorFlow / DeepDanbooru 的机器上也能用一个小的桩模型和桩读取函数运行。
+
+增量打标签：推理结果按图片内容哈希保存在标签总库中（哈希按 路径+大小+修改时间 缓存），
+内容打过标签的图片直接使用之前的结果（split_tagged），只有新的或改动过的图片送去推理
+
+用法：
+    python 打标签引擎.py Images_To_Sort --project-path Model_Files/deepdanbooru-v3-20211112-sgd-e28
+"""
+
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from 文件索引 import FINGERPRINT_WORKERS, full_fingerprint, path_key
+
+# 与 deepdanbooru evaluate --allow-folder 默认处理的图片格式一致
+TAGGING_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif')
+
+DEFAULT_THRESHOLD = 0.5
+DEFAULT_BATCH_SIZE = 16
+# 一次推理内部使用的线程数默认为CPU核数；逐批推理时同时执行的运算很少，运算之间的并行线程数取2
+DEFAULT_INTER_OP_THREADS = 2
+# 读取和解码图片的线程数（解码在TensorFlow中进行，不占用GIL）
+DEFAULT_LOAD_WORKERS = min(8, os.cpu_count() or 1)
+
+# (图片路径, [标签], [置信度])，与 转换TXT到CSV相对路径.iter_image_records 产出的记录（去掉偏移）相同
+TagRecord = Tuple[str, List[str], List[float]]
+
+
+def find_tagging_images(folder: str) -> List[str]:
+    """文件夹（含子文件夹）中需要打标签的图片，按路径排序"""
+    images = []
+    for dir_path, _, file_names in os.walk(folder):
+        for name in file_names:
+            if os.path.splitext(name)[1].lower() in TAGGING_EXTENSIONS:
+                images.append(os.path.join(dir_path, name))
+    return sorted(images)
+
+
+def model_key(project_path: str, threshold: float) -> str:
+    """区分打标签结果的模型标识：模型文件夹名 + 阈值（阈值不同时保存的标签不同）"""
+    return f"{Path(project_path).name}@{threshold}"
+
+
+def _hash_file(entry: Tuple[str, str, int, int]) -> Optional[str]:
+    try:
+        return full_fingerprint(entry[0])
+    except OSError:
+        return None
+
+
+def content_hashes(image_paths: Sequence[str], store) -> Dict[str, str]:
+    """
+    图片的内容哈希，返回 图片路径 -> 哈希（无法读取的图片不返回）
+    哈希按 (路径, 大小, 修改时间) 缓存在标签总库中，只读取新的或改动过的文件
+    """
+    entries = []  # (图片路径, 路径键, 大小, 修改时间ns)
+    for image_path in image_paths:
+        try:
+            stat = os.stat(image_path)
+        except OSError:
+            continue
+        entries.append((image_path, path_key(os.path.abspath(image_path)), stat.st_size, stat.st_mtime_ns))
+
+    cached = store.file_hashes([entry[1:] for entry in entries])
+    hashes = {}
+    todo = []
+    for entry in entries:
+        if entry[1] in cached:
+            hashes[entry[0]] = cached[entry[1]]
+        else:
+            todo.append(entry)
+    with ThreadPoolExecutor(max_workers=FINGERPRINT_WORKERS) as executor:
+        computed = [(entry, digest) for entry, digest in zip(todo, executor.map(_hash_file, todo)) if digest]
+    store.record_file_hashes((*entry[1:], digest) for entry, digest in computed)
+    hashes.update((entry[0], digest) for entry, digest in computed)
+    return hashes
+
+
+def split_tagged(image_paths: Sequence[str], store, model: str) -> Tuple[List[TagRecord], List[str], Dict[str, str]]:
+    """
+    按内容哈希查询标签总库中已有的打标签结果，返回 (已有结果的记录, 需要推理的图片, 图片路径 -> 哈希)；
+    文件改名或移动过但内容相同的图片同样直接使用之前的结果
+    """
+    hashes = content_hashes(image_paths, store)
+    known = store.tag_results(sorted(set(hashes.values())), model)
+    reused = []
+    todo = []
+    for image_path in image_paths:
+        result = known.get(hashes.get(image_path))
+        if result is not None:
+            reused.append((image_path, *result))
+        else:
+            todo.append(image_path)
+    return reused, todo, hashes
+
+
+def record_tagged(store, model: str, records: Iterable[TagRecord], hashes: Dict[str, str]):
+    """
+    把推理得到的记录按内容哈希保存到标签总库，下次遇到相同内容的图片时不再推理
+    记录与哈希按路径键（绝对路径，Windows上不区分大小写和斜杠方向）对应
+    """
+    keyed = {path_key(os.path.abspath(image_path)): digest for image_path, digest in hashes.items()}
+    results = []
+    for image_path, tags, confidences in records:
+        digest = keyed.get(path_key(os.path.abspath(image_path)))
+        if digest is not None:
+            results.append((digest, tags, confidences))
+    store.record_tag_results(model, results)
+
+
+def configure_threads(intra_op_threads: Optional[int] = None, inter_op_threads: int = DEFAULT_INTER_OP_THREADS):
+    """设置TensorFlow的线程数，必须在加载模型（第一次执行运算）之前调用"""
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads or os.cpu_count() or 1)
+    tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+
+
+class TaggingEngine:
+    """
+    按批为图片打标签
+    predict: 输入 (批大小, 高, 宽, 3) 的 float32 数组，返回 (批大小, 标签数) 的概率
+    image_loader: (图片路径, 宽, 高) -> (高, 宽, 3) 的数组，默认使用 DeepDanbooru 的读取方式（缩放并补边，归一化到0-1）
+    """
+
+    def __init__(self, predict: Callable[[np.ndarray], np.ndarray], tags: Sequence[str], input_size: Tuple[int, int],
+                 threshold: float = DEFAULT_THRESHOLD, batch_size: int = DEFAULT_BATCH_SIZE,
+                 image_loader: Optional[Callable[[str, int, int], np.ndarray]] = None,
+                 load_workers: int = DEFAULT_LOAD_WORKERS):
+        self.predict = predict
+        self.tags = list(tags)
+        self.height, self.width = input_size
+        self.threshold = threshold
+        self.batch_size = max(1, batch_size)
+        self.image_loader = image_loader or load_image_for_evaluate
+        self.load_workers = max(1, load_workers)
+        self.images = 0
+        self.failed = 0
+        self.seconds = 0.0
+
+    @classmethod
+    def from_project(cls, project_path: str, threshold: float = DEFAULT_THRESHOLD,
+                     batch_size: int = DEFAULT_BATCH_SIZE, intra_op_threads: Optional[int] = None,
+                     inter_op_threads: int = DEFAULT_INTER_OP_THREADS) -> 'TaggingEngine':
+        """从 DeepDanbooru 项目文件夹加载模型和标签表（需要 tensorflow 和 deepdanbooru）"""
+        configure_threads(intra_op_threads, inter_op_threads)
+        import deepdanbooru as dd
+
+        start_time = time.time()
+        model = dd.project.load_model_from_project(project_path, compile_model=False)
+        tags = dd.project.load_tags_from_project(project_path)
+        print(f"模型已加载: {project_path}（{len(tags)} 个标签），耗时 {time.time() - start_time:.2f}秒")
+        return cls(model.predict_on_batch, tags, model.input_shape[1:3], threshold, batch_size)
+
+    @property
+    def images_per_second(self) -> float:
+        return self.images / self.seconds if self.seconds else 0.0
+
+    def _load(self, image_path: str) -> Optional[np.ndarray]:
+        try:
+            return np.asarray(self.image_loader(image_path, self.width, self.height), dtype=np.float32)
+        except Exception as e:
+            print(f"⚠️  无法读取图片，跳过: {image_path}（{e}）")
+            return None
+
+    def _records(self, image_paths: Sequence[str], images: List[Optional[np.ndarray]]) -> Iterator[TagRecord]:
+        loaded = [i for i, image in enumerate(images) if image is not None]
+        self.failed += len(images) - len(loaded)
+        if not loaded:
+            return
+        probabilities = np.asarray(self.predict(np.stack([images[i] for i in loaded])))
+        above = probabilities >= self.threshold
+        for row, i in enumerate(loaded):
+            indices = np.flatnonzero(above[row])
+            # 置信度保留3位小数，与 deepdanbooru evaluate 输出的 "(0.987) tag" 解析后的值相同
+            yield (image_paths[i], [self.tags[j] for j in indices],
+                   [round(float(probabilities[row, j]), 3) for j in indices])
+        self.images += len(loaded)
+
+    def tag_images(self, image_paths: Iterable[str]) -> Iterator[TagRecord]:
+        """
+        逐张产出 (图片路径, [标签], [置信度])，标签按标签表的顺序排列（与 deepdanbooru evaluate 相同），
+        没有超过阈值的标签时列表为空；读取失败的图片跳过。推理当前批时，下一批图片已在后台读取
+        """
+        image_paths = list(image_paths)
+        batches = [image_paths[start:start + self.batch_size] for start in range(0, len(image_paths), self.batch_size)]
+        start_time = time.time()
+        try:
+            with ThreadPoolExecutor(max_workers=self.load_workers) as executor:
+                pending = [executor.submit(self._load, path) for path in batches[0]] if batches else []
+                for index, batch in enumerate(batches):
+                    images = [future.result() for future in pending]
+                    if index + 1 < len(batches):
+                        pending = [executor.submit(self._load, path) for path in batches[index + 1]]
+                    yield from self._records(batch, images)
+        finally:
+            self.seconds += time.time() - start_time
+
+    def summary(self) -> str:
+        text = f"打标签完成: {self.images} 张图片，耗时 {self.seconds:.2f}秒（{self.images_per_second:.2f} 张/秒）"
+        if self.failed:
+            text += f"，{self.failed} 张无法读取"
+        return text
+
+
+def load_image_for_evaluate(image_path: str, width: int, height: int) -> np.ndarray:
+    """与 deepdanbooru evaluate 相同的读取方式（需要 deepdanbooru）"""
+    import deepdanbooru as dd
+    return dd.data.load_image_for_evaluate(image_path, width=width, height=height)
+
+
+def write_records_txt(records: Iterable[TagRecord], txt_file_path: str) -> Iterator[TagRecord]:
+    """
+    把记录按 deepdanbooru evaluate 的输出格式写入TXT，同时原样产出每条记录（边推理边写出）；
+    写完后才替换为正式文件名，中途失败不会留下半个TXT
+    """
+    temp_path = f"{txt_file_path}.part"
+    try:
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            for record in records:
+                image_path, tags, confidences = record
+                f.write(f"Tags of {image_path}:\n")
+                for tag, confidence in zip(tags, confidences):
+                    f.write(f"({confidence:05.3f}) {tag}\n")
+                f.write("\n")
+                yield record
+        os.replace(temp_path, txt_file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="用 DeepDanbooru 模型为文件夹中的图片打标签，输出与 deepdanbooru evaluate 相同格式的TXT")
+    parser.add_argument("folder", help="图片文件夹（包含子文件夹）")
+    parser.add_argument("--project-path", required=True, help="DeepDanbooru 项目（模型）文件夹")
+    parser.add_argument("--output", help="输出的TXT文件（默认 Exported_Labels/图片标签数据_<时间>.txt）")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help=f"标签阈值（默认 {DEFAULT_THRESHOLD}）")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help=f"每批推理的图片数（默认 {DEFAULT_BATCH_SIZE}）")
+    parser.add_argument("--threads", type=int, help="一次推理使用的线程数（默认CPU核数）")
+    parser.add_argument("--inter-op-threads", type=int, default=DEFAULT_INTER_OP_THREADS,
+                        help=f"同时执行的运算数（默认 {DEFAULT_INTER_OP_THREADS}）")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    images = find_tagging_images(args.folder)
+    if not images:
+        print(f"{args.folder} 中没有需要打标签的图片")
+        return 0
+    output = args.output or os.path.join("Exported_Labels", f"图片标签数据_{time.strftime('%Y%m%d_%H%M%S')}.txt")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+
+    try:
+        engine = TaggingEngine.from_project(args.project_path, args.threshold, args.batch_size,
+                                            args.threads, args.inter_op_threads)
+    except ImportError as e:
+        print(f"❌ 需要安装 tensorflow 和 deepdanbooru: {e}")
+        return 1
+    print(f"待打标签的图片: {len(images)} 张，每批 {engine.batch_size} 张")
+    for _ in write_records_txt(engine.tag_images(images), output):
+        pass
+    print(engine.summary())
+    print(f"✅ 标签文件已生成: {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
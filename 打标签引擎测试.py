@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+打标签引擎测试
+不需要 TensorFlow / DeepDanbooru：TaggingEngine 使用桩模型（固定权重的线性层+sigmoid）和桩读取函数
+（按文件内容生成确定的图片数组，内容为 broken 的文件读取失败），检查：
+  1. 分批：不同批大小得到完全相同的记录，每次送入模型的图片数不超过批大小，读取失败的图片跳过
+  2. 阈值：每张图片的标签正好是概率不低于阈值的标签（按标签表顺序），置信度为概率保留3位小数
+  3. 复用：推理结果按内容哈希保存到临时标签总库后，再次查询时内容相同的图片（包括改名的副本）直接使用之前的结果，
+     改动过的图片重新推理；记录的路径写法与查询时不同（./ 前缀、斜杠方向）也能对应
+有不一致时返回非0
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import zlib
+
+import numpy as np
+
+from 打标签引擎 import TaggingEngine, record_tagged, split_tagged
+from 标签总库 import TagStore
+
+INPUT_SIZE = (8, 8)
+
+
+def build_model(tag_count, seed=0):
+    weights = np.random.default_rng(seed).normal(size=(INPUT_SIZE[0] * INPUT_SIZE[1] * 3, tag_count))
+    batch_sizes = []
+
+    def predict(batch):
+        batch_sizes.append(len(batch))
+        # 逐张计算，结果与批大小无关
+        return np.stack([1 / (1 + np.exp(-(image.ravel() @ weights) / 4)) for image in batch])
+
+    return predict, batch_sizes
+
+
+def load_stub_image(image_path, width, height):
+    with open(image_path, 'rb') as f:
+        data = f.read()
+    if data == b'broken':
+        raise ValueError("无法解码")
+    return np.random.default_rng(zlib.crc32(data)).random((height, width, 3))
+
+
+def write_images(folder, count):
+    paths = []
+    for i in range(count):
+        path = os.path.join(folder, f"img_{i}.jpg")
+        with open(path, 'wb') as f:
+            f.write(b'broken' if i == count // 2 else f"image {i}".encode())
+        paths.append(path)
+    return paths
+
+
+def check(name, ok, failures):
+    print(f"{'✅' if ok else '❌'} {name}")
+    if not ok:
+        failures.append(name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="打标签引擎测试")
+    parser.add_argument('--images', type=int, default=50, help="图片数量")
+    parser.add_argument('--tags', type=int, default=300, help="标签表大小")
+    parser.add_argument('--threshold', type=float, default=0.5, help="阈值")
+    args = parser.parse_args()
+
+    tags = [f"tag_{i}" for i in range(args.tags)]
+    failures = []
+    with tempfile.TemporaryDirectory(prefix='tagging_engine_test_') as work_dir:
+        image_dir = os.path.join(work_dir, "Images_To_Sort")
+        os.makedirs(image_dir)
+        images = write_images(image_dir, args.images)
+
+        # 1. 分批
+        results = {}
+        for batch_size in (1, 3, 16, args.images + 10):
+            predict, batch_sizes = build_model(len(tags))
+            engine = TaggingEngine(predict, tags, INPUT_SIZE, args.threshold, batch_size,
+                                   image_loader=load_stub_image, load_workers=4)
+            records = list(engine.tag_images(images))
+            results[batch_size] = records
+            check(f"批大小 {batch_size}: {len(records)} 条记录，{engine.failed} 张无法读取，送入模型 {len(batch_sizes)} 批",
+                  len(records) == args.images - 1 and engine.failed == 1 and engine.images == len(records)
+                  and max(batch_sizes) <= batch_size and sum(batch_sizes) == len(records), failures)
+        baseline = results[1]
+        check("不同批大小的记录完全一致", all(records == baseline for records in results.values()), failures)
+
+        # 2. 阈值
+        predict, _ = build_model(len(tags))
+        mismatched = 0
+        for image_path, record_tags, confidences in baseline:
+            probabilities = predict(np.asarray([load_stub_image(image_path, INPUT_SIZE[1], INPUT_SIZE[0])],
+                                               dtype=np.float32))[0]
+            indices = np.flatnonzero(probabilities >= args.threshold)
+            expected = ([tags[j] for j in indices], [round(float(probabilities[j]), 3) for j in indices])
+            mismatched += (record_tags, confidences) != expected
+        check(f"阈值 {args.threshold}: 标签与置信度不一致 {mismatched} 张", mismatched == 0, failures)
+
+        predict, _ = build_model(len(tags))
+        strict = list(TaggingEngine(predict, tags, INPUT_SIZE, 0.9, 16, image_loader=load_stub_image).tag_images(images))
+        check("提高阈值后每张图片的标签都是原来的子集",
+              all(set(high[1]) <= set(low[1]) and all(c >= 0.9 for c in high[2])
+                  for high, low in zip(strict, baseline)), failures)
+
+        # 3. 复用
+        store = TagStore(os.path.join(work_dir, "标签总库.sqlite3"))
+        model = "stub"
+        reused, todo, hashes = split_tagged(images, store, model)
+        check(f"首次查询: 复用 {len(reused)} 张，需要推理 {len(todo)} 张", not reused and todo == images, failures)
+        # 记录中的路径换一种写法，仍然要按路径键对应到内容哈希
+        record_tagged(store, model, [("./" + os.path.relpath(path).replace(os.sep, "/"), record_tags, confidences)
+                                     for path, record_tags, confidences in baseline], hashes)
+
+        renamed = os.path.join(image_dir, "renamed.jpg")
+        with open(images[0], 'rb') as src, open(renamed, 'wb') as dst:
+            dst.write(src.read())
+        with open(images[1], 'ab') as f:
+            f.write(b" changed")
+        reused, todo, _ = split_tagged(images + [renamed], store, model)
+        by_path = {record[0]: record[1:] for record in baseline}
+        check(f"再次查询: 复用 {len(reused)} 张，需要推理 {len(todo)} 张",
+              sorted(todo) == sorted([images[1], images[args.images // 2]])
+              and len(reused) == args.images - 1
+              and all(record[1:] == by_path[images[0] if record[0] == renamed else record[0]] for record in reused),
+              failures)
+
+    print(f"不一致: {len(failures)}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
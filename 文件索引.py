@@ -0,0 +1,475 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+文件索引
+1. FileNameIndex：内存中的多键索引（文件名 / 文件名主干 / 去掉图片扩展名的文件名），每种查找都是一次哈希命中
+2. PersistentFileIndex：将搜索文件夹的目录结构和文件列表保存在SQLite中，
+   下次运行时只重新扫描修改时间（mtime）发生变化的目录；
+   可选地为文件计算内容指纹（大小 + 首尾数据块的哈希），用于找回改过名的图片
+"""
+
+import os
+import hashlib
+import queue
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+# 索引结构版本，结构变化时旧索引会被丢弃并重新构建
+SCHEMA_VERSION = 2
+
+# 默认索引文件位置（脚本所在目录下的 Index_Cache 文件夹）
+DEFAULT_INDEX_PATH = Path(__file__).resolve().parent / "Index_Cache" / "file_index.sqlite3"
+
+# 扫描时刚被修改过的目录不记录真实mtime，保证下次运行一定重新扫描，
+# 避免同一时间粒度内的后续改动被漏掉
+MTIME_GUARD_NS = 2_000_000_000
+
+# 内容指纹读取文件开头和结尾各这么多字节
+FINGERPRINT_BLOCK_SIZE = 16 * 1024
+
+# 扫描目录的线程数（以I/O等待为主，线程数可以多于CPU核数）
+SCAN_WORKERS = min(32, (os.cpu_count() or 4) * 4)
+
+# 计算指纹的线程数
+FINGERPRINT_WORKERS = 8
+
+# 文件名不带扩展名时尝试的图片扩展名
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tiff', '.webp']
+
+
+def split_suffix(name: str) -> Tuple[str, str]:
+    """按 pathlib 的规则拆分文件名主干和扩展名，避免为每个文件创建 Path 对象"""
+    i = name.rfind('.')
+    if 0 < i < len(name) - 1:
+        return name[:i], name[i:]
+    return name, ''
+
+
+def path_key(path: str) -> str:
+    """路径比较用的键：统一分隔符并去掉多余的 . 和 ..；在不区分大小写的系统上转为小写"""
+    return os.path.normcase(os.path.normpath(path))
+
+
+def partial_fingerprint(path: str, size: int) -> str:
+    """文件大小 + 开头和结尾数据块的哈希，不读取整个文件"""
+    digest = hashlib.blake2b(str(size).encode('ascii'), digest_size=16)
+    with open(path, 'rb') as f:
+        digest.update(f.read(FINGERPRINT_BLOCK_SIZE))
+        if size > FINGERPRINT_BLOCK_SIZE:
+            f.seek(max(FINGERPRINT_BLOCK_SIZE, size - FINGERPRINT_BLOCK_SIZE))
+            digest.update(f.read(FINGERPRINT_BLOCK_SIZE))
+    return digest.hexdigest()
+
+
+def full_fingerprint(path: str) -> str:
+    """整个文件内容的哈希，只在部分指纹相同时计算"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _safe_fingerprint(func, *args) -> Optional[str]:
+    try:
+        return func(*args)
+    except OSError:
+        return None
+
+
+def _dir_mtime(dir_path: str) -> Optional[int]:
+    try:
+        return os.stat(dir_path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def scan_one_dir(dir_path: str, stat_files: bool = True):
+    """
+    列出单个目录，返回 (目录, mtime_ns, [(文件名, 大小, mtime_ns)], [子目录])
+    目录无法访问时 mtime_ns 为 None；stat_files 为 False 时大小和mtime记为0
+    """
+    files = []
+    subdirs = []
+    try:
+        # 先取mtime再列目录：扫描期间发生的改动会让下次的mtime不一致
+        mtime = os.stat(dir_path).st_mtime_ns
+        with os.scandir(dir_path) as it:
+            for entry in it:
+                try:
+                    # 与os.walk一致：不进入符号链接指向的目录
+                    if entry.is_dir():
+                        if not entry.is_symlink():
+                            subdirs.append(entry.path)
+                    elif stat_files:
+                        stat = entry.stat()
+                        files.append((entry.name, stat.st_size, stat.st_mtime_ns))
+                    else:
+                        files.append((entry.name, 0, 0))
+                except OSError:
+                    continue
+    except OSError:
+        return dir_path, None, [], []
+    return dir_path, mtime, files, subdirs
+
+
+def scan_directories(start_dirs: List[str], skip=(), max_workers: int = SCAN_WORKERS,
+                     stop_event=None, stat_files: bool = True) -> List[tuple]:
+    """
+    并行扫描目录树：以子目录为单位分配任务，空闲线程从共享队列领取下一个目录，
+    因此只有一个很大的搜索文件夹时也能用满所有线程。
+    每个线程把结果写入自己的列表，全部完成后按目录路径排序合并，结果与线程调度无关。
+    skip 中的子目录不会被递归扫描；返回 scan_one_dir 结果的列表
+    """
+    if not start_dirs:
+        return []
+
+    work = queue.Queue()
+    lock = threading.Lock()
+    remaining = [len(start_dirs)]  # 已入队但尚未扫描完的目录数
+    workers = max(1, max_workers)
+    partials = [[] for _ in range(workers)]
+
+    for dir_path in start_dirs:
+        work.put(dir_path)
+
+    def worker(out: list):
+        while True:
+            dir_path = work.get()
+            if dir_path is None:
+                return
+            new_dirs = []
+            try:
+                if stop_event is None or not stop_event.is_set():
+                    result = scan_one_dir(dir_path, stat_files)
+                    out.append(result)
+                    new_dirs = [d for d in result[3] if d not in skip]
+            finally:
+                with lock:
+                    remaining[0] += len(new_dirs) - 1
+                    finished = remaining[0] == 0
+                for sub_dir in new_dirs:
+                    work.put(sub_dir)
+                if finished:
+                    for _ in range(workers):
+                        work.put(None)
+
+    threads = [threading.Thread(target=worker, args=(partial,), daemon=True) for partial in partials]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    merged = [result for partial in partials for result in partial]
+    merged.sort(key=lambda result: result[0])
+    return merged
+
+
+class FileNameIndex:
+    """
+    多键文件名索引，键全部为小写：
+    - by_name：完整文件名 -> 路径集合
+    - by_stem：文件名主干 -> 路径集合
+    - by_image_stem：图片文件去掉扩展名后的文件名 -> 路径集合
+    """
+
+    def __init__(self):
+        self.by_name: Dict[str, Set[str]] = defaultdict(set)
+        self.by_stem: Dict[str, Set[str]] = defaultdict(set)
+        self.by_image_stem: Dict[str, Set[str]] = defaultdict(set)
+
+    def __len__(self) -> int:
+        return len(self.by_name)
+
+    def add(self, name: str, full_path: str):
+        name_lower = name.lower()
+        stem, suffix = split_suffix(name_lower)
+        self.by_name[name_lower].add(full_path)
+        self.by_stem[stem].add(full_path)
+        if suffix in IMAGE_EXTENSIONS:
+            self.by_image_stem[stem].add(full_path)
+
+    def remove(self, name: str, full_path: str):
+        name_lower = name.lower()
+        stem, _ = split_suffix(name_lower)
+        for index, key in ((self.by_name, name_lower), (self.by_stem, stem), (self.by_image_stem, stem)):
+            paths = index.get(key)
+            if paths is not None:
+                paths.discard(full_path)
+                if not paths:
+                    del index[key]
+
+    def lookup(self, filename: str) -> Set[str]:
+        """精确文件名、无扩展名时的图片扩展名、文件名主干三种方式匹配，结果取并集"""
+        filename_lower = filename.lower()
+        filename_stem, suffix = split_suffix(filename_lower)
+        found_files = set()
+
+        # 精确匹配
+        found_files.update(self.by_name.get(filename_lower, ()))
+
+        # 如果没有扩展名，尝试常见图片扩展名
+        if not suffix:
+            found_files.update(self.by_image_stem.get(filename_lower, ()))
+
+        # 匹配文件名主干
+        found_files.update(self.by_stem.get(filename_stem, ()))
+        return found_files
+
+    def contains_path(self, full_path: str) -> bool:
+        """判断索引中是否有这个文件，只比较同名的几个候选路径，不访问文件系统"""
+        name = os.path.basename(full_path.replace('\\', '/'))
+        candidates = self.by_name.get(name.lower())
+        if not candidates:
+            return False
+        key = path_key(full_path)
+        return any(path_key(candidate) == key for candidate in candidates)
+
+    def clear(self):
+        self.by_name.clear()
+        self.by_stem.clear()
+        self.by_image_stem.clear()
+
+
+class PersistentFileIndex:
+    """保存在磁盘上的文件索引，按目录mtime增量更新"""
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = Path(db_path) if db_path else DEFAULT_INDEX_PATH
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._init_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        # 每次调用使用独立连接，允许多个线程同时刷新不同的搜索文件夹
+        conn = sqlite3.connect(str(self.db_path), timeout=60)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _init_db(self):
+        with closing(self._connect()) as conn:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version != SCHEMA_VERSION:
+                conn.executescript("""
+                    DROP TABLE IF EXISTS dirs;
+                    DROP TABLE IF EXISTS files;
+                    DROP TABLE IF EXISTS fingerprints;
+                """)
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS dirs (
+                    root TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    PRIMARY KEY (root, path)
+                );
+                CREATE TABLE IF NOT EXISTS files (
+                    root TEXT NOT NULL,
+                    dir TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    PRIMARY KEY (root, dir, name)
+                );
+                -- 文件消失后指纹记录仍然保留，用于按内容找回被改名或移动的文件
+                CREATE TABLE IF NOT EXISTS fingerprints (
+                    key TEXT PRIMARY KEY,
+                    root TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    partial TEXT NOT NULL,
+                    full TEXT
+                );
+                CREATE INDEX IF NOT EXISTS fingerprints_root ON fingerprints (root);
+            """)
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            conn.commit()
+
+    def refresh(self, root: str, stop_event=None, max_workers: int = SCAN_WORKERS,
+                changes: Optional[Dict[str, Tuple[List[str], List[str]]]] = None) -> Optional[Dict[str, int]]:
+        """
+        增量更新指定搜索文件夹的索引
+        首次运行时完整扫描；之后只对mtime变化的目录重新列出内容，
+        新出现的子目录递归扫描，消失的目录从索引中删除。
+        检查mtime和扫描目录都由线程池并行完成，数据库只在当前线程写入。
+        传入 changes 时记录每个重新扫描或消失的目录：目录 -> (原来的文件名, 现在的文件名)
+        返回统计信息，被中止时返回None（本次改动不提交）
+        """
+        scan_started_ns = time.time_ns()
+        with closing(self._connect()) as conn:
+            known = dict(conn.execute("SELECT path, mtime_ns FROM dirs WHERE root = ?", (root,)))
+            pending: List[str] = []
+
+            if not known:
+                pending.append(root)
+            else:
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    mtimes = list(executor.map(_dir_mtime, known))
+                if stop_event is not None and stop_event.is_set():
+                    return None
+                for (dir_path, old_mtime), mtime in zip(known.items(), mtimes):
+                    if mtime is None:
+                        if changes is not None:
+                            changes[dir_path] = (self._dir_names(conn, root, dir_path), [])
+                        self._forget_dir(conn, root, dir_path)
+                    elif mtime != old_mtime:
+                        pending.append(dir_path)
+
+            # 已知子目录由它们自己的mtime判断，只递归新出现的子目录
+            results = scan_directories(pending, skip=known, max_workers=max_workers, stop_event=stop_event)
+            if stop_event is not None and stop_event.is_set():
+                conn.rollback()
+                return None
+
+            for dir_path, mtime, files, _ in results:
+                if changes is not None:
+                    changes[dir_path] = (self._dir_names(conn, root, dir_path),
+                                         [name for name, _, _ in files] if mtime is not None else [])
+                self._store_dir(conn, root, dir_path, mtime, files, scan_started_ns)
+
+            conn.commit()
+
+            total_dirs = conn.execute("SELECT COUNT(*) FROM dirs WHERE root = ?", (root,)).fetchone()[0]
+            total_files = conn.execute("SELECT COUNT(*) FROM files WHERE root = ?", (root,)).fetchone()[0]
+
+        return {
+            'cold': not known,
+            'checked_dirs': len(known),
+            'scanned_dirs': len(results),
+            'total_dirs': total_dirs,
+            'total_files': total_files,
+        }
+
+    def _store_dir(self, conn: sqlite3.Connection, root: str, dir_path: str, mtime: Optional[int],
+                   files: List[Tuple[str, int, int]], scan_started_ns: int):
+        """用单个目录的扫描结果替换索引中的记录"""
+        if mtime is None:
+            self._forget_dir(conn, root, dir_path)
+            return
+
+        if scan_started_ns - mtime < MTIME_GUARD_NS:
+            mtime = -1
+
+        conn.execute("DELETE FROM files WHERE root = ? AND dir = ?", (root, dir_path))
+        conn.executemany(
+            "INSERT OR REPLACE INTO files (root, dir, name, size, mtime_ns) VALUES (?, ?, ?, ?, ?)",
+            ((root, dir_path, name, size, file_mtime) for name, size, file_mtime in files)
+        )
+        conn.execute(
+            "INSERT OR REPLACE INTO dirs (root, path, mtime_ns) VALUES (?, ?, ?)",
+            (root, dir_path, mtime)
+        )
+
+    def _dir_names(self, conn: sqlite3.Connection, root: str, dir_path: str) -> List[str]:
+        return [name for name, in conn.execute("SELECT name FROM files WHERE root = ? AND dir = ?", (root, dir_path))]
+
+    def _forget_dir(self, conn: sqlite3.Connection, root: str, dir_path: str):
+        conn.execute("DELETE FROM dirs WHERE root = ? AND path = ?", (root, dir_path))
+        conn.execute("DELETE FROM files WHERE root = ? AND dir = ?", (root, dir_path))
+
+    def iter_entries(self, root: str) -> Iterator[Tuple[str, str, int, int]]:
+        """逐个返回 (所在目录, 文件名, 大小, 修改时间ns)"""
+        with closing(self._connect()) as conn:
+            yield from conn.execute("SELECT dir, name, size, mtime_ns FROM files WHERE root = ?", (root,))
+
+    def update_fingerprints(self, root: str, files: List[Tuple[str, int, int]], stop_event=None,
+                            counters: Optional[Dict[str, int]] = None
+                            ) -> Optional[Dict[Tuple[int, str], List[Tuple[str, Optional[str]]]]]:
+        """
+        为搜索文件夹中的文件计算内容指纹，按 (路径, 大小, mtime) 缓存，未变化的文件不再读取
+        files 为 (完整路径, 大小, 修改时间ns) 列表
+        部分指纹相同的文件再计算完整哈希加以区分
+        counters 不为None时累加 fingerprints_reused / fingerprints_computed / full_hashes_computed
+        返回 (大小, 部分指纹) -> [(完整路径, 完整哈希)]，被中止时返回None
+        """
+        with closing(self._connect()) as conn:
+            cached = {
+                key: (size, mtime_ns, partial, full)
+                for key, size, mtime_ns, partial, full in conn.execute(
+                    "SELECT key, size, mtime_ns, partial, full FROM fingerprints WHERE root = ?", (root,))
+            }
+
+            entries = []  # [完整路径, key, 大小, mtime, 部分指纹, 完整哈希]
+            todo = []
+            for full_path, size, mtime_ns in files:
+                key = path_key(full_path)
+                record = cached.get(key)
+                if record is not None and record[0] == size and record[1] == mtime_ns:
+                    entries.append([full_path, key, size, mtime_ns, record[2], record[3]])
+                else:
+                    entries.append([full_path, key, size, mtime_ns, None, None])
+                    todo.append(entries[-1])
+
+            with ThreadPoolExecutor(max_workers=FINGERPRINT_WORKERS) as executor:
+                partials = executor.map(lambda e: _safe_fingerprint(partial_fingerprint, e[0], e[2]), todo)
+                for entry, partial in zip(todo, partials):
+                    if stop_event is not None and stop_event.is_set():
+                        executor.shutdown(wait=False, cancel_futures=True)
+                        return None
+                    entry[4] = partial
+
+                groups = defaultdict(list)
+                for entry in entries:
+                    if entry[4] is not None:
+                        groups[(entry[2], entry[4])].append(entry)
+
+                # 部分指纹冲突时才计算完整哈希
+                collided = [entry for group in groups.values() if len(group) > 1
+                            for entry in group if entry[5] is None]
+                fulls = executor.map(lambda e: _safe_fingerprint(full_fingerprint, e[0]), collided)
+                for entry, full in zip(collided, fulls):
+                    if stop_event is not None and stop_event.is_set():
+                        executor.shutdown(wait=False, cancel_futures=True)
+                        return None
+                    entry[5] = full
+
+            if counters is not None:
+                counters['fingerprints_reused'] = counters.get('fingerprints_reused', 0) + len(entries) - len(todo)
+                counters['fingerprints_computed'] = counters.get('fingerprints_computed', 0) + len(todo)
+                counters['full_hashes_computed'] = counters.get('full_hashes_computed', 0) + len(collided)
+
+            todo_ids = {id(entry) for entry in todo}
+            changed = todo + [entry for entry in collided if id(entry) not in todo_ids]
+            conn.executemany(
+                "INSERT OR REPLACE INTO fingerprints (key, root, size, mtime_ns, partial, full) VALUES (?, ?, ?, ?, ?, ?)",
+                ((entry[1], root, entry[2], entry[3], entry[4], entry[5]) for entry in changed if entry[4] is not None)
+            )
+            conn.commit()
+
+        return {
+            fingerprint: [(entry[0], entry[5]) for entry in group]
+            for fingerprint, group in groups.items()
+        }
+
+    def fingerprint_history(self, keys: List[str]) -> Dict[str, Tuple[int, str, Optional[str]]]:
+        """查询路径最后一次记录的指纹（文件已不存在时依然可查），返回 key -> (大小, 部分指纹, 完整哈希)"""
+        result = {}
+        if not keys:
+            return result
+        with closing(self._connect()) as conn:
+            unique_keys = list(set(keys))
+            # 分批查询，避免超过SQLite的参数数量限制
+            for start in range(0, len(unique_keys), 500):
+                chunk = unique_keys[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                for key, size, partial, full in conn.execute(
+                        f"SELECT key, size, partial, full FROM fingerprints WHERE key IN ({placeholders})", chunk):
+                    result[key] = (size, partial, full)
+        return result
+
+    def clear(self, root: Optional[str] = None):
+        """清除索引（指定root时只清除该搜索文件夹）"""
+        with closing(self._connect()) as conn:
+            if root is None:
+                conn.execute("DELETE FROM dirs")
+                conn.execute("DELETE FROM files")
+                conn.execute("DELETE FROM fingerprints")
+            else:
+                conn.execute("DELETE FROM dirs WHERE root = ?", (root,))
+                conn.execute("DELETE FROM files WHERE root = ?", (root,))
+            conn.commit()
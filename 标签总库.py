@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+图片标签总库
+以规范化的图片路径为主键，把所有图片的标签数据保存在SQLite（WAL模式）中。
+Csv_All.py 每次只把新的一批数据 upsert 进来：已有的图片就地更新，新图片追加到末尾，
+不再读取上一次的完整快照、整体去重再写出一个新的CSV，耗时与这一批的大小成正比。
+所有图片标签_<时间>.csv 快照改为按需导出（export_csv），供图片查看器导入；
+导出和合并过的CSV都记录签名，Csv_All 中出现其他程序写入的快照（如路径修正结果）时可以识别出来；
+另外按图片内容哈希记录打标签的结果，内容没有变化的图片不再重新推理（见 打标签引擎.py）
+"""
+
+import os
+import csv
+import json
+import sqlite3
+from contextlib import closing
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+# 总库结构版本，结构变化时旧数据会被丢弃（可以从CSV快照重新导入）
+SCHEMA_VERSION = 2
+
+# 默认总库位置（与CSV快照放在同一个文件夹）
+DEFAULT_STORE_PATH = Path(__file__).resolve().parent / "Csv_All" / "标签总库.sqlite3"
+
+# SQLite 单条语句的参数个数有上限，按主键查询时分批
+QUERY_CHUNK_SIZE = 500
+
+
+def source_signature(file_path: str) -> List:
+    """合并来源文件的签名：(文件名, 大小, 修改时间ns)"""
+    stat = os.stat(file_path)
+    return [os.path.basename(file_path), stat.st_size, stat.st_mtime_ns]
+
+
+class TagStore:
+    """
+    图片标签总库
+    列结构在第一次写入时确定（保存在 meta 表中），之后写入的行需要先对齐到这个列结构；
+    每行以JSON数组保存，导出时按图片第一次加入总库的顺序输出
+    """
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = Path(db_path) if db_path else DEFAULT_STORE_PATH
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._init_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(str(self.db_path), timeout=60)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _init_db(self):
+        with closing(self._connect()) as conn:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version != SCHEMA_VERSION:
+                conn.executescript("""
+                    DROP TABLE IF EXISTS meta;
+                    DROP TABLE IF EXISTS images;
+                    DROP TABLE IF EXISTS sources;
+                """)
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                );
+                -- path 为规范化的路径键；seq 为图片第一次加入总库的顺序，更新时不变；
+                -- rank 为行中路径写法的优先级（如绝对路径高于相对路径）
+                CREATE TABLE IF NOT EXISTS images (
+                    path TEXT PRIMARY KEY,
+                    seq INTEGER NOT NULL,
+                    rank INTEGER NOT NULL,
+                    row TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS images_seq ON images (seq);
+                -- 已经合并过的来源文件，文件没变时不再重复合并
+                CREATE TABLE IF NOT EXISTS sources (
+                    name TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    rows INTEGER NOT NULL,
+                    merged_at TEXT NOT NULL
+                );
+                -- 图片文件的内容哈希，按 (路径, 大小, 修改时间) 缓存，文件没变时不再读取
+                CREATE TABLE IF NOT EXISTS file_hashes (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    hash TEXT NOT NULL
+                );
+                -- 打标签的结果（超过阈值的标签和置信度），按内容哈希和模型（含阈值）保存
+                CREATE TABLE IF NOT EXISTS tag_results (
+                    hash TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    tags TEXT NOT NULL,
+                    confidences TEXT NOT NULL,
+                    PRIMARY KEY (hash, model)
+                );
+            """)
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            conn.commit()
+
+    def __len__(self) -> int:
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+
+    @property
+    def columns(self) -> Optional[List[str]]:
+        """总库的列结构，尚未写入任何数据时为None"""
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'columns'").fetchone()
+        return json.loads(row[0]) if row else None
+
+    @property
+    def revision(self) -> int:
+        """总库内容的版本号，每次内容发生变化时加一（用于判断导出的快照是否仍然是最新的）"""
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'revision'").fetchone()
+        return int(row[0]) if row else 0
+
+    @staticmethod
+    def _bump_revision(conn: sqlite3.Connection):
+        conn.execute("""INSERT INTO meta (key, value) VALUES ('revision', '1')
+                        ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1""")
+
+    def set_columns(self, columns: Sequence[str]):
+        """设置列结构（只能在总库为空时设置，避免已有的行与列对不上）"""
+        with closing(self._connect()) as conn:
+            if conn.execute("SELECT 1 FROM images LIMIT 1").fetchone():
+                raise ValueError("总库中已有数据，不能修改列结构")
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('columns', ?)",
+                         (json.dumps(list(columns), ensure_ascii=False),))
+            self._bump_revision(conn)
+            conn.commit()
+
+    def is_merged(self, file_path: str) -> bool:
+        """来源文件是否已经合并过且之后没有变化"""
+        name, size, mtime_ns = source_signature(file_path)
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT size, mtime_ns FROM sources WHERE name = ?", (name,)).fetchone()
+        return row is not None and tuple(row) == (size, mtime_ns)
+
+    def upsert(self, records: Iterable[Tuple[str, int, Sequence[str]]], path_index: int = 0) -> Dict[str, int]:
+        """
+        写入一批 (路径键, 路径优先级, 行)，行已对齐到总库的列结构：
+        新图片追加，已有图片更新，内容相同的行不改动；
+        已有记录的路径写法优先级更高时（如绝对路径），更新其他列但保留原来的路径写法。
+        返回 {'inserted', 'updated', 'unchanged'}
+        """
+        # 同一批中路径键重复时保留优先级高的，优先级相同时以后面的为准
+        batch = {}
+        for key, rank, row in records:
+            if key not in batch or rank >= batch[key][0]:
+                batch[key] = (rank, list(row))
+
+        with closing(self._connect()) as conn:
+            keys = list(batch)
+            existing = {}
+            for start in range(0, len(keys), QUERY_CHUNK_SIZE):
+                chunk = keys[start:start + QUERY_CHUNK_SIZE]
+                placeholders = ",".join("?" * len(chunk))
+                for key, rank, row in conn.execute(
+                        f"SELECT path, rank, row FROM images WHERE path IN ({placeholders})", chunk):
+                    existing[key] = (rank, row)
+
+            for key, (rank, old_row) in existing.items():
+                new_rank, row = batch[key]
+                if rank > new_rank:
+                    row[path_index] = json.loads(old_row)[path_index]
+                    batch[key] = (rank, row)
+
+            next_seq = conn.execute("SELECT COALESCE(MAX(seq), -1) + 1 FROM images").fetchone()[0]
+            changes_before = conn.total_changes
+            conn.executemany(
+                """INSERT INTO images (path, seq, rank, row) VALUES (?, ?, ?, ?)
+                   ON CONFLICT (path) DO UPDATE SET rank = excluded.rank, row = excluded.row
+                   WHERE images.row != excluded.row OR images.rank != excluded.rank""",
+                ((key, next_seq + i, rank, json.dumps(row, ensure_ascii=False))
+                 for i, (key, (rank, row)) in enumerate(batch.items()))
+            )
+            changed = conn.total_changes - changes_before
+            if changed:
+                self._bump_revision(conn)
+            conn.commit()
+
+        inserted = len(batch) - len(existing)
+        return {
+            'inserted': inserted,
+            'updated': changed - inserted,
+            'unchanged': len(batch) - changed,
+        }
+
+    def record_source(self, file_path: str, rows: int):
+        """记录已合并或由总库导出的CSV文件，文件不变时之后不会再被当作新数据合并"""
+        name, size, mtime_ns = source_signature(file_path)
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sources (name, size, mtime_ns, rows, merged_at) VALUES (?, ?, ?, ?, ?)",
+                (name, size, mtime_ns, rows, datetime.now().isoformat(timespec='seconds'))
+            )
+            conn.commit()
+
+    def _select_in(self, conn: sqlite3.Connection, sql: str, keys: Sequence[str], *params) -> Iterator[Tuple]:
+        """按主键分批查询（sql 中的 {placeholders} 替换为参数占位符）"""
+        for start in range(0, len(keys), QUERY_CHUNK_SIZE):
+            chunk = list(keys[start:start + QUERY_CHUNK_SIZE])
+            yield from conn.execute(sql.format(placeholders=",".join("?" * len(chunk))), [*params, *chunk])
+
+    def file_hashes(self, files: Sequence[Tuple[str, int, int]]) -> Dict[str, str]:
+        """files 为 (路径键, 大小, 修改时间ns)，返回大小和修改时间与记录相同的文件的 路径键 -> 内容哈希"""
+        signatures = {key: (size, mtime_ns) for key, size, mtime_ns in files}
+        with closing(self._connect()) as conn:
+            return {
+                key: digest
+                for key, size, mtime_ns, digest in self._select_in(
+                    conn, "SELECT path, size, mtime_ns, hash FROM file_hashes WHERE path IN ({placeholders})",
+                    list(signatures))
+                if signatures[key] == (size, mtime_ns)
+            }
+
+    def record_file_hashes(self, entries: Iterable[Tuple[str, int, int, str]]):
+        """记录 (路径键, 大小, 修改时间ns, 内容哈希)"""
+        with closing(self._connect()) as conn:
+            conn.executemany("INSERT OR REPLACE INTO file_hashes (path, size, mtime_ns, hash) VALUES (?, ?, ?, ?)",
+                             entries)
+            conn.commit()
+
+    def tag_results(self, hashes: Sequence[str], model: str) -> Dict[str, Tuple[List[str], List[float]]]:
+        """查询内容哈希已有的打标签结果，返回 哈希 -> ([标签], [置信度])"""
+        with closing(self._connect()) as conn:
+            return {
+                digest: (json.loads(tags), json.loads(confidences))
+                for digest, tags, confidences in self._select_in(
+                    conn, "SELECT hash, tags, confidences FROM tag_results WHERE model = ? AND hash IN ({placeholders})",
+                    list(hashes), model)
+            }
+
+    def record_tag_results(self, model: str, results: Iterable[Tuple[str, Sequence[str], Sequence[float]]]):
+        """记录 (内容哈希, [标签], [置信度])"""
+        with closing(self._connect()) as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO tag_results (hash, model, tags, confidences) VALUES (?, ?, ?, ?)",
+                ((digest, model, json.dumps(list(tags), ensure_ascii=False), json.dumps(list(confidences)))
+                 for digest, tags, confidences in results)
+            )
+            conn.commit()
+
+    def clear(self):
+        """
+        清空总库中的图片和列结构，用于以完整的快照重建总库；
+        已合并的来源记录保留（快照已包含它们的内容，不应再次合并回来），打标签的结果与快照无关，同样保留
+        """
+        with closing(self._connect()) as conn:
+            conn.execute("DELETE FROM images")
+            conn.execute("DELETE FROM meta WHERE key = 'columns'")
+            self._bump_revision(conn)
+            conn.commit()
+
+    def iter_rows(self) -> Iterator[List[str]]:
+        """按加入顺序逐行读取，不把整个总库放进内存"""
+        with closing(self._connect()) as conn:
+            for row, in conn.execute("SELECT row FROM images ORDER BY seq"):
+                yield json.loads(row)
+
+    def export_csv(self, file_path: str, encoding: str = 'utf-8-sig') -> int:
+        """导出CSV快照（先写临时文件再替换），返回行数"""
+        columns = self.columns
+        if columns is None:
+            raise ValueError("总库为空，没有可导出的数据")
+        temp_path = f"{file_path}.part"
+        count = 0
+        try:
+            with open(temp_path, 'w', encoding=encoding, newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(columns)
+                for row in self.iter_rows():
+                    writer.writerow(row)
+                    count += 1
+            os.replace(temp_path, file_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        self.record_source(file_path, count)
+        return count
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+图片×标签稀疏矩阵
+由列式标签目录（见 列式目录.py）生成，保存在目录下的 matrix/ 中，全部为可内存映射的 .npy 文件：
+  csr_indptr.npy   int64[图片数+1]  按图片（行）存储，行内标签ID升序
+  csr_indices.npy  int32[条目数]    标签ID
+  csr_data.npy     float32[条目数]  置信度
+  csc_indptr.npy   int64[标签数+1]  按标签（列）存储，列内图片ID升序
+  csc_indices.npy  int32[条目数]    图片ID
+  csc_data.npy     float32[条目数]  置信度
+  matrix.json      矩阵形状和生成时列式目录的签名（目录变化后需要重新生成）
+图片ID为列式目录中的图片序号（paths.txt 的行号），标签ID为 vocab.txt 的行号。
+标签筛选、计数和共现统计都是对内存映射数组的向量化运算，不需要解析文本；
+安装了 scipy 时可以直接得到 scipy.sparse.csr_matrix
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from 列式目录 import COLUMNS, TagCatalog, read_manifest
+
+MATRIX_DIR = 'matrix'
+MATRIX_INFO = 'matrix.json'
+MATRIX_VERSION = 1
+
+ARRAYS = ('csr_indptr', 'csr_indices', 'csr_data', 'csc_indptr', 'csc_indices', 'csc_data')
+
+
+def catalog_signature(catalog_dir) -> Optional[dict]:
+    """列式目录的签名：清单中的计数 + 标签数组文件的大小和修改时间（替换最后一张图片时计数可能不变）"""
+    manifest = read_manifest(catalog_dir)
+    if manifest is None:
+        return None
+    signature = {key: manifest[key] for key in ('images', 'tags', 'entries')}
+    for name in ('tag_ids', 'confidences'):
+        stat = os.stat(os.path.join(catalog_dir, COLUMNS[name][0]))
+        signature[name] = [stat.st_size, stat.st_mtime_ns]
+    return signature
+
+
+def read_matrix_info(matrix_dir) -> Optional[dict]:
+    try:
+        with open(os.path.join(matrix_dir, MATRIX_INFO), 'r', encoding='utf-8') as f:
+            info = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return info if info.get('version') == MATRIX_VERSION else None
+
+
+def build_tag_matrix(catalog_dir, force: bool = False) -> Tuple[Path, bool]:
+    """
+    由列式目录生成稀疏矩阵，返回 (matrix目录, 是否重新生成)
+    矩阵已与目录一致时直接返回；生成过程在内存中进行，占用与标签条目数成正比
+    """
+    catalog = TagCatalog(catalog_dir)
+    matrix_dir = catalog.catalog_dir / MATRIX_DIR
+    signature = catalog_signature(catalog_dir)
+    info = read_matrix_info(matrix_dir)
+    if not force and info is not None and info['signature'] == signature:
+        return matrix_dir, False
+
+    image_count = len(catalog)
+    tag_count = len(catalog.vocab)
+    offsets = np.asarray(catalog.offsets, dtype=np.int64)
+    tag_ids = np.asarray(catalog.tag_ids, dtype=np.int64)
+    confidences = np.asarray(catalog.confidences, dtype=np.float32)
+    rows = np.repeat(np.arange(image_count, dtype=np.int64), np.diff(offsets))
+
+    # 行已经按图片排列，只需在行内按标签ID排序；每行的条目数不变，indptr 就是目录的 offsets
+    order = np.argsort(rows * max(tag_count, 1) + tag_ids, kind='stable')
+    arrays = {
+        'csr_indptr': offsets,
+        'csr_indices': tag_ids[order].astype(np.int32),
+        'csr_data': confidences[order],
+    }
+
+    # 稳定排序保证每个标签内图片ID仍为升序
+    order = np.argsort(tag_ids, kind='stable')
+    csc_indptr = np.zeros(tag_count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(tag_ids, minlength=tag_count), out=csc_indptr[1:])
+    arrays.update({
+        'csc_indptr': csc_indptr,
+        'csc_indices': rows[order].astype(np.int32),
+        'csc_data': confidences[order],
+    })
+
+    temp_dir = matrix_dir.with_name(MATRIX_DIR + '.part')
+    if temp_dir.exists():
+        shutil.rmtree(temp_dir)
+    temp_dir.mkdir()
+    for name, values in arrays.items():
+        np.save(temp_dir / f'{name}.npy', values)
+    with open(temp_dir / MATRIX_INFO, 'w', encoding='utf-8') as f:
+        json.dump({
+            'version': MATRIX_VERSION,
+            'shape': [image_count, tag_count],
+            'nnz': int(tag_ids.size),
+            'signature': signature,
+        }, f, ensure_ascii=False, indent=2)
+
+    if matrix_dir.exists():
+        shutil.rmtree(matrix_dir)
+    os.replace(temp_dir, matrix_dir)
+    return matrix_dir, True
+
+
+class TagMatrix:
+    """只读打开稀疏矩阵（内存映射），提供常用的向量化查询"""
+
+    def __init__(self, catalog_dir):
+        self.catalog = TagCatalog(catalog_dir)
+        matrix_dir = self.catalog.catalog_dir / MATRIX_DIR
+        info = read_matrix_info(matrix_dir)
+        if info is None or info['signature'] != catalog_signature(catalog_dir):
+            raise ValueError(f"稀疏矩阵不存在或已过期，请先运行 build_tag_matrix: {catalog_dir}")
+        self.shape = tuple(info['shape'])
+        for name in ARRAYS:
+            setattr(self, name, np.load(matrix_dir / f'{name}.npy', mmap_mode='r'))
+        self._tag_ids_by_name = {tag: tag_id for tag_id, tag in enumerate(self.catalog.vocab)}
+
+    @classmethod
+    def open(cls, catalog_dir) -> 'TagMatrix':
+        """需要时先生成矩阵，再打开"""
+        build_tag_matrix(catalog_dir)
+        return cls(catalog_dir)
+
+    @property
+    def vocab(self) -> List[str]:
+        return self.catalog.vocab
+
+    def tag_id(self, tag: str) -> int:
+        try:
+            return self._tag_ids_by_name[tag]
+        except KeyError:
+            raise KeyError(f"标签不在词表中: {tag}") from None
+
+    def images_with_tag(self, tag, min_confidence: float = 0.0) -> np.ndarray:
+        """带有某个标签的图片ID（升序）；tag 可以是标签名或标签ID"""
+        tag_id = self.tag_id(tag) if isinstance(tag, str) else tag
+        start, end = self.csc_indptr[tag_id], self.csc_indptr[tag_id + 1]
+        image_ids = self.csc_indices[start:end]
+        if min_confidence > 0:
+            image_ids = image_ids[self.csc_data[start:end] >= min_confidence]
+        return np.asarray(image_ids)
+
+    def filter_images(self, all_of: Iterable = (), any_of: Iterable = (), none_of: Iterable = (),
+                      min_confidence: float = 0.0) -> np.ndarray:
+        """按标签组合筛选图片：包含 all_of 中全部标签、至少一个 any_of 中的标签、不含 none_of 中的标签"""
+        result = None
+        for tag in all_of:
+            image_ids = self.images_with_tag(tag, min_confidence)
+            result = image_ids if result is None else np.intersect1d(result, image_ids, assume_unique=True)
+        any_of = list(any_of)
+        if any_of:
+            image_ids = np.unique(np.concatenate([self.images_with_tag(tag, min_confidence) for tag in any_of]))
+            result = image_ids if result is None else np.intersect1d(result, image_ids, assume_unique=True)
+        if result is None:
+            result = np.arange(self.shape[0], dtype=np.int32)
+        for tag in none_of:
+            result = np.setdiff1d(result, self.images_with_tag(tag, min_confidence), assume_unique=True)
+        return result
+
+    def tag_frequencies(self, min_confidence: float = 0.0) -> np.ndarray:
+        """每个标签出现的图片数（下标为标签ID）"""
+        if min_confidence <= 0:
+            return np.diff(self.csc_indptr)
+        return np.bincount(self.csr_indices[self.csr_data >= min_confidence], minlength=self.shape[1])
+
+    def top_tags(self, count: int = 20, min_confidence: float = 0.0) -> List[Tuple[str, int]]:
+        frequencies = self.tag_frequencies(min_confidence)
+        order = np.argsort(frequencies, kind='stable')[::-1][:count]
+        return [(self.vocab[tag_id], int(frequencies[tag_id])) for tag_id in order if frequencies[tag_id]]
+
+    def cooccurrence(self, tags: List, min_confidence: float = 0.0) -> np.ndarray:
+        """若干标签两两同时出现的图片数（对角线为各标签自身的图片数）"""
+        image_sets = [self.images_with_tag(tag, min_confidence) for tag in tags]
+        counts = np.zeros((len(tags), len(tags)), dtype=np.int64)
+        for i, left in enumerate(image_sets):
+            counts[i, i] = left.size
+            for j in range(i + 1, len(tags)):
+                counts[i, j] = counts[j, i] = np.intersect1d(left, image_sets[j], assume_unique=True).size
+        return counts
+
+    def to_scipy(self, min_confidence: float = 0.0):
+        """转换为 scipy.sparse.csr_matrix（需要安装scipy；数组直接使用内存映射，不复制）"""
+        from scipy.sparse import csr_matrix
+
+        data = self.csr_data
+        if min_confidence > 0:
+            data = np.where(self.csr_data >= min_confidence, self.csr_data, np.float32(0))
+        return csr_matrix((data, self.csr_indices, self.csr_indptr), shape=self.shape)
+
+    def image_paths(self, image_ids) -> List[str]:
+        return [self.catalog.path(int(image_id)) for image_id in image_ids]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="生成并查询图片×标签稀疏矩阵")
+    parser.add_argument('catalog', help="列式标签目录（<CSV文件名>.catalog）")
+    parser.add_argument('--rebuild', action='store_true', help="强制重新生成矩阵")
+    parser.add_argument('-t', '--tag', action='append', default=[], help="必须包含的标签（可重复）")
+    parser.add_argument('--any', action='append', default=[], help="至少包含其中一个的标签（可重复）")
+    parser.add_argument('--exclude', action='append', default=[], help="不能包含的标签（可重复）")
+    parser.add_argument('--min-confidence', type=float, default=0.0, help="只统计置信度不低于该值的标签")
+    parser.add_argument('--top', type=int, default=0, help="打印出现次数最多的N个标签")
+    parser.add_argument('--cooccurrence', action='store_true', help="打印 --tag 中各标签的共现次数")
+    parser.add_argument('--limit', type=int, default=20, help="最多打印多少个匹配的图片路径")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    start_time = time.time()
+    matrix_dir, rebuilt = build_tag_matrix(args.catalog, force=args.rebuild)
+    if rebuilt:
+        print(f"已生成稀疏矩阵: {matrix_dir}，耗时 {time.time() - start_time:.2f}秒")
+
+    matrix = TagMatrix(args.catalog)
+    print(f"图片 {matrix.shape[0]} 张，标签 {matrix.shape[1]} 个，非零项 {matrix.csr_indices.size} 个")
+
+    try:
+        if args.top:
+            print(f"\n出现次数最多的 {args.top} 个标签:")
+            for tag, count in matrix.top_tags(args.top, args.min_confidence):
+                print(f"  {tag}: {count}")
+
+        if args.cooccurrence and args.tag:
+            counts = matrix.cooccurrence(args.tag, args.min_confidence)
+            print("\n共现次数:")
+            for tag, row in zip(args.tag, counts):
+                print(f"  {tag}: " + ", ".join(f"{other}={count}" for other, count in zip(args.tag, row)))
+        elif args.tag or args.any or args.exclude:
+            query_start = time.time()
+            image_ids = matrix.filter_images(args.tag, args.any, args.exclude, args.min_confidence)
+            print(f"\n匹配的图片: {image_ids.size} 张（查询耗时 {(time.time() - query_start) * 1000:.1f}毫秒）")
+            for path in matrix.image_paths(image_ids[:args.limit]):
+                print(f"  {path}")
+    except KeyError as e:
+        print(f"错误: {e.args[0]}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+文件索引查找性能测试
+用合成的文件名对比旧的逐个遍历索引匹配主干的方式与 FileNameIndex 的哈希查找
+默认规模：30万个已索引文件、2万个缺失行
+旧方式每次查找都要遍历全部索引，只抽样执行一部分查找再按比例推算总耗时
+"""
+
+import argparse
+import os
+import random
+import time
+from collections import defaultdict
+from pathlib import Path
+
+from 文件索引 import FileNameIndex, IMAGE_EXTENSIONS
+
+
+def legacy_search(file_index, filename):
+    """旧版 fast_search_files 的匹配逻辑（文件名小写 -> 路径集合的单一字典）"""
+    filename_lower = filename.lower()
+    filename_stem = Path(filename).stem.lower()
+    found_files = set()
+
+    if filename_lower in file_index:
+        found_files.update(file_index[filename_lower])
+
+    if not Path(filename).suffix:
+        for ext in IMAGE_EXTENSIONS:
+            test_name_lower = (filename + ext).lower()
+            if test_name_lower in file_index:
+                found_files.update(file_index[test_name_lower])
+
+    for indexed_file in file_index:
+        if Path(indexed_file).stem.lower() == filename_stem:
+            found_files.update(file_index[indexed_file])
+
+    return found_files
+
+
+def main():
+    parser = argparse.ArgumentParser(description="文件索引查找性能测试")
+    parser.add_argument('--files', type=int, default=300_000, help="已索引的文件数量")
+    parser.add_argument('--queries', type=int, default=20_000, help="缺失行（查找次数）")
+    parser.add_argument('--legacy-sample', type=int, default=20, help="旧方式实际执行的查找次数")
+    parser.add_argument('--seed', type=int, default=1412)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    names = [f"{i:08x}_{rng.getrandbits(32):08x}{rng.choice(IMAGE_EXTENSIONS)}" for i in range(args.files)]
+    paths = [os.path.join("Sorted_Images", f"dir{i % 500:03d}", name) for i, name in enumerate(names)]
+
+    # 查找对象：三分之一改了扩展名，三分之一去掉扩展名，其余为不存在的文件
+    queries = []
+    for i in range(args.queries):
+        stem = Path(rng.choice(names)).stem
+        kind = i % 3
+        if kind == 0:
+            queries.append(stem + ".png")
+        elif kind == 1:
+            queries.append(stem)
+        else:
+            queries.append(f"missing_{i}.jpg")
+
+    print(f"已索引文件: {args.files}, 查找次数: {args.queries}")
+
+    start = time.perf_counter()
+    legacy_index = defaultdict(set)
+    for name, path in zip(names, paths):
+        legacy_index[name.lower()].add(path)
+    legacy_build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    index = FileNameIndex()
+    for name, path in zip(names, paths):
+        index.add(name, path)
+    new_build = time.perf_counter() - start
+
+    sample = queries[:max(1, min(args.legacy_sample, len(queries)))]
+    start = time.perf_counter()
+    legacy_results = [legacy_search(legacy_index, q) for q in sample]
+    legacy_per_query = (time.perf_counter() - start) / len(sample)
+
+    start = time.perf_counter()
+    new_results = [index.lookup(q) for q in queries]
+    new_total = time.perf_counter() - start
+    new_per_query = new_total / len(queries)
+
+    # 抽样部分的结果必须与旧方式一致
+    mismatches = sum(1 for old, new in zip(legacy_results, new_results) if old != new)
+
+    legacy_total = legacy_per_query * len(queries)
+    print(f"索引构建: 旧 {legacy_build:.2f}秒, 新 {new_build:.2f}秒")
+    print(f"旧方式: {legacy_per_query * 1000:.2f}毫秒/次 (抽样 {len(sample)} 次), 推算总耗时 {legacy_total:.1f}秒")
+    print(f"新方式: {new_per_query * 1e6:.2f}微秒/次, 总耗时 {new_total:.3f}秒")
+    print(f"加速比: {legacy_per_query / max(new_per_query, 1e-12):.0f}x")
+    print(f"抽样结果不一致: {mismatches}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+路径修正守护进程
+常驻内存保存文件索引，并根据文件系统变化自动更新；
+查找和纠正请求直接使用已经建好的索引，不需要每次重新遍历目录树
+
+变化检测：安装了 watchdog 时使用文件系统通知，否则定时比较目录mtime（与磁盘索引的增量刷新相同）
+
+启动：
+    python 路径修正守护进程.py -f Sorted_Images --port 8765
+请求：
+    GET  /status                 索引状态
+    GET  /lookup?name=文件名      按文件名查找
+    POST /correct                {"csv": "...", "output": "..."} 纠正CSV，返回统计信息
+    POST /refresh                立即检查变化并更新索引
+也可以用 路径修正引擎.py a.csv --server http://127.0.0.1:8765 发送纠正请求
+"""
+
+import os
+import sys
+import json
+import argparse
+import threading
+import time
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional
+from urllib.parse import urlparse, parse_qs
+from 路径修正引擎 import PathCorrectionEngine, default_output_path
+from 文件索引 import PersistentFileIndex
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+# 没有文件系统通知时，检查目录mtime的间隔（秒）
+DEFAULT_POLL_INTERVAL = 10.0
+
+# 收到文件系统通知后等待这么久再刷新，合并连续的大量改动
+EVENT_DEBOUNCE = 1.0
+
+
+class _ChangeHandler(FileSystemEventHandler):
+    def __init__(self, daemon):
+        self.daemon = daemon
+
+    def on_any_event(self, event):
+        self.daemon.changed_event.set()
+
+
+class IndexDaemon:
+    """持有常驻索引的路径纠正服务"""
+
+    def __init__(self, search_folders: List[str], engine_options: Optional[Dict] = None,
+                 poll_interval: float = DEFAULT_POLL_INTERVAL, index_path: Optional[str] = None):
+        # 增量刷新依赖磁盘索引记录的目录mtime
+        self.engine_options = dict(engine_options or {}, use_persistent_index=True,
+                                   use_file_cache=True, use_fast_search=True)
+        self.search_folders = search_folders
+        self.poll_interval = poll_interval
+        self.persistent_index = PersistentFileIndex(index_path)
+        self.engine = None
+        self.correct_lock = threading.Lock()  # 同一时间只处理一个纠正请求
+        self.refresh_lock = threading.RLock()  # 纠正期间持有，内存索引不会在处理途中改变
+        self.changed_event = threading.Event()
+        self.shutdown_event = threading.Event()
+        self.last_refresh = None
+        self.observer = None
+
+    def log_message(self, message: str):
+        print(message, file=sys.stderr)
+
+    def new_engine(self) -> PathCorrectionEngine:
+        engine = PathCorrectionEngine(search_folders=self.search_folders,
+                                      log_callback=self.log_message, **self.engine_options)
+        engine.persistent_index = self.persistent_index
+        return engine
+
+    def refresh(self, force: bool = False) -> Dict:
+        """
+        检查目录变化，只把变化的目录应用到内存索引（mtime没变时只有一轮目录stat）；
+        首次启动或 force 时在新引擎中完整建立索引，建好后再替换。
+        启用内容指纹时新文件需要计算指纹，仍然重建整个索引
+        """
+        with self.refresh_lock:
+            rebuild = force or self.engine is None
+            changes = {}
+            if not rebuild:
+                for folder in self.engine.search_folders:
+                    self.persistent_index.refresh(folder, changes=changes)
+                rebuild = bool(changes) and self.engine.use_fingerprints
+
+            changed_files = 0
+            if rebuild:
+                engine = self.new_engine()
+                engine.build_indexes()
+                self.engine = engine
+            elif changes:
+                changed_files = self.engine.apply_dir_changes(changes)
+
+            self.last_refresh = time.time()
+            return {'changed': rebuild or changed_files > 0, 'changed_dirs': len(changes),
+                    'changed_files': changed_files, 'indexed_files': self.engine.performance_stats.total_files}
+
+    def watch_loop(self):
+        """有通知时尽快刷新，没有通知时按间隔轮询"""
+        while not self.shutdown_event.is_set():
+            triggered = self.changed_event.wait(self.poll_interval)
+            if self.shutdown_event.is_set():
+                break
+            if triggered:
+                time.sleep(EVENT_DEBOUNCE)
+                self.changed_event.clear()
+            try:
+                result = self.refresh()
+                if result['changed']:
+                    self.log_message(f"检测到文件变化，索引已更新（{result['indexed_files']} 个文件）")
+            except Exception as e:
+                self.log_message(f"更新索引时出错: {e}")
+
+    def start(self):
+        self.refresh(force=True)
+
+        if Observer is not None:
+            self.observer = Observer()
+            handler = _ChangeHandler(self)
+            for folder in self.engine.search_folders:
+                if os.path.isdir(folder):
+                    self.observer.schedule(handler, folder, recursive=True)
+            self.observer.start()
+            self.log_message("使用文件系统通知监视变化")
+        else:
+            self.log_message(f"未安装 watchdog，每 {self.poll_interval:g} 秒检查一次目录修改时间")
+
+        threading.Thread(target=self.watch_loop, daemon=True).start()
+
+    def stop(self):
+        self.shutdown_event.set()
+        self.changed_event.set()
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer.join()
+
+    def lookup(self, name: str) -> List[str]:
+        return self.engine.find_image_files(name)
+
+    def correct(self, csv_path: str, output_path: Optional[str] = None) -> Dict:
+        output_path = output_path or default_output_path(csv_path)
+        with self.correct_lock, self.refresh_lock:
+            # 通知合并等待和轮询间隔内索引可能还没更新，纠正前先检查一次（没有变化时只比较目录mtime）
+            self.refresh()
+            return self.engine.process_csv(csv_path, output_path, reuse_index=True)
+
+    def status(self) -> Dict:
+        return {
+            'search_folders': self.engine.search_folders,
+            'indexed_files': self.engine.performance_stats.total_files,
+            'last_refresh': self.last_refresh,
+            'watcher': 'watchdog' if self.observer is not None else 'polling',
+        }
+
+
+def make_handler(daemon: IndexDaemon):
+    class RequestHandler(BaseHTTPRequestHandler):
+        def send_json(self, status: int, payload):
+            body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def read_json(self) -> Dict:
+            length = int(self.headers.get('Content-Length') or 0)
+            return json.loads(self.rfile.read(length).decode('utf-8')) if length else {}
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == '/status':
+                self.send_json(200, daemon.status())
+            elif url.path == '/lookup':
+                name = parse_qs(url.query).get('name', [''])[0]
+                if not name:
+                    self.send_json(400, {'error': "缺少参数 name"})
+                else:
+                    self.send_json(200, {'name': name, 'matches': daemon.lookup(name)})
+            else:
+                self.send_json(404, {'error': f"未知请求: {url.path}"})
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            try:
+                if url.path == '/correct':
+                    payload = self.read_json()
+                    if not payload.get('csv'):
+                        self.send_json(400, {'error': "缺少参数 csv"})
+                        return
+                    self.send_json(200, daemon.correct(payload['csv'], payload.get('output')))
+                elif url.path == '/refresh':
+                    self.send_json(200, daemon.refresh())
+                else:
+                    self.send_json(404, {'error': f"未知请求: {url.path}"})
+            except Exception as e:
+                daemon.log_message(traceback.format_exc())
+                self.send_json(500, {'error': str(e)})
+
+        def log_message(self, format, *args):
+            daemon.log_message(format % args)
+
+    return RequestHandler
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="路径修正守护进程（常驻索引）")
+    parser.add_argument('-f', '--folder', action='append', required=True, dest='folders',
+                        help="搜索文件夹，可重复指定")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--poll', type=float, default=DEFAULT_POLL_INTERVAL, help="轮询间隔（秒）")
+    parser.add_argument('--base-dir', help="解析相对路径的基准目录，默认为脚本所在目录")
+    parser.add_argument('--index-db', help="磁盘索引文件路径")
+    parser.add_argument('--drop-missing', action='store_true', help="丢弃找不到图片的行")
+    parser.add_argument('--expand-multiple', action='store_true', help="找到多个匹配时每个匹配输出一行")
+    parser.add_argument('--fingerprint', action='store_true', help="按内容指纹找回改过名的图片")
+    args = parser.parse_args(argv)
+
+    options = {
+        'create_missing_only': not args.drop_missing,
+        'keep_original_order': not args.expand_multiple,
+        'use_fingerprints': args.fingerprint,
+        'base_dir': args.base_dir or str(Path(__file__).resolve().parent),
+    }
+    daemon = IndexDaemon(args.folders, options, poll_interval=args.poll, index_path=args.index_db)
+    daemon.start()
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(daemon))
+    daemon.log_message(f"守护进程已启动: http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        daemon.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,756 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CSV图片路径纠正引擎（无界面）
+路径修正程序.py 的核心逻辑，不依赖tkinter，可以在脚本或命令行中直接使用
+
+命令行示例：
+    python 路径修正引擎.py 所有图片标签.csv -f Sorted_Images --json
+    python 路径修正引擎.py a.csv b.csv -f Sorted_Images -f D:/备份 --jobs 2 --output-dir Csv_All
+"""
+
+import os
+import sys
+import csv
+import json
+import argparse
+import threading
+import traceback
+import sqlite3
+import time
+import itertools
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from CSV读写 import detect_encoding, iter_csv_rows, read_csv_rows, write_csv_rows
+from 性能统计 import PerformanceStats
+from 文件索引 import (FileNameIndex, PersistentFileIndex, IMAGE_EXTENSIONS, SCAN_WORKERS,
+                  path_key, scan_directories, split_suffix)
+
+# 每批处理的行数：批内先统一判断文件是否存在，再逐行纠正
+ROW_BATCH_SIZE = 2000
+
+# 不在已索引文件夹中的路径用线程池并发检查，限制同时进行的文件系统调用数量
+STAT_WORKERS = 16
+
+
+class PathCorrectionEngine:
+    """
+    CSV图片路径纠正：检查第一列的图片路径，找不到的文件按文件名在搜索文件夹中重新定位
+    选项与界面上的复选框一一对应
+    """
+
+    def __init__(self,
+                 search_folders: Optional[List[str]] = None,
+                 create_missing_only: bool = True,
+                 keep_original_order: bool = True,
+                 use_multithreading: bool = True,
+                 use_file_cache: bool = True,
+                 use_fast_search: bool = True,
+                 use_persistent_index: bool = True,
+                 use_fingerprints: bool = False,
+                 index_path: Optional[str] = None,
+                 base_dir: Optional[str] = None,
+                 log_callback: Optional[Callable[[str], None]] = None,
+                 progress_callback: Optional[Callable[[float], None]] = None):
+        self.create_missing_only = create_missing_only
+        self.keep_original_order = keep_original_order
+        self.use_multithreading = use_multithreading
+        self.use_file_cache = use_file_cache
+        self.use_fast_search = use_fast_search
+        self.use_persistent_index = use_persistent_index
+        # 按内容指纹找回改过名的图片（需要磁盘索引保存历史指纹）
+        self.use_fingerprints = use_fingerprints
+        self.index_path = index_path
+        # 相对路径的基准目录，默认与原程序一致使用启动脚本所在目录
+        self.base_dir = Path(os.path.abspath(base_dir if base_dir else Path(sys.argv[0]).parent))
+        self.log_callback = log_callback
+        self.progress_callback = progress_callback
+
+        self.search_folders = []
+        for folder in search_folders or []:
+            self.add_search_folder(folder)
+
+        self.file_index = FileNameIndex()  # 文件名/主干/无扩展名 -> 完整路径集合
+        self.folder_cache = set()  # 已索引的文件夹
+        self.indexed_root_keys = []  # 已索引文件夹的路径键，用于判断某个路径能否直接查索引
+        self.fingerprint_groups = {}  # (大小, 部分指纹) -> [(完整路径, 完整哈希)]
+        self.resolved_names = {}  # 本次运行中已查找过的缺失文件名 -> 匹配结果
+        self.index_lock = threading.Lock()
+        self.persistent_index = None  # 磁盘索引，首次使用时创建
+        self.stop_event = threading.Event()
+        self.performance_stats = PerformanceStats()
+
+    def log_message(self, message: str):
+        if self.log_callback is not None:
+            self.log_callback(message)
+        else:
+            print(message)
+
+    def set_progress(self, progress: float):
+        if self.progress_callback is not None:
+            self.progress_callback(progress)
+
+    def add_search_folder(self, folder_path: str) -> bool:
+        folder_path = self.normalize_path(folder_path)
+        if folder_path in self.search_folders:
+            return False
+        self.search_folders.append(folder_path)
+        return True
+
+    def reset(self):
+        """清空内存中的索引和统计（磁盘索引保留）"""
+        self.file_index.clear()
+        self.folder_cache.clear()
+        self.indexed_root_keys = []
+        self.fingerprint_groups = {}
+        self.resolved_names = {}
+        self.performance_stats = PerformanceStats()
+
+    @property
+    def uses_index(self) -> bool:
+        return self.use_file_cache and self.use_fast_search
+
+    def normalize_path(self, path_str: str) -> str:
+        # 只做字符串层面的拼接和规范化，不调用 Path.resolve()（每个路径组件都会产生系统调用）
+        if not os.path.isabs(path_str):
+            path_str = os.path.normpath(os.path.join(self.base_dir, path_str))
+        return path_str.replace('\\', '/')
+
+    def detect_encoding(self, file_path: str) -> str:
+        """编码检测见 CSV读写.detect_encoding（BOM优先、样本检测、按文件大小和修改时间缓存）"""
+        return detect_encoding(file_path)
+
+    def iter_csv_rows(self, file_path: str, encoding: str) -> Iterator[List[str]]:
+        """逐行读取CSV，不把整个文件放进内存"""
+        return iter_csv_rows(file_path, encoding)
+
+    def read_csv(self, file_path: str) -> Tuple[List[List[str]], str]:
+        return read_csv_rows(file_path)
+
+    def write_csv(self, file_path: str, rows: List[List[str]], encoding: str = 'utf-8-sig'):
+        write_csv_rows(file_path, rows, encoding)
+
+    def build_file_index(self, folder_path: str) -> bool:
+        """构建文件索引，返回是否成功"""
+        if folder_path in self.folder_cache:
+            return True
+
+        folder = Path(folder_path)
+        if not folder.exists():
+            return False
+
+        try:
+            start_time = time.time()
+            detail = ""
+            folder_info = {}
+            scan_workers = SCAN_WORKERS if self.use_multithreading else 1
+            # 各文件夹先收集到自己的列表，最后在锁内合并进共享索引
+            entries = []
+
+            if self.use_persistent_index:
+                # 磁盘索引：只重新扫描mtime变化的目录，然后载入内存
+                with self.index_lock:
+                    if self.persistent_index is None:
+                        self.persistent_index = PersistentFileIndex(self.index_path)
+                refresh_stats = self.persistent_index.refresh(folder_path, self.stop_event, scan_workers)
+                if refresh_stats is None:
+                    return False
+
+                fingerprint_files = []
+                for root, file, size, mtime_ns in self.persistent_index.iter_entries(folder_path):
+                    full_path = os.path.join(root, file)
+                    entries.append((file, full_path))
+                    if self.use_fingerprints:
+                        fingerprint_files.append((full_path, size, mtime_ns))
+
+                folder_info.update(refresh_stats)
+                self.performance_stats.count('dir_stat_calls', refresh_stats['checked_dirs'])
+                self.performance_stats.count('dirs_scanned', refresh_stats['scanned_dirs'])
+
+                if refresh_stats['cold']:
+                    detail = ", 首次建立磁盘索引"
+                else:
+                    detail = f", 重新扫描 {refresh_stats['scanned_dirs']}/{refresh_stats['total_dirs']} 个目录"
+
+                if self.use_fingerprints:
+                    fingerprint_counters = {}
+                    groups = self.persistent_index.update_fingerprints(folder_path, fingerprint_files,
+                                                                       self.stop_event, fingerprint_counters)
+                    if groups is None:
+                        return False
+                    folder_info.update(fingerprint_counters)
+                    for name, value in fingerprint_counters.items():
+                        self.performance_stats.count(name, value)
+                    with self.index_lock:
+                        for fingerprint, members in groups.items():
+                            self.fingerprint_groups.setdefault(fingerprint, []).extend(members)
+                    detail += ", 已更新内容指纹"
+            else:
+                results = scan_directories([folder_path], max_workers=scan_workers,
+                                           stop_event=self.stop_event, stat_files=False)
+                if self.stop_event.is_set():
+                    return False
+
+                for root, _, files, _ in results:
+                    entries.extend((file, os.path.join(root, file)) for file, _, _ in files)
+                folder_info['scanned_dirs'] = len(results)
+                self.performance_stats.count('dirs_scanned', len(results))
+
+            file_count = len(entries)
+            with self.index_lock:
+                for file, full_path in entries:
+                    self.file_index.add(file, full_path)
+                self.folder_cache.add(folder_path)
+                self.performance_stats.total_files += file_count
+            elapsed = time.time() - start_time
+            folder_info.update(files=file_count, seconds=round(elapsed, 6))
+            self.performance_stats.record_folder(folder_path, **folder_info)
+            self.log_message(f"已索引文件夹 {folder_path} (共 {file_count} 个文件{detail}, 耗时 {elapsed:.2f}秒)")
+            return True
+        except (PermissionError, OSError, sqlite3.Error) as e:
+            self.log_message(f"无法索引文件夹 {folder_path}: {e}")
+            return False
+
+    def build_indexes(self) -> float:
+        """为所有搜索文件夹构建索引，返回耗时（秒）"""
+        self.log_message("正在构建文件索引...")
+        start_index_time = time.time()
+
+        if self.use_fingerprints and not self.use_persistent_index:
+            self.log_message("警告：按内容查找需要启用磁盘索引（保存历史指纹），本次不使用内容指纹")
+
+        if self.use_multithreading and self.search_folders:
+            with ThreadPoolExecutor(max_workers=min(8, len(self.search_folders))) as executor:
+                futures = {executor.submit(self.build_file_index, folder): folder for folder in self.search_folders}
+
+                for future in as_completed(futures):
+                    if self.stop_event.is_set():
+                        break
+        else:
+            for folder in self.search_folders:
+                if self.stop_event.is_set():
+                    break
+                self.build_file_index(folder)
+
+        self.indexed_root_keys = [path_key(folder).rstrip(os.sep) + os.sep for folder in self.folder_cache]
+
+        elapsed = time.time() - start_index_time
+        self.performance_stats.add_time('index_build', elapsed)
+        self.log_message(f"文件索引构建完成，耗时 {elapsed:.2f}秒")
+        self.log_message(f"已索引 {self.performance_stats.total_files} 个文件")
+        return elapsed
+
+    def apply_dir_changes(self, changes: Dict[str, Tuple[List[str], List[str]]]) -> int:
+        """
+        把磁盘索引刷新时记录的目录变化（目录 -> (原来的文件名, 现在的文件名)）应用到内存索引，
+        只改动这些目录下的文件，不重建整个索引；返回变化的文件数
+        """
+        changed_files = 0
+        with self.index_lock:
+            for dir_path, (old_names, new_names) in changes.items():
+                old_set, new_set = set(old_names), set(new_names)
+                for name in old_set - new_set:
+                    self.file_index.remove(name, os.path.join(dir_path, name))
+                for name in new_set - old_set:
+                    self.file_index.add(name, os.path.join(dir_path, name))
+                changed_files += len(old_set ^ new_set)
+                self.performance_stats.total_files += len(new_set) - len(old_set)
+        return changed_files
+
+    def fast_search_files(self, filename: str) -> List[str]:
+        """使用文件索引快速搜索文件"""
+        start_time = time.perf_counter()
+        # 三种匹配方式都是索引上的哈希查找，不再遍历整个索引
+        found_files = self.file_index.lookup(filename)
+
+        # 转换为规范化路径列表（排序后多个匹配时的选择与线程调度无关）
+        result = sorted(self.normalize_path(f) for f in found_files)
+
+        self.performance_stats.record_lookup(time.perf_counter() - start_time)
+        return result
+
+    def find_image_files(self, filename: str) -> List[str]:
+        """查找图片文件，根据设置选择搜索方式"""
+        if self.uses_index:
+            return self.fast_search_files(filename)
+
+        # 传统搜索方式（不使用索引）
+        return self.search_folders_for_names([filename])[filename]
+
+    def search_folders_for_names(self, filenames: List[str]) -> Dict[str, List[str]]:
+        """
+        不使用索引时的查找：遍历一次所有搜索文件夹，同时匹配多个文件名，
+        每个文件名的匹配规则与单独查找时相同（精确匹配、补全图片扩展名、文件名主干）
+        返回 文件名 -> 排序后的规范化路径列表
+        """
+        start_time = time.perf_counter()
+        by_name = defaultdict(set)  # 小写文件名 -> 要查找的文件名
+        by_stem = defaultdict(set)  # 小写主干 -> 要查找的文件名
+        for filename in filenames:
+            by_name[filename.lower()].add(filename)
+            stem, suffix = split_suffix(filename)
+            if not suffix:
+                # 没有扩展名，尝试常见图片扩展名
+                for ext in IMAGE_EXTENSIONS:
+                    by_name[(filename + ext).lower()].add(filename)
+            by_stem[stem.lower()].add(filename)
+
+        # 以子目录为单位并行遍历（单线程模式下依次遍历）
+        workers = SCAN_WORKERS if self.use_multithreading else 1
+        results = scan_directories(self.search_folders, max_workers=workers,
+                                   stop_event=self.stop_event, stat_files=False)
+        self.performance_stats.count('folder_walks', len(self.search_folders))
+        self.performance_stats.count('dirs_scanned', len(results))
+
+        found_files = {filename: set() for filename in filenames}
+        no_match = set()
+        for root, _, files, _ in results:
+            for file, _, _ in files:
+                file_lower = file.lower()
+                matches = by_name.get(file_lower, no_match) | by_stem.get(split_suffix(file_lower)[0], no_match)
+                for filename in matches:
+                    found_files[filename].add(os.path.join(root, file))
+
+        result = {filename: sorted(self.normalize_path(f) for f in found)
+                  for filename, found in found_files.items()}
+        self.performance_stats.record_lookup(time.perf_counter() - start_time)
+        return result
+
+    def resolve_missing_names(self, filenames: List[str]):
+        """
+        查找一批缺失文件名（可重复），结果存入 resolved_names；
+        同一文件名在整个运行中只查找一次，不使用索引时所有新文件名共用一次目录遍历
+        """
+        pending = [name for name in dict.fromkeys(filenames) if name not in self.resolved_names]
+        self.performance_stats.count('name_lookups_saved', len(filenames) - len(pending))
+        if not pending:
+            return
+
+        self.performance_stats.count('name_lookups', len(pending))
+        if self.uses_index:
+            for filename in pending:
+                self.resolved_names[filename] = self.fast_search_files(filename)
+        else:
+            self.resolved_names.update(self.search_folders_for_names(pending))
+
+    def is_under_indexed_folder(self, path: str) -> bool:
+        key = path_key(path)
+        return any(key.startswith(root_key) for root_key in self.indexed_root_keys)
+
+    def check_paths_exist(self, paths: List[Optional[str]], counts: Dict[str, int],
+                          stat_pool: ThreadPoolExecutor) -> List[bool]:
+        """
+        批量判断文件是否存在：位于已索引文件夹内的路径直接查内存索引，
+        其余路径交给线程池并发调用 os.path.isfile（每个路径一次stat）
+        """
+        start_time = time.perf_counter()
+        results = [False] * len(paths)
+        pending = []
+        index_checks = 0
+        for i, path in enumerate(paths):
+            if path is None:
+                continue
+            if self.indexed_root_keys and self.is_under_indexed_folder(path):
+                results[i] = self.file_index.contains_path(path)
+                index_checks += 1
+            else:
+                pending.append(i)
+
+        if pending:
+            for i, found in zip(pending, stat_pool.map(os.path.isfile, [paths[i] for i in pending])):
+                results[i] = found
+
+        counts['index_checks'] += index_checks
+        counts['stat_checks'] += len(pending)
+        stats = self.performance_stats
+        with stats.lock:
+            stats.cache_hits += index_checks
+            stats.cache_misses += len(pending)
+        stats.count('file_stat_calls', len(pending))
+        stats.add_time('existence_check', time.perf_counter() - start_time)
+        return results
+
+    def batch_paths(self, rows: List[List[str]]) -> List[Optional[str]]:
+        paths = []
+        for row in rows:
+            original_path = row[0].strip() if row else ""
+            paths.append(self.normalize_path(original_path) if original_path else None)
+        return paths
+
+    def correct_batch(self, rows: List[List[str]], counts: Dict[str, int],
+                      stat_pool: ThreadPoolExecutor, exists: Optional[List[bool]] = None) -> List[List[str]]:
+        """
+        纠正一批行，输出保持原顺序
+        先判断存在性，再一次查找批内所有不重复的缺失文件名，最后按原顺序逐行套用结果；
+        exists 不为None时使用预扫描得到的存在性结果，缺失的文件名也已在预扫描后查找过
+        """
+        paths = self.batch_paths(rows)
+        prescanned = exists is not None
+        if not prescanned:
+            exists = self.check_paths_exist(paths, counts, stat_pool)
+
+        # 一次查询本批所有缺失文件的历史指纹
+        history = {}
+        if self.fingerprint_groups:
+            history = self.persistent_index.fingerprint_history(
+                [path_key(path) for path, found in zip(paths, exists) if path and not found])
+
+        with self.performance_stats.phase('resolve'):
+            if not prescanned:
+                self.resolve_missing_names([os.path.basename(path) for path, found in zip(paths, exists)
+                                            if path and not found and os.path.basename(path)])
+            output = []
+            for row, path, found in zip(rows, paths, exists):
+                fingerprint = history.get(path_key(path)) if history and path and not found else None
+                output.extend(self.correct_row(row, path, found, counts, fingerprint))
+        return output
+
+    def find_by_fingerprint(self, normalized_path: str, fingerprint: Tuple[int, str, Optional[str]]) -> List[str]:
+        """按文件消失前记录的内容指纹查找同内容的现有文件"""
+        size, partial, full = fingerprint
+        key = path_key(normalized_path)
+        candidates = [(path, full_hash) for path, full_hash in self.fingerprint_groups.get((size, partial), [])
+                      if path_key(path) != key]
+        # 多个候选且有完整哈希时，只保留完整哈希一致的文件
+        if len(candidates) > 1 and full:
+            candidates = [(path, full_hash) for path, full_hash in candidates if full_hash == full]
+        return [self.normalize_path(path) for path, _ in candidates]
+
+    def correct_row(self, row: List[str], normalized_path: Optional[str], exists: bool,
+                    counts: Dict[str, int],
+                    fingerprint: Optional[Tuple[int, str, Optional[str]]] = None) -> List[List[str]]:
+        """纠正单行，返回要写出的行（找不到且不保留时为空，展开多个匹配时为多行）"""
+        if not normalized_path:
+            return [row]
+
+        if exists:
+            return [[normalized_path] + row[1:]]
+
+        counts['missing'] += 1
+        filename = os.path.basename(normalized_path)
+
+        if not filename:
+            return [row]
+
+        found_files = self.resolved_names.get(filename)
+        if found_files is None:
+            found_files = self.find_image_files(filename)
+
+        # 按文件名找不到时，尝试按内容找回被改名的文件
+        if not found_files and fingerprint is not None:
+            found_files = self.find_by_fingerprint(normalized_path, fingerprint)
+            if found_files:
+                counts['fingerprint_matches'] += 1
+
+        if len(found_files) == 1:
+            counts['corrected'] += 1
+            return [[found_files[0]] + row[1:]]
+        elif len(found_files) > 1:
+            counts['multiple_found'] += 1
+            if self.keep_original_order:
+                counts['corrected'] += 1
+                return [[found_files[0]] + row[1:]]
+            counts['corrected'] += len(found_files)
+            return [[found] + row[1:] for found in found_files]
+        elif self.create_missing_only:
+            return [row]
+        return []
+
+    @staticmethod
+    def batch_flags(exists_flags: Optional[bytearray], rows_read: int, batch_size: int) -> Optional[List[bool]]:
+        """取出刚读完的一批行对应的预扫描存在性标记"""
+        if exists_flags is None:
+            return None
+        return [bool(flag) for flag in exists_flags[rows_read - batch_size:rows_read]]
+
+    def prescan_missing(self, csv_path_str: str, encoding: str, counts: Dict[str, int],
+                        stat_pool: ThreadPoolExecutor) -> Optional[bytearray]:
+        """
+        不使用索引时的预扫描：先读一遍CSV，判断每行的文件是否存在并收集所有缺失的文件名，
+        然后只遍历一次搜索文件夹查找全部文件名。
+        返回每行的存在性标记（每行一个字节），被中止时返回None
+        """
+        self.log_message("正在预扫描CSV，收集缺失的文件名...")
+        exists_flags = bytearray()
+        missing_names = []
+        with open(csv_path_str, 'r', encoding=encoding, newline='') as src:
+            rows = csv.reader(src)
+            while not self.stop_event.is_set():
+                batch = list(itertools.islice(rows, ROW_BATCH_SIZE))
+                if not batch:
+                    break
+                paths = self.batch_paths(batch)
+                exists = self.check_paths_exist(paths, counts, stat_pool)
+                exists_flags.extend(exists)
+                missing_names.extend(os.path.basename(path) for path, found in zip(paths, exists)
+                                     if path and not found and os.path.basename(path))
+
+        if self.stop_event.is_set():
+            return None
+
+        distinct = len(set(missing_names))
+        self.log_message(f"缺失 {len(missing_names)} 行，不重复的文件名 {distinct} 个，开始搜索...")
+        with self.performance_stats.phase('resolve'):
+            self.resolve_missing_names(missing_names)
+        return exists_flags
+
+    def process_csv(self, csv_path_str: str, output_path_str: str, reuse_index: bool = False) -> Dict:
+        """
+        纠正CSV文件中的图片路径并写入输出文件
+        整个过程按行流式处理，内存占用与CSV大小无关
+        reuse_index 为 True 时直接使用已经建好的内存索引（守护进程模式），不重新构建
+        返回统计信息字典（可直接序列化为JSON）；被中止时 stopped 为 True 且不写输出文件
+        """
+        self.stop_event.clear()
+        if reuse_index:
+            # 保留索引相关的统计，只重新统计本次纠正
+            previous = self.performance_stats
+            self.performance_stats = PerformanceStats()
+            self.performance_stats.total_files = previous.total_files
+            self.performance_stats.folders = previous.folders
+            self.resolved_names = {}
+        else:
+            self.reset()
+        stats = self.performance_stats
+
+        csv_path = Path(csv_path_str)
+        if not csv_path.exists():
+            raise FileNotFoundError(f"CSV文件不存在 - {csv_path}")
+
+        output_path = Path(output_path_str)
+
+        if not self.search_folders:
+            self.log_message("警告：没有指定搜索文件夹，将只检查现有路径")
+
+        with stats.phase('encoding_detection'):
+            encoding = self.detect_encoding(csv_path_str)
+        self.log_message(f"CSV编码: {encoding}")
+
+        # 构建文件索引
+        index_time = 0.0
+        if self.uses_index and not reuse_index:
+            index_time = self.build_indexes()
+
+        # 逐行读取、纠正并写出；先写入临时文件，完成后再替换输出文件
+        counts = {'rows': 0, 'missing': 0, 'corrected': 0, 'multiple_found': 0,
+                  'index_checks': 0, 'stat_checks': 0, 'fingerprint_matches': 0}
+        total_bytes = max(1, csv_path.stat().st_size)
+        temp_path = output_path.with_name(output_path.name + '.part')
+
+        start_time = time.time()
+        last_update_time = start_time
+
+        self.log_message(f"正在读取CSV文件: {csv_path}")
+        self.log_message(f"输出文件: {output_path}")
+        try:
+            with ThreadPoolExecutor(max_workers=STAT_WORKERS) as stat_pool:
+                # 不使用索引时每次查找都要遍历目录树，先收集全部缺失文件名再统一查找
+                exists_flags = None
+                if not self.uses_index and self.search_folders:
+                    exists_flags = self.prescan_missing(csv_path_str, encoding, counts, stat_pool)
+                    if exists_flags is None:
+                        exists_flags = bytearray()
+
+                with open(csv_path_str, 'r', encoding=encoding, newline='') as src, \
+                        open(temp_path, 'w', encoding=encoding, newline='') as dst:
+                    writer = csv.writer(dst)
+                    batch = []
+                    read_started = time.perf_counter()
+                    for row in csv.reader(src):
+                        if self.stop_event.is_set():
+                            break
+
+                        counts['rows'] += 1
+                        batch.append(row)
+                        if len(batch) < ROW_BATCH_SIZE:
+                            continue
+
+                        stats.add_time('csv_read', time.perf_counter() - read_started)
+                        output_rows = self.correct_batch(batch, counts, stat_pool,
+                                                         self.batch_flags(exists_flags, counts['rows'], len(batch)))
+                        with stats.phase('csv_write'):
+                            writer.writerows(output_rows)
+                        batch = []
+                        read_started = time.perf_counter()
+
+                        # 按已读取的字节数更新进度
+                        current_time = time.time()
+                        if current_time - last_update_time > 0.5:
+                            self.set_progress(min(100.0, src.buffer.tell() / total_bytes * 100))
+                            last_update_time = current_time
+
+                    stats.add_time('csv_read', time.perf_counter() - read_started)
+                    if batch and not self.stop_event.is_set():
+                        output_rows = self.correct_batch(batch, counts, stat_pool,
+                                                         self.batch_flags(exists_flags, counts['rows'], len(batch)))
+                        with stats.phase('csv_write'):
+                            writer.writerows(output_rows)
+
+            if self.stop_event.is_set():
+                self.log_message("处理已中止")
+
+            stopped = self.stop_event.is_set()
+            if stopped or counts['rows'] == 0:
+                os.remove(temp_path)
+            else:
+                os.replace(temp_path, output_path)
+        except BaseException:
+            if temp_path.exists():
+                os.remove(temp_path)
+            raise
+
+        if counts['rows'] == 0:
+            raise ValueError("CSV文件为空或读取失败")
+
+        self.set_progress(100)
+
+        total_rows = counts['rows']
+        missing_count = counts['missing']
+        corrected_count = counts['corrected']
+        multiple_found_count = counts['multiple_found']
+
+        elapsed_time = time.time() - start_time
+        avg_search_time = (stats.search_time / max(1, missing_count)) * 1000
+
+        if not stopped:
+            self.log_message("\n" + "="*50)
+            self.log_message("处理完成!")
+            self.log_message(f"总行数: {total_rows}")
+            self.log_message(f"缺失图片: {missing_count}")
+            self.log_message(f"已纠正: {corrected_count}")
+            self.log_message(f"多个匹配文件的情况: {multiple_found_count}")
+            self.log_message(f"索引判断存在: {counts['index_checks']} 行, 文件系统检查: {counts['stat_checks']} 行")
+            if self.use_fingerprints:
+                self.log_message(f"按内容找回: {counts['fingerprint_matches']}")
+            self.log_message(f"总耗时: {elapsed_time:.2f}秒")
+
+            if self.use_fast_search:
+                self.log_message(f"平均搜索时间: {avg_search_time:.2f}毫秒/文件")
+
+            self.log_message("各阶段耗时:")
+            for line in stats.summary_lines():
+                self.log_message(line)
+
+        return {
+            'csv_file': str(csv_path),
+            'output_file': str(output_path),
+            'encoding': encoding,
+            'stopped': stopped,
+            'total_rows': total_rows,
+            'missing': missing_count,
+            'corrected': corrected_count,
+            'multiple_found': multiple_found_count,
+            'index_checks': counts['index_checks'],
+            'stat_checks': counts['stat_checks'],
+            'fingerprint_matches': counts['fingerprint_matches'],
+            'indexed_files': stats.total_files,
+            'index_time': round(index_time, 3),
+            'elapsed': round(elapsed_time, 3),
+            'avg_search_ms': round(avg_search_time, 3),
+            'performance': stats.to_dict(),
+        }
+
+
+def default_output_path(csv_path: str, output_dir: Optional[str] = None) -> str:
+    """与界面一致：<原文件名>_corrected.csv"""
+    path = Path(csv_path)
+    parent = Path(output_dir) if output_dir else path.parent
+    return str(parent / (path.stem + "_corrected" + path.suffix))
+
+
+def run_correction(csv_path: str, output_path: str, options: Dict) -> Dict:
+    """处理单个CSV（可在子进程中运行），失败时返回带 error 字段的统计"""
+    engine = PathCorrectionEngine(log_callback=lambda message: print(message, file=sys.stderr), **options)
+    try:
+        return engine.process_csv(csv_path, output_path)
+    except Exception as e:
+        engine.log_message(f"\n错误: {str(e)}")
+        engine.log_message(traceback.format_exc())
+        return {'csv_file': csv_path, 'output_file': output_path, 'error': str(e)}
+
+
+def request_correction(server: str, csv_path: str, output_path: str) -> Dict:
+    """把纠正请求发给路径修正守护进程"""
+    body = json.dumps({'csv': csv_path, 'output': output_path}).encode('utf-8')
+    request = urllib.request.Request(server.rstrip('/') + '/correct', data=body,
+                                     headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return json.loads(response.read().decode('utf-8'))
+    except urllib.error.HTTPError as e:
+        return json.loads(e.read().decode('utf-8'))
+    except (urllib.error.URLError, OSError) as e:
+        return {'csv_file': csv_path, 'output_file': output_path, 'error': f"无法连接守护进程: {e}"}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="CSV图片路径纠正工具（命令行版）")
+    parser.add_argument('csv_files', nargs='+', help="需要纠正的CSV文件")
+    parser.add_argument('-f', '--folder', action='append', default=[], dest='folders',
+                        help="搜索文件夹，可重复指定")
+    parser.add_argument('-o', '--output', help="输出文件（只处理一个CSV时可用）")
+    parser.add_argument('--output-dir', help="输出目录，默认与输入CSV相同")
+    parser.add_argument('--base-dir', help="解析相对路径的基准目录，默认为脚本所在目录")
+    parser.add_argument('--index-db', help="磁盘索引文件路径")
+    parser.add_argument('--drop-missing', action='store_true', help="丢弃找不到图片的行")
+    parser.add_argument('--expand-multiple', action='store_true', help="找到多个匹配时每个匹配输出一行")
+    parser.add_argument('--no-multithreading', action='store_true', help="禁用多线程搜索")
+    parser.add_argument('--no-file-cache', action='store_true', help="禁用文件缓存（每个缺失文件都遍历搜索文件夹）")
+    parser.add_argument('--no-fast-search', action='store_true', help="禁用快速搜索")
+    parser.add_argument('--no-persistent-index', action='store_true', help="不使用磁盘索引")
+    parser.add_argument('--fingerprint', action='store_true', help="按内容指纹找回改过名的图片")
+    parser.add_argument('-j', '--jobs', type=int, default=1, help="同时处理的CSV数量（多进程）")
+    parser.add_argument('--json', action='store_true', help="在标准输出打印JSON格式的统计信息")
+    parser.add_argument('--stats-json', help="把统计信息（含各阶段耗时、查找延迟分布）写入JSON文件")
+    parser.add_argument('--server', help="交给正在运行的守护进程处理（如 http://127.0.0.1:8765），使用其常驻索引")
+    args = parser.parse_args(argv)
+    if args.output and len(args.csv_files) > 1:
+        parser.error("处理多个CSV时不能使用 --output，请改用 --output-dir")
+    return args
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    base_dir = args.base_dir or str(Path(__file__).resolve().parent)
+    options = {
+        'search_folders': args.folders,
+        'create_missing_only': not args.drop_missing,
+        'keep_original_order': not args.expand_multiple,
+        'use_multithreading': not args.no_multithreading,
+        'use_file_cache': not args.no_file_cache,
+        'use_fast_search': not args.no_fast_search,
+        'use_persistent_index': not args.no_persistent_index,
+        'use_fingerprints': args.fingerprint,
+        'index_path': args.index_db,
+        'base_dir': base_dir,
+    }
+    jobs = [(csv_file, args.output or default_output_path(csv_file, args.output_dir))
+            for csv_file in args.csv_files]
+
+    if args.server:
+        # 守护进程已持有索引，搜索文件夹和索引选项以守护进程为准
+        results = [request_correction(args.server, os.path.abspath(csv_file), os.path.abspath(output))
+                   for csv_file, output in jobs]
+    elif args.jobs > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=min(args.jobs, len(jobs))) as executor:
+            futures = [executor.submit(run_correction, csv_file, output, options) for csv_file, output in jobs]
+            results = [future.result() for future in futures]
+    else:
+        results = [run_correction(csv_file, output, options) for csv_file, output in jobs]
+
+    if args.json:
+        print(json.dumps(results if len(results) > 1 else results[0], ensure_ascii=False, indent=2))
+
+    if args.stats_json:
+        with open(args.stats_json, 'w', encoding='utf-8') as f:
+            json.dump(results if len(results) > 1 else results[0], f, ensure_ascii=False, indent=2)
+
+    return 1 if any('error' in result or result.get('stopped') for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
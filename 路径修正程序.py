@@ -8,23 +8,18 @@ CSV图片路径纠正工具 - 高性能版
 3. 优化缓存机制
 4. 使用更高效的文件名匹配算法
 5. 添加性能监控
+
+界面只负责收集选项和显示日志，路径纠正逻辑见 路径修正引擎.py（也可在命令行中使用）
 """
 
-import os
 import sys
-import csv
 import tkinter as tk
 from tkinter import filedialog, ttk, messagebox, scrolledtext
 from pathlib import Path
 import threading
 import queue
 import traceback
-from typing import List, Tuple, Dict, Set
-import chardet
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import time
-import fnmatch
-from collections import defaultdict
+from 路径修正引擎 import PathCorrectionEngine
 
 class CSVPathCorrector:
     def __init__(self):
@@ -38,15 +33,9 @@ class CSVPathCorrector:
         self.output_file_path = tk.StringVar(value="corrected_output.csv")
         self.processing = False
         self.log_queue = queue.Queue()
-        self.file_index = defaultdict(set)  # 文件名小写 -> 完整路径集合
-        self.folder_cache = set()  # 已索引的文件夹
-        self.stop_event = threading.Event()
-        self.performance_stats = {
-            'total_files': 0,
-            'cache_hits': 0,
-            'cache_misses': 0,
-            'search_time': 0.0
-        }
+        # 路径纠正逻辑在无界面的引擎中，界面只负责收集选项和显示日志
+        self.engine = PathCorrectionEngine(log_callback=self.log_message,
+                                           progress_callback=self.update_progress)
         
         # 创建UI
         self.setup_ui()
@@ -107,6 +96,8 @@ class CSVPathCorrector:
         self.use_multithreading_var = tk.BooleanVar(value=True)
         self.use_file_cache_var = tk.BooleanVar(value=True)
         self.use_fast_search_var = tk.BooleanVar(value=True)
+        self.use_persistent_index_var = tk.BooleanVar(value=True)
+        self.use_fingerprints_var = tk.BooleanVar(value=False)
         
         ttk.Checkbutton(options_frame, text="仅处理找不到的图片", 
                         variable=self.create_missing_only_var).grid(row=0, column=0, sticky=tk.W)
@@ -118,6 +109,10 @@ class CSVPathCorrector:
                         variable=self.use_file_cache_var).grid(row=1, column=1, sticky=tk.W, padx=(20, 0))
         ttk.Checkbutton(options_frame, text="启用快速搜索", 
                         variable=self.use_fast_search_var).grid(row=2, column=0, sticky=tk.W)
+        ttk.Checkbutton(options_frame, text="保存索引供下次使用", 
+                        variable=self.use_persistent_index_var).grid(row=2, column=1, sticky=tk.W, padx=(20, 0))
+        ttk.Checkbutton(options_frame, text="按内容查找改名的图片", 
+                        variable=self.use_fingerprints_var).grid(row=3, column=0, sticky=tk.W)
         
         # 进度条
         self.progress_var = tk.DoubleVar()
@@ -195,167 +190,32 @@ class CSVPathCorrector:
             self.output_file_path.set(file_path)
     
     def normalize_path(self, path_str: str) -> str:
-        path = Path(path_str)
-        if not path.is_absolute():
-            program_dir = Path(sys.argv[0]).parent
-            path = (program_dir / path).resolve()
-        return str(path).replace('\\', '/')
+        return self.engine.normalize_path(path_str)
     
-    def detect_encoding(self, file_path: str) -> str:
-        with open(file_path, 'rb') as f:
-            raw_data = f.read()
-            result = chardet.detect(raw_data)
-            encoding = result.get('encoding', 'utf-8')
-            
-            if raw_data.startswith(b'\xef\xbb\xbf'):
-                return 'utf-8-sig'
-            elif raw_data.startswith(b'\xff\xfe'):
-                return 'utf-16-le'
-            elif raw_data.startswith(b'\xfe\xff'):
-                return 'utf-16-be'
-            
-            return encoding or 'utf-8'
+    def update_progress(self, progress: float):
+        self.progress_var.set(progress)
+        self.root.update_idletasks()
     
-    def read_csv(self, file_path: str) -> Tuple[List[List[str]], str]:
-        encoding = self.detect_encoding(file_path)
-        
-        with open(file_path, 'r', encoding=encoding, newline='') as f:
-            reader = csv.reader(f)
-            rows = [row for row in reader]
-        
-        return rows, encoding
-    
-    def write_csv(self, file_path: str, rows: List[List[str]], encoding: str = 'utf-8-sig'):
-        with open(file_path, 'w', encoding=encoding, newline='') as f:
-            writer = csv.writer(f)
-            writer.writerows(rows)
-    
-    def build_file_index(self, folder_path: str) -> bool:
-        """构建文件索引，返回是否成功"""
-        if folder_path in self.folder_cache:
-            return True
-            
-        folder = Path(folder_path)
-        if not folder.exists():
-            return False
-        
-        try:
-            start_time = time.time()
-            file_count = 0
-            
-            for root, _, files in os.walk(folder_path):
-                if self.stop_event.is_set():
-                    return False
-                
-                for file in files:
-                    file_lower = file.lower()
-                    full_path = os.path.join(root, file)
-                    self.file_index[file_lower].add(full_path)
-                    file_count += 1
-            
-            self.folder_cache.add(folder_path)
-            self.performance_stats['total_files'] += file_count
-            elapsed = time.time() - start_time
-            self.log_message(f"已索引文件夹 {folder_path} (共 {file_count} 个文件, 耗时 {elapsed:.2f}秒)")
-            return True
-        except (PermissionError, OSError) as e:
-            self.log_message(f"无法索引文件夹 {folder_path}: {e}")
-            return False
-    
-    def fast_search_files(self, filename: str) -> List[str]:
-        """使用文件索引快速搜索文件"""
-        start_time = time.time()
-        filename_lower = filename.lower()
-        filename_stem = Path(filename).stem.lower()
-        found_files = set()
-        
-        # 精确匹配
-        if filename_lower in self.file_index:
-            found_files.update(self.file_index[filename_lower])
-        
-        # 如果没有扩展名，尝试常见图片扩展名
-        if not Path(filename).suffix:
-            for ext in ['.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tiff', '.webp']:
-                test_name = filename + ext
-                test_name_lower = test_name.lower()
-                if test_name_lower in self.file_index:
-                    found_files.update(self.file_index[test_name_lower])
-        
-        # 尝试匹配文件名主干
-        for indexed_file in self.file_index:
-            if Path(indexed_file).stem.lower() == filename_stem:
-                found_files.update(self.file_index[indexed_file])
-        
-        # 转换为规范化路径列表
-        result = [self.normalize_path(f) for f in found_files]
-        
-        elapsed = time.time() - start_time
-        self.performance_stats['search_time'] += elapsed
-        return result
-    
-    def find_image_files(self, filename: str) -> List[str]:
-        """查找图片文件，根据设置选择搜索方式"""
-        if self.use_fast_search_var.get() and self.use_file_cache_var.get():
-            return self.fast_search_files(filename)
-        
-        # 传统搜索方式（不使用索引）
-        filename_lower = filename.lower()
-        filename_stem = Path(filename).stem.lower()
-        found_files = set()
-        
-        def search_in_folder(folder: str):
-            try:
-                for root, _, files in os.walk(folder):
-                    if self.stop_event.is_set():
-                        return
-                    
-                    for file in files:
-                        file_lower = file.lower()
-                        
-                        # 精确匹配
-                        if file_lower == filename_lower:
-                            found_files.add(os.path.join(root, file))
-                            continue
-                        
-                        # 如果没有扩展名，尝试常见图片扩展名
-                        if not Path(filename).suffix:
-                            for ext in ['.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tiff', '.webp']:
-                                if file_lower == (filename + ext).lower():
-                                    found_files.add(os.path.join(root, file))
-                                    break
-                        
-                        # 尝试匹配文件名主干
-                        if Path(file).stem.lower() == filename_stem:
-                            found_files.add(os.path.join(root, file))
-            except (PermissionError, OSError) as e:
-                self.log_message(f"搜索文件夹 {folder} 时出错: {e}")
-        
-        if self.use_multithreading_var.get():
-            with ThreadPoolExecutor(max_workers=min(8, len(self.search_folders))) as executor:
-                futures = {executor.submit(search_in_folder, folder): folder for folder in self.search_folders}
-                
-                for future in as_completed(futures):
-                    if self.stop_event.is_set():
-                        break
-        else:
-            for folder in self.search_folders:
-                if self.stop_event.is_set():
-                    break
-                search_in_folder(folder)
-        
-        return [self.normalize_path(f) for f in found_files]
+    def configure_engine(self):
+        """将界面上的选项同步到引擎"""
+        self.engine.search_folders = list(self.search_folders)
+        self.engine.create_missing_only = self.create_missing_only_var.get()
+        self.engine.keep_original_order = self.keep_original_order_var.get()
+        self.engine.use_multithreading = self.use_multithreading_var.get()
+        self.engine.use_file_cache = self.use_file_cache_var.get()
+        self.engine.use_fast_search = self.use_fast_search_var.get()
+        self.engine.use_persistent_index = self.use_persistent_index_var.get()
+        self.engine.use_fingerprints = self.use_fingerprints_var.get()
     
     def process_csv(self):
         try:
-            self.stop_event.clear()
             csv_path_str = self.csv_file_path.get().strip()
             if not csv_path_str:
                 self.log_message("错误：请先选择CSV文件")
                 return
             
-            csv_path = Path(csv_path_str)
-            if not csv_path.exists():
-                self.log_message(f"错误：CSV文件不存在 - {csv_path}")
+            if not Path(csv_path_str).exists():
+                self.log_message(f"错误：CSV文件不存在 - {Path(csv_path_str)}")
                 return
             
             output_path_str = self.output_file_path.get().strip()
@@ -363,141 +223,18 @@ class CSVPathCorrector:
                 self.log_message("错误：请指定输出文件路径")
                 return
             
-            output_path = Path(output_path_str)
-            
-            if not self.search_folders:
-                self.log_message("警告：没有指定搜索文件夹，将只检查现有路径")
-            
-            # 读取CSV
-            self.log_message(f"正在读取CSV文件: {csv_path}")
-            rows, encoding = self.read_csv(csv_path_str)
-            
-            if not rows:
-                self.log_message("错误：CSV文件为空或读取失败")
-                return
-            
-            self.log_message(f"CSV编码: {encoding}")
-            self.log_message(f"找到 {len(rows)} 行数据")
-            
-            # 构建文件索引
-            if self.use_file_cache_var.get() and self.use_fast_search_var.get():
-                self.log_message("正在构建文件索引...")
-                start_index_time = time.time()
-                
-                if self.use_multithreading_var.get():
-                    with ThreadPoolExecutor(max_workers=min(8, len(self.search_folders))) as executor:
-                        futures = {executor.submit(self.build_file_index, folder): folder for folder in self.search_folders}
-                        
-                        for future in as_completed(futures):
-                            if self.stop_event.is_set():
-                                break
-                else:
-                    for folder in self.search_folders:
-                        if self.stop_event.is_set():
-                            break
-                        self.build_file_index(folder)
-                
-                elapsed = time.time() - start_index_time
-                self.log_message(f"文件索引构建完成，耗时 {elapsed:.2f}秒")
-                self.log_message(f"已索引 {self.performance_stats['total_files']} 个文件")
-            
-            # 处理每一行
-            processed_rows = []
-            total_rows = len(rows)
-            corrected_count = 0
-            missing_count = 0
-            multiple_found_count = 0
-            
-            start_time = time.time()
-            last_update_time = start_time
-            
-            for i, row in enumerate(rows):
-                if self.stop_event.is_set():
-                    self.log_message("处理已中止")
-                    break
-                
-                # 更新进度
-                current_time = time.time()
-                if current_time - last_update_time > 0.5:
-                    progress = (i + 1) / total_rows * 100
-                    self.progress_var.set(progress)
-                    self.root.update_idletasks()
-                    last_update_time = current_time
-                
-                if not row:
-                    processed_rows.append(row)
-                    continue
-                
-                original_path = row[0].strip() if len(row) > 0 else ""
-                
-                if not original_path:
-                    processed_rows.append(row)
-                    continue
-                
-                normalized_original = self.normalize_path(original_path)
-                image_path = Path(normalized_original)
-                
-                if image_path.exists() and image_path.is_file():
-                    new_row = [self.normalize_path(str(image_path))] + row[1:]
-                    processed_rows.append(new_row)
-                else:
-                    missing_count += 1
-                    filename = image_path.name
-                    
-                    if not filename:
-                        processed_rows.append(row)
-                        continue
-                    
-                    found_files = self.find_image_files(filename)
-                    
-                    if len(found_files) == 1:
-                        new_path = found_files[0]
-                        new_row = [new_path] + row[1:]
-                        processed_rows.append(new_row)
-                        corrected_count += 1
-                    elif len(found_files) > 1:
-                        multiple_found_count += 1
-                        if self.keep_original_order_var.get():
-                            new_path = found_files[0]
-                            new_row = [new_path] + row[1:]
-                            processed_rows.append(new_row)
-                            corrected_count += 1
-                        else:
-                            for found in found_files:
-                                new_row = [found] + row[1:]
-                                processed_rows.append(new_row)
-                            corrected_count += len(found_files)
-                    else:
-                        if self.create_missing_only_var.get():
-                            processed_rows.append(row)
-            
-            self.progress_var.set(100)
+            self.configure_engine()
+            stats = self.engine.process_csv(csv_path_str, output_path_str)
             
-            if not self.stop_event.is_set():
-                self.log_message(f"\n正在写入输出文件: {output_path}")
-                self.write_csv(str(output_path), processed_rows, encoding)
-                
-                elapsed_time = time.time() - start_time
-                self.log_message("\n" + "="*50)
-                self.log_message("处理完成!")
-                self.log_message(f"总行数: {total_rows}")
-                self.log_message(f"缺失图片: {missing_count}")
-                self.log_message(f"已纠正: {corrected_count}")
-                self.log_message(f"多个匹配文件的情况: {multiple_found_count}")
-                self.log_message(f"总耗时: {elapsed_time:.2f}秒")
-                
-                if self.use_fast_search_var.get():
-                    avg_search_time = (self.performance_stats['search_time'] / max(1, missing_count)) * 1000
-                    self.log_message(f"平均搜索时间: {avg_search_time:.2f}毫秒/文件")
-                
+            if not stats['stopped']:
                 messagebox.showinfo("处理完成", 
                     f"CSV文件处理完成！\n\n"
-                    f"总行数: {total_rows}\n"
-                    f"缺失图片: {missing_count}\n"
-                    f"已纠正: {corrected_count}\n"
-                    f"多个匹配文件的情况: {multiple_found_count}\n"
-                    f"总耗时: {elapsed_time:.2f}秒\n\n"
-                    f"输出文件: {output_path.name}")
+                    f"总行数: {stats['total_rows']}\n"
+                    f"缺失图片: {stats['missing']}\n"
+                    f"已纠正: {stats['corrected']}\n"
+                    f"多个匹配文件的情况: {stats['multiple_found']}\n"
+                    f"总耗时: {stats['elapsed']:.2f}秒\n\n"
+                    f"输出文件: {Path(output_path_str).name}")
             
         except Exception as e:
             self.log_message(f"\n错误: {str(e)}")
@@ -507,14 +244,7 @@ class CSVPathCorrector:
             self.processing = False
             self.start_button.config(state=tk.NORMAL)
             self.root.title("CSV图片路径纠正工具 - 高性能版")
-            self.file_index.clear()
-            self.folder_cache.clear()
-            self.performance_stats = {
-                'total_files': 0,
-                'cache_hits': 0,
-                'cache_misses': 0,
-                'search_time': 0.0
-            }
+            self.engine.reset()
     
     def start_processing(self):
         if self.processing:
@@ -527,18 +257,11 @@ class CSVPathCorrector:
         self.log_text.config(state='normal')
         self.log_text.delete(1.0, tk.END)
         self.log_text.config(state='disabled')
-        self.file_index.clear()
-        self.folder_cache.clear()
-        self.performance_stats = {
-            'total_files': 0,
-            'cache_hits': 0,
-            'cache_misses': 0,
-            'search_time': 0.0
-        }
+        self.engine.reset()
         self.progress_var.set(0)
         
         self.processing = True
-        self.stop_event.clear()
+        self.engine.stop_event.clear()
         self.start_button.config(state=tk.DISABLED)
         self.root.title("CSV图片路径纠正工具 - 处理中...")
         
@@ -547,7 +270,7 @@ class CSVPathCorrector:
     
     def stop_processing(self):
         if self.processing:
-            self.stop_event.set()
+            self.engine.stop_event.set()
             self.log_message("\n正在停止处理...")
     
     def log_message(self, message: str):
@@ -1,35 +1,374 @@
 #!/usr/bin/env python3.11
 import re
-import pandas as pd
 import os
+import io
+import csv
+import json
+import hashlib
+import time
+import shutil
+import tempfile
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from CSV读写 import detect_encoding
+from 列式目录 import CatalogWriter, MANIFEST_FILE, read_manifest
 from pathlib import Path
 import tkinter as tk
 from tkinter import filedialog
 import glob
-import chardet  # 新增：用于检测文件编码
+
+
+# 排序用的分桶缓冲区超过这个大小（字符数）就写入临时文件，内存占用与TXT大小无关
+SPILL_BUFFER_SIZE = 8 * 1024 * 1024
+
+# 每隔多少秒打印一次进度；每读取这么多行检查一次
+PROGRESS_INTERVAL = 5.0
+PROGRESS_LINES = 8192
+
+CSV_HEADER = ['图片路径', '标签数量', '标签', '标签(带置信度)', '置信度列表']
+
+# 增量转换的检查点文件（与输出CSV放在一起）
+CHECKPOINT_SUFFIX = '.checkpoint.json'
+CHECKPOINT_VERSION = 1
+
+# 并行转换时每段的大致大小
+PARALLEL_CHUNK_SIZE = 32 * 1024 * 1024
+
+# 记录 --all 模式已转换过哪些TXT（路径 -> [大小, mtime_ns]）
+CONVERSION_MANIFEST = 'txt_conversion_manifest.json'
+
+# DeepDanbooru 模型的标签表（相对于脚本目录，与 batch_process.bat 中的 MODEL_PATH 一致）
+MODEL_TAGS_PATH = os.path.join('Model_Files', 'deepdanbooru-v3-20211112-sgd-e28', 'tags.txt')
+
+# 检查TXT已转换部分是否被改动时，读取开头和检查点之前各这么多字节
+PREFIX_SAMPLE_SIZE = 64 * 1024
+
+TAG_PATTERN = re.compile(r'^\(([0-9.]+)\)\s+(.+)$')
 
 
 def detect_file_encoding(file_path):
     """
     自动检测文件编码，解决UnicodeDecodeError问题
+    见 CSV读写.detect_encoding：BOM优先，只对文件开头的一段样本检测，结果按文件大小和修改时间缓存
     """
     try:
-        with open(file_path, 'rb') as f:
-            raw_data = f.read()
-            result = chardet.detect(raw_data)
-            encoding = result['encoding']
-            confidence = result['confidence']
-            print(f"📝 自动检测文件编码: {encoding} (可信度: {confidence:.2f})")
-            return encoding
+        encoding = detect_encoding(file_path)
+        print(f"📝 自动检测文件编码: {encoding}")
+        return encoding
     except Exception as e:
-        print(f"⚠️  编码检测失败，使用默认编码 GBK: {e}")
-        return 'gbk'
+        print(f"⚠️  编码检测失败，使用默认编码 GB18030: {e}")
+        return 'gb18030'
+
+
+def is_ascii_compatible(encoding):
+    """
+    编码是否与ASCII兼容：换行和 "Tags of" 编码后的字节与ASCII相同，可以按字节逐行切分、按字节偏移定位。
+    UTF-16/32（如 Windows PowerShell 的 > 重定向输出）不兼容
+    """
+    # utf-8-sig 编码时会在开头加上BOM，只比较末尾
+    return '\nTags of '.encode(encoding).endswith(b'\nTags of ')
+
+
+def iter_image_records(txt_file_path, encoding, progress=None, start_offset=0, end_offset=None):
+    """
+    逐行读取TXT，把 "Tags of <图片路径>:" 开头的块解析为 (块起始字节偏移, 图片路径, [标签], [置信度])，
+    每个块产出一次。以二进制方式读取并单独解码每一行，只在内存中保留当前块；没有标签的图片不产出
+    progress 为可选的回调，参数为已读取到的字节位置（每读取一批行调用一次）
+    start_offset 为开始解析的字节位置，必须是某个 "Tags of" 行的开头；
+    end_offset 不为None时解析到该位置为止（同样必须是 "Tags of" 行的开头或文件末尾）
+    与ASCII不兼容的编码（UTF-16/32）按文本方式解码，记录中的偏移为None，也不能指定 start_offset / end_offset
+    """
+    current_offset = None
+    current_image = None
+    current_tags = []
+    current_confidences = []
+    bytes_read = start_offset
+    tag_match = TAG_PATTERN.match
+    byte_offsets = is_ascii_compatible(encoding)
+    if not byte_offsets and (start_offset or end_offset is not None):
+        raise ValueError(f"{encoding} 编码的TXT不能按字节偏移解析，请先转换为UTF-8")
+
+    with open(txt_file_path, 'rb') as f:
+        if byte_offsets:
+            f.seek(start_offset)
+            lines = f
+        else:
+            # 按文本方式解码后逐行转为UTF-8，下面的按行解析不变（已读取的字节数按转换后的计算，只用于进度）
+            lines = (line.encode('utf-8') for line in io.TextIOWrapper(f, encoding=encoding, errors='ignore'))
+            encoding = 'utf-8'
+        for line_number, raw_line in enumerate(lines):
+            line_offset = bytes_read
+            if end_offset is not None and line_offset >= end_offset:
+                break
+            bytes_read += len(raw_line)
+            if progress is not None and not line_number % PROGRESS_LINES:
+                progress(bytes_read)
+
+            line = raw_line.decode(encoding, errors='ignore').strip()
+            if not line:
+                continue
+
+            # 检查是否是标签行（绝大多数行）
+            if line[0] == '(':
+                match = tag_match(line)
+                if match:
+                    confidence, tag = match.groups()
+                    current_tags.append(tag.strip())
+                    current_confidences.append(float(confidence))
+
+            # 检查是否是新的图片开始
+            elif line.startswith('Tags of '):
+                # 产出上一个图片的数据
+                if current_image is not None and current_tags:
+                    yield current_offset if byte_offsets else None, current_image, current_tags, current_confidences
+
+                # 移除 "Tags of " 和末尾的冒号
+                image_path = line.replace('Tags of ', '')
+                if image_path.endswith(':'):
+                    image_path = image_path[:-1]
+
+                current_offset = line_offset
+                current_image = image_path.strip()
+                current_tags = []
+                current_confidences = []
+
+    # 产出最后一个图片的数据
+    if current_image is not None and current_tags:
+        yield current_offset if byte_offsets else None, current_image, current_tags, current_confidences
+
+
+def record_to_row(image_path, tags, confidences, relative_to):
+    """把一条图片记录转换为CSV的一行（图片路径转换为相对于 relative_to 的路径）"""
+    abs_image_path = Path(image_path)
+    try:
+        relative_image_path = abs_image_path.relative_to(relative_to)
+    except ValueError:
+        # 如果路径不在基准目录下，使用绝对路径
+        relative_image_path = abs_image_path
+
+    return [
+        str(relative_image_path),
+        len(tags),
+        ', '.join(tags),
+        ', '.join([f'{tag} ({conf})' for tag, conf in zip(tags, confidences)]),
+        ', '.join([f'{conf:.3f}' for conf in confidences]),
+    ]
+
+
+def write_rows_sorted_by_tag_count(rows, csv_file_path):
+    """
+    按标签数量从多到少写出CSV（数量相同时保持原顺序），返回写出的行数
+    每种标签数量一个分桶，缓冲区满了就追加到该分桶的临时文件，最后按数量从大到小依次拼接，
+    因此不需要把所有行同时放在内存中。先写入临时文件，完成后再替换输出文件
+    """
+    csv_file_path = Path(csv_file_path)
+    buffers = {}  # 标签数量 -> (StringIO, csv.writer)
+    buffered_chars = 0
+    row_count = 0
+
+    with tempfile.TemporaryDirectory(prefix='txt2csv_') as spill_dir:
+        def spill():
+            for tag_count, (buffer, _) in buffers.items():
+                with open(os.path.join(spill_dir, f'{tag_count}.csv'), 'a', encoding='utf-8', newline='') as f:
+                    f.write(buffer.getvalue())
+            buffers.clear()
+
+        for row in rows:
+            tag_count = row[1]
+            if tag_count not in buffers:
+                buffer = io.StringIO()
+                buffers[tag_count] = (buffer, csv.writer(buffer, lineterminator=os.linesep))
+            buffers[tag_count][1].writerow(row)
+            # 按主要字段的长度估算缓冲区大小（StringIO.tell() 很慢）
+            buffered_chars += len(row[0]) + len(row[3]) * 2
+            row_count += 1
+            if buffered_chars >= SPILL_BUFFER_SIZE:
+                spill()
+                buffered_chars = 0
+
+        if row_count == 0:
+            return 0
+
+        spill()
+        temp_path = csv_file_path.with_name(csv_file_path.name + '.part')
+        try:
+            with open(temp_path, 'w', encoding='utf-8-sig', newline='') as out:
+                csv.writer(out, lineterminator=os.linesep).writerow(CSV_HEADER)
+                tag_counts = sorted((int(name[:-4]) for name in os.listdir(spill_dir)), reverse=True)
+                for tag_count in tag_counts:
+                    with open(os.path.join(spill_dir, f'{tag_count}.csv'), 'r', encoding='utf-8', newline='') as f:
+                        shutil.copyfileobj(f, out)
+            os.replace(temp_path, csv_file_path)
+        except BaseException:
+            if temp_path.exists():
+                os.remove(temp_path)
+            raise
+
+    return row_count
+
+
+def checkpoint_path_for(csv_file_path):
+    return Path(str(csv_file_path) + CHECKPOINT_SUFFIX)
+
+
+def prefix_hash(txt_file_path, offset):
+    """
+    TXT前 offset 个字节的指纹：长度 + 开头和 offset 之前各一段数据的哈希
+    只读取两段样本，不读取整个前缀，用来发现TXT被替换或改写（而不是仅在末尾追加）
+    """
+    digest = hashlib.blake2b(str(offset).encode('ascii'), digest_size=16)
+    with open(txt_file_path, 'rb') as f:
+        digest.update(f.read(min(offset, PREFIX_SAMPLE_SIZE)))
+        tail_start = max(0, offset - PREFIX_SAMPLE_SIZE)
+        f.seek(tail_start)
+        digest.update(f.read(offset - tail_start))
+    return digest.hexdigest()
+
+
+def save_checkpoint(txt_file_path, csv_file_path, relative_to, encoding, record, row, catalog_images=None):
+    """
+    记录转换进度：最后一个图片块的起始偏移和它写出的行。
+    最后一个块可能还在写入中，下次从它的开头重新解析，内容有变化时替换这一行
+    catalog_images 为同时写出的列式目录中的图片数，用来确认目录与CSV一致
+    """
+    csv_stat = os.stat(csv_file_path)
+    checkpoint = {
+        'version': CHECKPOINT_VERSION,
+        'txt_file': os.path.abspath(txt_file_path),
+        'txt_size': os.path.getsize(txt_file_path),
+        'relative_to': str(relative_to),
+        'encoding': encoding,
+        'offset': record[0],
+        'prefix_hash': prefix_hash(txt_file_path, record[0]),
+        'last_row': row,
+        'csv_size': csv_stat.st_size,
+        'csv_mtime_ns': csv_stat.st_mtime_ns,
+        'catalog_images': catalog_images,
+    }
+    checkpoint_path = checkpoint_path_for(csv_file_path)
+    temp_path = checkpoint_path.with_name(checkpoint_path.name + '.part')
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, checkpoint_path)
+
+
+def load_checkpoint(txt_file_path, csv_file_path, relative_to, catalog_dir=None):
+    """
+    读取检查点；TXT的已转换部分或输出CSV在上次转换后被改动过时返回None
+    指定了 catalog_dir 时，列式目录也必须与检查点一致
+    """
+    try:
+        with open(checkpoint_path_for(csv_file_path), 'r', encoding='utf-8') as f:
+            checkpoint = json.load(f)
+        csv_stat = os.stat(csv_file_path)
+        txt_size = os.path.getsize(txt_file_path)
+    except (OSError, ValueError):
+        return None
+
+    if (checkpoint.get('version') != CHECKPOINT_VERSION
+            or not is_ascii_compatible(checkpoint['encoding'])
+            or checkpoint['txt_file'] != os.path.abspath(txt_file_path)
+            or checkpoint['relative_to'] != str(relative_to)
+            or checkpoint['csv_size'] != csv_stat.st_size
+            or checkpoint['csv_mtime_ns'] != csv_stat.st_mtime_ns
+            or txt_size < checkpoint['txt_size']):
+        return None
+    if catalog_dir is not None:
+        manifest = read_manifest(catalog_dir)
+        if manifest is None or manifest['images'] != checkpoint.get('catalog_images'):
+            return None
+    if prefix_hash(txt_file_path, checkpoint['offset']) != checkpoint['prefix_hash']:
+        return None
+    return checkpoint
+
+
+def convert_incrementally(txt_file_path, csv_file_path, relative_to, checkpoint, catalog_dir=None):
+    """
+    只解析检查点之后的部分，新记录追加到CSV末尾（按出现顺序，不参与整体排序）；
+    上次的最后一个块内容有变化时，流式重写CSV替换那一行。返回写出的新行数
+    列式目录中最后一个块总是最后一张图片，直接去掉后追加
+    """
+    csv_file_path = Path(csv_file_path)
+    encoding = checkpoint['encoding']
+    if os.path.getsize(txt_file_path) == checkpoint['txt_size']:
+        return 0
+
+    catalog = CatalogWriter(catalog_dir, append=True) if catalog_dir is not None else None
+
+    records = iter_image_records(txt_file_path, encoding, start_offset=checkpoint['offset'])
+    last_record = None
+    last_row = None
+    first_row = None
+    tail_path = csv_file_path.with_name(csv_file_path.name + '.tail')
+    new_rows = 0
+    try:
+        with open(tail_path, 'w', encoding='utf-8', newline='') as tail:
+            writer = csv.writer(tail, lineterminator=os.linesep)
+            for record in records:
+                row = [str(value) for value in record_to_row(*record[1:], relative_to)]
+                if first_row is None:
+                    first_row = row
+                    # 上次的最后一个块没有变化，不需要重写
+                    if row == checkpoint['last_row']:
+                        last_record, last_row = record, row
+                        continue
+                    if catalog is not None:
+                        catalog.truncate(catalog.images - 1)
+                writer.writerow(row)
+                if catalog is not None:
+                    catalog.add(row[0], record[2], record[3])
+                new_rows += 1
+                last_record, last_row = record, row
+
+        if last_record is None:
+            return 0
+
+        if first_row != checkpoint['last_row']:
+            # 最后一个块在上次转换时尚未写完：去掉旧的那一行后拼接新内容
+            temp_path = csv_file_path.with_name(csv_file_path.name + '.part')
+            with open(csv_file_path, 'r', encoding='utf-8-sig', newline='') as src, \
+                    open(temp_path, 'w', encoding='utf-8-sig', newline='') as dst, \
+                    open(tail_path, 'r', encoding='utf-8', newline='') as tail:
+                writer = csv.writer(dst, lineterminator=os.linesep)
+                removed = False
+                for row in csv.reader(src):
+                    if not removed and row == checkpoint['last_row']:
+                        removed = True
+                        continue
+                    writer.writerow(row)
+                shutil.copyfileobj(tail, dst)
+            os.replace(temp_path, csv_file_path)
+        else:
+            with open(csv_file_path, 'a', encoding='utf-8', newline='') as dst, \
+                    open(tail_path, 'r', encoding='utf-8', newline='') as tail:
+                shutil.copyfileobj(tail, dst)
+        if catalog is not None:
+            catalog.close()
+    except BaseException:
+        # 列式目录可能已被截断：删掉清单，下次完整转换
+        if catalog is not None and os.path.exists(os.path.join(catalog_dir, MANIFEST_FILE)):
+            os.remove(os.path.join(catalog_dir, MANIFEST_FILE))
+        raise
+    finally:
+        if tail_path.exists():
+            os.remove(tail_path)
+
+    save_checkpoint(txt_file_path, csv_file_path, relative_to, encoding, last_record, last_row,
+                    catalog.images if catalog is not None else None)
+    return new_rows
 
 
-def convert_deepdanbooru_txt_to_csv(txt_file_path, csv_file_path=None, relative_to=None):
+def convert_deepdanbooru_txt_to_csv(txt_file_path, csv_file_path=None, relative_to=None, incremental=False,
+                                    catalog_dir=None, base_vocab_path=None):
     """
     将DeepDanbooru输出的TXT文件转换为CSV格式
     relative_to: 相对路径的基准目录，如果为None则使用txt文件所在目录
+    逐行流式解析，内存占用与TXT文件大小无关
+    incremental: 为True时使用检查点，只转换TXT上次转换后新追加的部分；
+                 没有可用的检查点时完整转换一次并记录检查点
+    catalog_dir: 不为None时同时写出列式标签目录（见 列式目录.py），
+                 base_vocab_path 为模型的 tags.txt 时标签ID与模型一致
     """
     
     if csv_file_path is None:
@@ -43,117 +382,73 @@ def convert_deepdanbooru_txt_to_csv(txt_file_path, csv_file_path=None, relative_
         relative_to = Path(txt_file_path).parent
     else:
         relative_to = Path(relative_to)
+
+    if incremental:
+        checkpoint = load_checkpoint(txt_file_path, csv_file_path, relative_to, catalog_dir)
+        if checkpoint is not None:
+            start_time = time.time()
+            new_rows = convert_incrementally(txt_file_path, csv_file_path, relative_to, checkpoint, catalog_dir)
+            size_mb = (os.path.getsize(txt_file_path) - checkpoint['offset']) / (1024 * 1024)
+            print(f"⏩ 增量转换：从第 {checkpoint['offset']} 字节继续，读取 {size_mb:.1f} MB，"
+                  f"新增或更新 {new_rows} 条记录，耗时 {time.time() - start_time:.2f}秒")
+            print(f"   输出文件: {csv_file_path}")
+            return csv_file_path
+        print("📝 没有可用的检查点，完整转换")
     
-    # ========== 核心修改：自动检测编码并读取文件 ==========
-    # 检测文件编码
     file_encoding = detect_file_encoding(txt_file_path)
-    # 尝试使用检测到的编码读取，失败则依次尝试常用编码
-    encodings_to_try = [file_encoding, 'gbk', 'gb2312', 'utf-8', 'gb18030']
-    lines = None
-    
-    for enc in encodings_to_try:
-        try:
-            with open(txt_file_path, 'r', encoding=enc, errors='ignore') as f:
-                lines = f.readlines()
-            print(f"✅ 使用编码 {enc} 成功读取文件")
-            break
-        except Exception as e:
-            print(f"⚠️  使用编码 {enc} 读取失败: {e}")
-            continue
-    
-    if lines is None:
-        print("❌❌❌❌ 所有编码尝试均失败，无法读取文件")
-        return None
-    # ========== 编码读取部分修改结束 ==========
-    
-    results = []
-    current_image = None
-    current_tags = []
-    current_confidences = []
-    
-    tag_pattern = re.compile(r'^\(([0-9.]+)\)\s+(.+)$')
-    
-    for line in lines:
-        line = line.strip()
-        
-        if not line:
-            continue
-        
-        # 检查是否是新的图片开始
-        if line.startswith('Tags of '):
-            # 保存上一个图片的数据
-            if current_image is not None and current_tags:
-                # 转换为相对路径
-                abs_image_path = Path(current_image)
-                try:
-                    relative_image_path = abs_image_path.relative_to(relative_to)
-                except ValueError:
-                    # 如果路径不在基准目录下，使用绝对路径
-                    relative_image_path = abs_image_path
-                
-                results.append({
-                    '图片路径': str(relative_image_path),
-                    '标签数量': len(current_tags),
-                    '标签': ', '.join(current_tags),
-                    '标签(带置信度)': ', '.join([f'{tag} ({conf})' for tag, conf in zip(current_tags, current_confidences)]),
-                    '置信度列表': ', '.join([f'{conf:.3f}' for conf in current_confidences])
-                })
-            
-            # 移除 "Tags of " 和末尾的冒号
-            image_path = line.replace('Tags of ', '')
-            if image_path.endswith(':'):
-                image_path = image_path[:-1]
-            
-            current_image = image_path.strip()
-            current_tags = []
-            current_confidences = []
-        
-        # 检查是否是标签行
-        elif line.startswith('('):
-            match = tag_pattern.match(line)
-            if match:
-                confidence = float(match.group(1))
-                tag = match.group(2).strip()
-                current_tags.append(tag)
-                current_confidences.append(confidence)
-    
-    # 保存最后一个图片的数据
-    if current_image is not None and current_tags:
-        # 转换为相对路径（修复原代码的变量名错误：relative_base → relative_to）
-        abs_image_path = Path(current_image)
-        try:
-            relative_image_path = abs_image_path.relative_to(relative_to)
-        except ValueError:
-            # 如果路径不在基准目录下，使用绝对路径
-            relative_image_path = abs_image_path
-        
-        results.append({
-            '图片路径': str(relative_image_path),
-            '标签数量': len(current_tags),
-            '标签': ', '.join(current_tags),
-            '标签(带置信度)': ', '.join([f'{tag} ({conf})' for tag, conf in zip(current_tags, current_confidences)]),
-            '置信度列表': ', '.join([f'{conf:.3f}' for conf in current_confidences])
-        })
-    
-    if results:
-        df = pd.DataFrame(results)
-        
-        # 按标签数量排序
-        df = df.sort_values('标签数量', ascending=False).reset_index(drop=True)
-        
-        # 保存为CSV
-        df.to_csv(csv_file_path, index=False, encoding='utf-8-sig')
-        
-        print(f"✅ 转换完成！")
-        print(f"   处理的图片数量: {len(results)}")
+    total_bytes = max(1, os.path.getsize(txt_file_path))
+    start_time = time.time()
+    last_report = [start_time]
+
+    def report_progress(bytes_read):
+        now = time.time()
+        if now - last_report[0] >= PROGRESS_INTERVAL:
+            last_report[0] = now
+            speed = bytes_read / (1024 * 1024) / max(now - start_time, 1e-9)
+            print(f"   已读取 {bytes_read / total_bytes * 100:.1f}% ({speed:.1f} MB/s)")
+
+    last_record = [None]
+    catalog = CatalogWriter(catalog_dir, base_vocab_path) if catalog_dir is not None else None
+
+    def rows():
+        for record in iter_image_records(txt_file_path, file_encoding, report_progress):
+            last_record[0] = record
+            row = record_to_row(*record[1:], relative_to)
+            if catalog is not None:
+                catalog.add(row[0], record[2], record[3])
+            yield row
+
+    row_count = write_rows_sorted_by_tag_count(rows(), csv_file_path)
+    if catalog is not None:
+        catalog.close()
+
+    elapsed = time.time() - start_time
+    size_mb = total_bytes / (1024 * 1024)
+    print(f"⏱️  读取 {size_mb:.1f} MB，耗时 {elapsed:.2f}秒 ({size_mb / max(elapsed, 1e-9):.1f} MB/s)")
+
+    if row_count:
+        print("✅ 转换完成！")
+        print(f"   处理的图片数量: {row_count}")
         print(f"   输出文件: {csv_file_path}")
         print(f"   相对路径基准目录: {relative_to}")
+        if catalog is not None:
+            print(f"   列式标签目录: {catalog_dir} (标签词表 {len(catalog.vocab)} 个)")
+
+        if incremental and not is_ascii_compatible(file_encoding):
+            # 检查点按字节偏移定位，UTF-16/32 的TXT不能从中间开始解析
+            print(f"⚠️  {file_encoding} 编码的TXT不支持增量转换，下次仍会完整转换（可以先把TXT另存为UTF-8）")
+        elif incremental:
+            last_row = [str(value) for value in record_to_row(*last_record[0][1:], relative_to)]
+            save_checkpoint(txt_file_path, csv_file_path, relative_to, file_encoding, last_record[0], last_row,
+                            catalog.images if catalog is not None else None)
         
         # 验证路径格式
         print("\n📁📁📁📁 验证前3条路径格式:")
-        for i in range(min(3, len(df))):
-            path = df.iloc[i]['图片路径']
-            print(f"  {i+1}. {path}")
+        with open(csv_file_path, 'r', encoding='utf-8-sig', newline='') as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            for i, row in enumerate(itertools.islice(reader, 3)):
+                print(f"  {i+1}. {row[0]}")
         
         return csv_file_path
     else:
@@ -161,18 +456,57 @@ def convert_deepdanbooru_txt_to_csv(txt_file_path, csv_file_path=None, relative_
         return None
 
 
-def check_pandas_installed():
-    """检查pandas是否已安装"""
+def convert_txt_to_rows(txt_file_path, csv_file_path, relative_to, catalog_dir=None, base_vocab_path=None):
+    """
+    解析TXT并返回内存中的行（按标签数量从多到少排列，与写出的CSV一致）
+    CSV和列式目录只作为检查点写出，调用方（刷新流程）直接把返回的行交给下一步，不再重新读取CSV；
+    一次刷新的新图片不多，行可以全部放在内存中
+    """
+    file_encoding = detect_file_encoding(txt_file_path)
+    records = (record[1:] for record in iter_image_records(txt_file_path, file_encoding))
+    return records_to_rows(records, csv_file_path, relative_to, catalog_dir, base_vocab_path)
+
+
+def records_to_rows(records, csv_file_path, relative_to, catalog_dir=None, base_vocab_path=None):
+    """
+    把 (图片路径, [标签], [置信度]) 记录转换为行，写出CSV和列式目录并返回行（同 convert_txt_to_rows）
+    记录可以直接来自打标签引擎，不经过TXT；没有标签的图片跳过（与解析TXT时一致）
+    """
+    relative_to = Path(relative_to)
+    catalog = CatalogWriter(catalog_dir, base_vocab_path) if catalog_dir is not None else None
+    rows = []
+    for image_path, tags, confidences in records:
+        if not tags:
+            continue
+        row = record_to_row(image_path, tags, confidences, relative_to)
+        if catalog is not None:
+            catalog.add(row[0], tags, confidences)
+        rows.append(row)
+    if catalog is not None:
+        catalog.close()
+
+    # reverse=True 的排序同样是稳定的，数量相同的行保持原顺序
+    rows.sort(key=lambda row: row[1], reverse=True)
+    write_rows_sorted_by_tag_count(rows, csv_file_path)
+    return rows
+
+
+def build_matrix_for_catalog(catalog_dir):
+    """由列式目录生成图片×标签稀疏矩阵（见 标签矩阵.py，需要numpy），目录没有变化时跳过"""
     try:
-        import pandas
-        return True
-    except ImportError:
-        return False
+        from 标签矩阵 import build_tag_matrix
+    except ImportError as e:
+        print(f"⚠️  无法生成稀疏矩阵（需要numpy）: {e}")
+        return
+    start_time = time.time()
+    matrix_dir, rebuilt = build_tag_matrix(catalog_dir)
+    if rebuilt:
+        print(f"🧮 已生成图片×标签稀疏矩阵: {matrix_dir}，耗时 {time.time() - start_time:.2f}秒")
 
 
-def find_latest_txt_file(directory):
+def find_txt_files(directory):
     """
-    在指定目录下查找最新的TXT文件
+    在指定目录下查找DeepDanbooru输出的TXT文件
     文件名格式示例：图片标签数据_20260112_021529.txt
     """
     # 匹配文件名模式：图片标签数据_YYYYMMDD_HHMMSS.txt
@@ -182,6 +516,193 @@ def find_latest_txt_file(directory):
     if not txt_files:
         # 如果没有找到特定格式的文件，查找所有TXT文件
         txt_files = glob.glob(os.path.join(directory, "*.txt"))
+    return txt_files
+
+
+def normalize_txt_encoding(txt_file_path, encoding, output_dir):
+    """
+    把与ASCII不兼容的TXT（UTF-16/32）逐行转为UTF-8写入 output_dir，返回新文件路径；
+    之后可以按字节偏移切分和解析（编码为 'utf-8'）
+    """
+    output_path = os.path.join(output_dir, f"{Path(txt_file_path).stem}.utf8.txt")
+    with open(txt_file_path, 'r', encoding=encoding, errors='ignore', newline='') as src, \
+            open(output_path, 'w', encoding='utf-8', newline='') as dst:
+        shutil.copyfileobj(src, dst)
+    return output_path
+
+
+def find_block_boundaries(txt_file_path, chunk_size=PARALLEL_CHUNK_SIZE, encoding=None):
+    """
+    把TXT按大约 chunk_size 字节切分成若干段，每段都从 "Tags of" 行的开头开始，
+    返回 [(起始偏移, 结束偏移)]；找不到合适的切分点时整个文件作为一段
+    按字节查找 "Tags of"，encoding 与ASCII不兼容时无法切分（先用 normalize_txt_encoding 转换）
+    """
+    if encoding is not None and not is_ascii_compatible(encoding):
+        raise ValueError(f"{encoding} 编码的TXT不能按字节切分，请先转换为UTF-8")
+    file_size = os.path.getsize(txt_file_path)
+    boundaries = [0]
+    with open(txt_file_path, 'rb') as f:
+        position = chunk_size
+        while position < file_size:
+            f.seek(position)
+            f.readline()  # 跳过可能不完整的一行
+            while True:
+                line_start = f.tell()
+                line = f.readline()
+                if not line or line.lstrip().startswith(b'Tags of '):
+                    break
+            if not line:
+                break
+            boundaries.append(line_start)
+            position = line_start + chunk_size
+    boundaries.append(file_size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def convert_txt_chunk(task):
+    """
+    进程池任务：把TXT的一段转换为CSV行写入临时文件（不排序），返回行数
+    每行末尾多一列以空格分隔的原始置信度，合并时用于写出列式目录
+    """
+    txt_file_path, encoding, start, end, relative_to, output_path = task
+    row_count = 0
+    with open(output_path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f, lineterminator=os.linesep)
+        for record in iter_image_records(txt_file_path, encoding, start_offset=start, end_offset=end):
+            row = record_to_row(*record[1:], relative_to)
+            row.append(' '.join(map(repr, record[3])))
+            writer.writerow(row)
+            row_count += 1
+    return row_count
+
+
+def load_conversion_manifest(output_csv_dir):
+    try:
+        with open(os.path.join(output_csv_dir, CONVERSION_MANIFEST), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_conversion_manifest(output_csv_dir, manifest):
+    manifest_path = os.path.join(output_csv_dir, CONVERSION_MANIFEST)
+    with open(manifest_path + '.part', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(manifest_path + '.part', manifest_path)
+
+
+def txt_file_signature(txt_file_path):
+    stat = os.stat(txt_file_path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def find_unconverted_txt_files(directory, output_csv_dir):
+    """
+    找出还没有转换过的TXT：既没有记录在转换清单中（或记录后又被修改），
+    也没有比TXT更新的单独转换结果（<文件名>_CSV格式.csv）
+    按修改时间从旧到新排列
+    """
+    manifest = load_conversion_manifest(output_csv_dir)
+    unconverted = []
+    for txt_file_path in find_txt_files(directory):
+        if manifest.get(os.path.abspath(txt_file_path)) == txt_file_signature(txt_file_path):
+            continue
+        csv_file_path = os.path.join(output_csv_dir, f"{Path(txt_file_path).stem}_CSV格式.csv")
+        if os.path.exists(csv_file_path) and os.path.getmtime(csv_file_path) >= os.path.getmtime(txt_file_path):
+            continue
+        unconverted.append(txt_file_path)
+    return sorted(unconverted, key=os.path.getmtime)
+
+
+def merge_chunk_outputs(chunk_paths, csv_file_path, catalog=None):
+    """
+    合并各段的转换结果并按图片路径去重（同一图片出现多次时保留最后一次，即最新的标签），
+    再按标签数量排序写出。返回 (写出的行数, 去掉的重复行数)
+    第一遍只记录每个路径最后出现的位置，第二遍流式写出，不把所有行同时放在内存中
+    catalog 不为None时，去重后的记录同时写入列式目录
+    """
+    def iter_chunk_rows():
+        for chunk_index, chunk_path in enumerate(chunk_paths):
+            with open(chunk_path, 'r', encoding='utf-8', newline='') as f:
+                for row_index, row in enumerate(csv.reader(f)):
+                    yield (chunk_index, row_index), row
+
+    latest = {}
+    total = 0
+    for position, row in iter_chunk_rows():
+        latest[os.path.normcase(row[0])] = position
+        total += 1
+
+    def unique_rows():
+        for position, row in iter_chunk_rows():
+            if latest[os.path.normcase(row[0])] == position:
+                confidences = row.pop()
+                row[1] = int(row[1])
+                if catalog is not None:
+                    catalog.add(row[0], row[2].split(', ') if row[1] else [],
+                                [float(value) for value in confidences.split()])
+                yield row
+
+    row_count = write_rows_sorted_by_tag_count(unique_rows(), csv_file_path)
+    return row_count, total - row_count
+
+
+def convert_txt_files_parallel(txt_files, csv_file_path, relative_to, max_workers=None,
+                               catalog_dir=None, base_vocab_path=None, chunk_size=PARALLEL_CHUNK_SIZE):
+    """
+    用进程池转换多个TXT：大文件在 "Tags of" 边界处切成多段（每段约 chunk_size 字节）并行解析，
+    所有结果合并为一个去重后的CSV；越晚的TXT优先级越高。
+    UTF-16/32 的TXT先转为UTF-8临时文件再切分。
+    catalog_dir 不为None时同时写出列式标签目录
+    成功后把这些TXT记入转换清单，返回写出的行数
+    """
+    relative_to = Path(relative_to)
+    output_csv_dir = os.path.dirname(os.path.abspath(csv_file_path))
+    start_time = time.time()
+    total_bytes = sum(os.path.getsize(path) for path in txt_files)
+
+    with tempfile.TemporaryDirectory(prefix='txt2csv_parallel_') as chunk_dir:
+        tasks = []
+        for index, txt_file_path in enumerate(txt_files):
+            encoding = detect_file_encoding(txt_file_path)
+            source_path = txt_file_path
+            if not is_ascii_compatible(encoding):
+                source_dir = os.path.join(chunk_dir, f'source_{index:04d}')
+                os.makedirs(source_dir)
+                source_path = normalize_txt_encoding(txt_file_path, encoding, source_dir)
+                encoding = 'utf-8'
+            for start, end in find_block_boundaries(source_path, chunk_size, encoding):
+                output_path = os.path.join(chunk_dir, f'{len(tasks):06d}.csv')
+                tasks.append((source_path, encoding, start, end, relative_to, output_path))
+
+        print(f"🚀 {len(txt_files)} 个TXT共 {total_bytes / (1024 * 1024):.1f} MB，切分为 {len(tasks)} 段并行解析")
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            parsed = sum(executor.map(convert_txt_chunk, tasks))
+
+        catalog = CatalogWriter(catalog_dir, base_vocab_path) if catalog_dir is not None else None
+        row_count, duplicates = merge_chunk_outputs([task[-1] for task in tasks], csv_file_path, catalog)
+        if catalog is not None:
+            catalog.close()
+
+    elapsed = time.time() - start_time
+    size_mb = total_bytes / (1024 * 1024)
+    print(f"⏱️  读取 {size_mb:.1f} MB，耗时 {elapsed:.2f}秒 ({size_mb / max(elapsed, 1e-9):.1f} MB/s)")
+    print(f"   解析记录 {parsed} 条，去掉重复 {duplicates} 条，写出 {row_count} 条")
+
+    if row_count:
+        manifest = load_conversion_manifest(output_csv_dir)
+        for txt_file_path in txt_files:
+            manifest[os.path.abspath(txt_file_path)] = txt_file_signature(txt_file_path)
+        save_conversion_manifest(output_csv_dir, manifest)
+    return row_count
+
+
+def find_latest_txt_file(directory):
+    """
+    在指定目录下查找最新的TXT文件
+    文件名格式示例：图片标签数据_20260112_021529.txt
+    """
+    txt_files = find_txt_files(directory)
     
     if not txt_files:
         return None
@@ -196,29 +717,20 @@ def find_latest_txt_file(directory):
 # =============================
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="DeepDanbooru TXT转CSV工具")
+    parser.add_argument('--full', action='store_true',
+                        help="忽略检查点，重新完整转换（输出整体按标签数量排序）")
+    parser.add_argument('--all', action='store_true',
+                        help="并行转换 Exported_Labels 中所有尚未转换的TXT，合并为一个去重后的CSV")
+    parser.add_argument('-j', '--jobs', type=int, default=None, help="--all 模式的进程数（默认为CPU核心数）")
+    parser.add_argument('--no-catalog', action='store_true',
+                        help="不写出列式标签目录（<CSV文件名>.catalog，标签ID + 置信度数组）")
+    args = parser.parse_args()
+
     print("=" * 60)
     print("DeepDanbooru TXT转CSV工具 (自动选择最新文件版)")
     print("=" * 60)
 
-    # ===== 检查依赖 =====
-    required_packages = {'pandas': check_pandas_installed()}
-    try:
-        import chardet
-        required_packages['chardet'] = True
-    except ImportError:
-        required_packages['chardet'] = False
-
-    # 检查缺失的依赖
-    missing_packages = [pkg for pkg, installed in required_packages.items() if not installed]
-    if missing_packages:
-        print("❌❌❌❌ 错误: 缺少必要的模块")
-        for pkg in missing_packages:
-            print(f"   - {pkg} 未安装")
-        print("\n请运行以下命令安装:")
-        print(f"pip install {' '.join(missing_packages)}")
-        input("\n按Enter键退出...")
-        exit(1)
-
     # ===== 自动查找最新文件 =====
     script_dir = os.path.dirname(os.path.abspath(__file__))
     exported_labels_dir = os.path.join(script_dir, "Exported_Labels")
@@ -228,11 +740,50 @@ if __name__ == "__main__":
     
     # 检查目录是否存在
     if not os.path.exists(exported_labels_dir):
-        print(f"❌❌❌❌ 错误: Exported_Labels 文件夹不存在")
-        print(f"请确保在脚本同目录下存在 Exported_Labels 文件夹")
+        print("❌❌❌❌ 错误: Exported_Labels 文件夹不存在")
+        print("请确保在脚本同目录下存在 Exported_Labels 文件夹")
         input("\n按 Enter 键退出...")
         exit()
 
+    # ===== 自动选择模式1 =====
+    print("\n📁📁 自动选择模式1: 使用脚本所在目录作为基准目录")
+    relative_base = Path(script_dir)
+    print(f"   基准目录: {relative_base}")
+
+    # ===== 设置 CSV 输出目录 =====
+    output_csv_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Exported_Labels_csv")
+    os.makedirs(output_csv_dir, exist_ok=True)
+    print(f"📂📂📂📂 CSV 文件将保存到: {output_csv_dir}")
+
+    # 模型自带的标签表，使列式目录的标签ID与模型一致
+    base_vocab_path = os.path.join(script_dir, MODEL_TAGS_PATH)
+    if not os.path.exists(base_vocab_path):
+        base_vocab_path = None
+
+    def catalog_dir_for(csv_file_path):
+        return None if args.no_catalog else Path(csv_file_path).with_suffix('.catalog')
+
+    if args.all:
+        # ===== 并行转换所有未转换的TXT =====
+        txt_files = find_unconverted_txt_files(exported_labels_dir, output_csv_dir)
+        if not txt_files:
+            print("✅ 所有TXT都已转换过，没有需要处理的文件")
+            exit()
+
+        print(f"✅ 找到 {len(txt_files)} 个未转换的TXT:")
+        for txt_file_path in txt_files:
+            print(f"   - {txt_file_path}")
+
+        merged_csv_path = os.path.join(output_csv_dir, f"合并标签数据_{time.strftime('%Y%m%d_%H%M%S')}_CSV格式.csv")
+        if convert_txt_files_parallel(txt_files, merged_csv_path, relative_base, args.jobs,
+                                      catalog_dir_for(merged_csv_path), base_vocab_path):
+            print(f"✅ 转换成功！CSV 已保存至: {merged_csv_path}")
+            if not args.no_catalog:
+                build_matrix_for_catalog(catalog_dir_for(merged_csv_path))
+        else:
+            print("❌❌❌❌ 转换失败或无有效数据")
+        exit()
+
     # 查找最新文件
     latest_txt_file = find_latest_txt_file(exported_labels_dir)
     
@@ -246,16 +797,6 @@ if __name__ == "__main__":
     
     txt_files = [latest_txt_file]
 
-    # ===== 自动选择模式1 =====
-    print("\n📁📁 自动选择模式1: 使用脚本所在目录作为基准目录")
-    relative_base = Path(script_dir)
-    print(f"   基准目录: {relative_base}")
-
-    # ===== 设置 CSV 输出目录 =====
-    output_csv_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Exported_Labels_csv")
-    os.makedirs(output_csv_dir, exist_ok=True)
-    print(f"📂📂📂📂 CSV 文件将保存到: {output_csv_dir}")
-
     # ===== 开始转换文件 =====
     for txt_file_path in txt_files:
         print(f"\n🔍🔍🔍🔍 正在处理文件: {txt_file_path}")
@@ -269,11 +810,16 @@ if __name__ == "__main__":
         result_csv_path = convert_deepdanbooru_txt_to_csv(
             txt_file_path, 
             csv_file_path=csv_file_path,
-            relative_to=relative_base
+            relative_to=relative_base,
+            incremental=not args.full,
+            catalog_dir=catalog_dir_for(csv_file_path),
+            base_vocab_path=base_vocab_path
         )
 
         if result_csv_path:
             print(f"✅ 转换成功！CSV 已保存至: {result_csv_path}")
+            if not args.no_catalog:
+                build_matrix_for_catalog(catalog_dir_for(csv_file_path))
         else:
             print(f"❌❌❌❌ 转换失败或无有效数据: {txt_file_path}")
 
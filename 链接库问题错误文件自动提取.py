@@ -2,6 +2,7 @@ import os
 import glob
 import shutil
 import pathlib
+from CSV读写 import open_text
 
 def get_latest_txt_by_mtime(folder_path):
     """
@@ -20,7 +21,7 @@ def extract_file_path_from_txt(txt_file):
     从txt文件中提取文件路径
     规则：找到以"Tags of "开头的最后一行
     """
-    with open(txt_file, 'r', encoding='utf-8') as f:
+    with open_text(txt_file, errors='ignore') as f:
         lines = f.readlines()
     
     # 逆序遍历，找到第一个包含"Tags of "的行
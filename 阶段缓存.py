@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+流水线各步骤的结果缓存（按内容寻址）
+每个步骤把 输入文件的内容哈希 + 参数 组合成一个键，连同输出文件的签名记录在
+Index_Cache/stage_cache.json 中。下次运行时键相同且输出文件没有被改动，就直接使用上次的输出，跳过这一步。
+文件内容哈希按 (路径, 大小, 修改时间) 缓存，文件没变时不重新读取；
+每次运行中各步骤是执行还是跳过记录在清单的 last_run 中，便于查看
+"""
+
+import os
+import json
+import hashlib
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from 文件索引 import full_fingerprint
+
+# 缓存格式或各步骤的输出格式变化时修改，使旧的缓存全部失效
+CACHE_VERSION = 1
+
+DEFAULT_MANIFEST_PATH = Path(__file__).resolve().parent / "Index_Cache" / "stage_cache.json"
+
+# 文件内容哈希缓存的条目上限
+FILE_HASH_MAX_ENTRIES = 4096
+
+
+def _file_key(file_path) -> str:
+    return os.path.normcase(os.path.abspath(file_path))
+
+
+def _output_signature(file_path) -> Optional[List[int]]:
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class StageCache:
+    """读取和更新步骤缓存清单；一次运行使用一个实例，结束时调用 save()"""
+
+    def __init__(self, manifest_path=None):
+        self.manifest_path = Path(manifest_path) if manifest_path else DEFAULT_MANIFEST_PATH
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = {}
+        if manifest.get('version') != CACHE_VERSION:
+            manifest = {'version': CACHE_VERSION, 'stages': {}, 'files': {}}
+        self.manifest = manifest
+        self.manifest['last_run'] = []
+
+    def file_hash(self, file_path) -> str:
+        """文件内容的哈希；大小和修改时间与上次相同时直接使用记录的哈希"""
+        key = _file_key(file_path)
+        signature = _output_signature(file_path)
+        if signature is None:
+            raise FileNotFoundError(f"文件不存在: {file_path}")
+        files = self.manifest['files']
+        cached = files.get(key)
+        if cached is not None and cached[:2] == signature:
+            return cached[2]
+        digest = full_fingerprint(str(file_path))
+        files.pop(key, None)
+        files[key] = signature + [digest]
+        for old_key in list(files)[:max(0, len(files) - FILE_HASH_MAX_ENTRIES)]:
+            del files[old_key]
+        return digest
+
+    def key(self, stage: str, *parts) -> str:
+        """步骤的缓存键：步骤名 + 输入哈希 + 参数（参数需要能转换为JSON）"""
+        payload = json.dumps([CACHE_VERSION, stage, parts], ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.blake2b(payload.encode('utf-8'), digest_size=16).hexdigest()
+
+    def lookup(self, stage: str, key: str) -> Optional[Dict]:
+        """键相同且所有输出文件都没有被改动时返回上次记录的结果（含 outputs 和附加信息），否则返回None"""
+        entry = self.manifest['stages'].get(stage)
+        if entry is None or entry['key'] != key:
+            return None
+        for output, signature in entry['outputs'].items():
+            if _output_signature(output) != signature:
+                return None
+        return entry
+
+    def store(self, stage: str, key: str, outputs=(), **info):
+        """记录步骤的结果；outputs 为输出文件，记录它们当前的签名"""
+        self.manifest['stages'][stage] = {
+            'key': key,
+            'outputs': {str(output): _output_signature(output) for output in outputs},
+            'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+            **info,
+        }
+
+    def record_run(self, stage: str, skipped: bool, seconds: float = 0.0, **info):
+        self.manifest['last_run'].append({
+            'stage': stage,
+            'status': 'skipped' if skipped else 'ran',
+            'seconds': round(seconds, 3),
+            **info,
+        })
+
+    def skipped_stages(self) -> List[str]:
+        return [item['stage'] for item in self.manifest['last_run'] if item['status'] == 'skipped']
+
+    def save(self):
+        # 缓存只是加速，写入失败（只读目录等）时忽略
+        try:
+            self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = self.manifest_path.with_name(f"{self.manifest_path.name}.{os.getpid()}.part")
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.manifest, f, ensure_ascii=False, indent=2)
+            os.replace(temp_path, self.manifest_path)
+        except OSError:
+            pass